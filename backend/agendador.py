@@ -0,0 +1,259 @@
+"""
+Agendador de pré-aquecimento das carteiras dos usuários ativos.
+
+Um único líder (entre workers do gunicorn e, no Postgres, entre máquinas)
+roda em loop: durante o pregão a cada AGENDADOR_INTERVALO segundos e, fora
+dele, uma vez logo após o fechamento e outra antes da abertura. Cada rodada:
+
+1. lista os usuários com sessão recente (tabela sessoes);
+2. busca de uma vez os preços da união dos tickers dessas carteiras
+   (obter_precos_batch guarda no cache_publico);
+3. para cada usuário grava os preços (atualizar_carteira_coordenado,
+   que reaproveita o batch) e recalcula carteira, insights e histórico nas
+   mesmas chaves de cache usadas pelas rotas, com TTL até a próxima rodada;
+4. na rodada após o fechamento, completa os snapshots diários que faltam
+   (historico_carteira) e grava o do dia com os preços recém-atualizados.
+
+Eleição de líder: pg_try_advisory_lock numa conexão dedicada quando há
+Postgres (os demais workers mantêm a sua aberta para as novas tentativas);
+senão fcntl.flock num arquivo de lock (vale para os workers de uma máquina).
+Com o SimpleCache padrão o aquecimento só vale para o processo líder; use
+CACHE_TYPE=FileSystemCache/RedisCache para compartilhar.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem eleição, roda no processo que iniciar
+    fcntl = None
+
+try:
+    from . import models
+    from . import snapshots
+    from .optimizations import b3_aberta, ttl_mercado, _agora_b3, B3_ABERTURA, B3_FECHAMENTO
+except ImportError:
+    import models
+    import snapshots
+    from optimizations import b3_aberta, ttl_mercado, _agora_b3, B3_ABERTURA, B3_FECHAMENTO
+
+AGENDADOR_INTERVALO = int(os.getenv('AGENDADOR_INTERVALO', '900'))
+# Usuário com sessão expirada há menos que isso conta como ativo
+AGENDADOR_JANELA = int(os.getenv('AGENDADOR_JANELA_DIAS', '3')) * 86400
+AGENDADOR_LOCK = os.getenv('AGENDADOR_LOCK') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'bancos_usuarios', '_agendador.lock'
+)
+# Rodadas fora do pregão: 5 min após o fechamento e 30 min antes da abertura
+_APOS_FECHAMENTO = timedelta(minutes=5)
+_ANTES_ABERTURA = timedelta(minutes=30)
+_PG_LOCK_ID = 7301862
+
+# Rotas aquecidas: (endpoint, query string, chave de cache que a rota grava)
+_ROTAS = (
+    ('api_get_carteira', '', 'carteira:{usuario}'),
+    ('api_carteira_insights', '', 'carteira_insights:{usuario}'),
+    ('api_get_historico_carteira', 'periodo=mensal', 'carteira_historico:{usuario}:mensal'),
+)
+
+
+# ==================== ELEIÇÃO DE LÍDER ====================
+
+class _Lider:
+    def __init__(self):
+        self._recurso = None
+        # Postgres: conexão de quem ainda não é líder, reaproveitada a cada tentativa
+        self._candidata = None
+
+    def tentar(self):
+        """True se este processo é (ou acabou de virar) o líder"""
+        if self._recurso is not None:
+            if models._is_postgres():
+                try:
+                    with self._recurso.cursor() as cur:
+                        cur.execute("SELECT 1")
+                except Exception:
+                    # conexão caiu: o lock foi junto
+                    self._recurso = None
+                    return False
+            return True
+        if models._is_postgres():
+            conn = self._candidata or models._get_pg_conn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_try_advisory_lock(%s)", (_PG_LOCK_ID,))
+                    obteve = cur.fetchone()[0]
+            except Exception:
+                # conexão caiu: a próxima tentativa abre outra
+                self._candidata = None
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                return False
+            if obteve:
+                self._recurso = conn
+                self._candidata = None
+                return True
+            # mantém a conexão aberta: tentar de novo não custa um connect por minuto
+            self._candidata = conn
+            return False
+        if fcntl is None:
+            self._recurso = True
+            return True
+        os.makedirs(os.path.dirname(AGENDADOR_LOCK), exist_ok=True)
+        arquivo = open(AGENDADOR_LOCK, 'a')
+        try:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            arquivo.close()
+            return False
+        # o lock vive enquanto o arquivo estiver aberto (morre junto com o processo)
+        self._recurso = arquivo
+        return True
+
+
+# ==================== AGENDA ====================
+
+def ultimo_marco(agora=None):
+    """Último horário de rodada fora do pregão (pré-abertura ou pós-fechamento) <= agora"""
+    agora = agora or _agora_b3()
+    candidatos = []
+    for dias in range(0, 5):
+        dia = (agora - timedelta(days=dias)).date()
+        if dia.weekday() >= 5:
+            continue
+        abertura = datetime(dia.year, dia.month, dia.day, *B3_ABERTURA, tzinfo=agora.tzinfo)
+        fechamento = datetime(dia.year, dia.month, dia.day, *B3_FECHAMENTO, tzinfo=agora.tzinfo)
+        candidatos += [abertura - _ANTES_ABERTURA, fechamento + _APOS_FECHAMENTO]
+    passados = [c for c in candidatos if c <= agora]
+    return max(passados) if passados else None
+
+
+def precisa_rodar(ultima_execucao, agora=None):
+    agora = agora or _agora_b3()
+    if ultima_execucao is None:
+        return True
+    if b3_aberta(agora):
+        return (agora - ultima_execucao).total_seconds() >= AGENDADOR_INTERVALO
+    marco = ultimo_marco(agora)
+    return marco is not None and ultima_execucao < marco
+
+
+# ==================== RODADA ====================
+
+def usuarios_ativos():
+    limite = int(time.time()) - AGENDADOR_JANELA
+    if models._is_postgres():
+        conn = models._get_pg_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT username FROM public.sessoes WHERE expira_em > %s", (limite,))
+                return [r[0] for r in cur.fetchall()]
+        finally:
+            conn.close()
+    import sqlite3
+    conn = sqlite3.connect(models.USUARIOS_DB_PATH)
+    try:
+        return [r[0] for r in conn.execute("SELECT DISTINCT username FROM sessoes WHERE expira_em > ?", (limite,))]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+
+def _tickers_usuario(usuario):
+    with models.usuario_contexto(usuario):
+        carteira = models.obter_carteira(campos=['ticker', 'tipo'])
+    if not isinstance(carteira, list):
+        return []
+    return [a['ticker'] for a in carteira if a.get('ticker') and a.get('tipo') != 'Renda Fixa']
+
+
+def _aquecer_usuario(app, usuario, ttl):
+    with models.usuario_contexto(usuario):
+        # janela=0: sempre atualiza, mas se junta a um refresh do usuário em andamento
+        models.atualizar_carteira_coordenado(janela=0)
+        for endpoint, query, chave in _ROTAS:
+            chave = chave.format(usuario=usuario)
+            models.cache.delete(chave)
+            view = app.view_functions.get(endpoint)
+            if view is None:
+                continue
+            with app.test_request_context(f"/?{query}"):
+                view()
+            valor = models.cache.get(chave)
+            if valor is not None:
+                # a rota grava com TTL curto; o agendador garante até a próxima rodada
+                models.cache.set(chave, valor, timeout=ttl)
+
+
+def apos_fechamento(agora=None):
+    """True em dia útil depois do fechamento do pregão"""
+    agora = agora or _agora_b3()
+    return agora.weekday() < 5 and (agora.hour, agora.minute) >= B3_FECHAMENTO
+
+
+def _snapshot_usuario(usuario):
+    if snapshots.reconstruir(usuario) is None:
+        print(f"Agendador: snapshots de {usuario} incompletos (base de preços)")
+    snapshots.gravar_snapshot_hoje(usuario)
+
+
+def rodar(app):
+    """Uma rodada completa de pré-aquecimento"""
+    inicio = time.time()
+    usuarios = usuarios_ativos()
+    if not usuarios:
+        return {'usuarios': 0, 'tickers': 0}
+    with app.app_context():
+        tickers = set()
+        for usuario in usuarios:
+            try:
+                tickers.update(_tickers_usuario(usuario))
+            except Exception as e:
+                print(f"Agendador: erro ao ler carteira de {usuario}: {e}")
+        if tickers:
+            models.obter_precos_batch(sorted(tickers), ttl=AGENDADOR_INTERVALO)
+        # até a próxima rodada: intervalo + folga no pregão, até a abertura fora dele
+        ttl = ttl_mercado(AGENDADOR_INTERVALO + 300, ttl_fechado_max=18 * 3600)
+        fechamento = apos_fechamento()
+        for usuario in usuarios:
+            try:
+                _aquecer_usuario(app, usuario, ttl)
+            except Exception as e:
+                print(f"Agendador: erro ao aquecer {usuario}: {e}")
+            if fechamento:
+                try:
+                    _snapshot_usuario(usuario)
+                except Exception as e:
+                    print(f"Agendador: erro no snapshot de {usuario}: {e}")
+    print(f"Agendador: {len(usuarios)} usuários e {len(tickers)} tickers em {time.time() - inicio:.1f}s")
+    return {'usuarios': len(usuarios), 'tickers': len(tickers)}
+
+
+def _loop(app):
+    lider = _Lider()
+    ultima_execucao = None
+    while True:
+        try:
+            if lider.tentar() and precisa_rodar(ultima_execucao):
+                ultima_execucao = _agora_b3()
+                rodar(app)
+        except Exception as e:
+            print(f"Agendador: erro na rodada: {e}")
+        time.sleep(60)
+
+
+_iniciado = False
+
+
+def iniciar_agendador(app):
+    """Inicia a thread do agendador (uma por processo; só o líder executa)"""
+    global _iniciado
+    if _iniciado:
+        return
+    _iniciado = True
+    threading.Thread(target=_loop, args=(app,), name='agendador', daemon=True).start()
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, make_response, send_from_directory, send_file
+from flask import Flask, jsonify, request, make_response, send_file, g, stream_with_context, redirect
 from flask_cors import CORS
 import pandas as pd
 import yfinance as yf
@@ -6,12 +6,15 @@ from datetime import datetime, timedelta
 import json
 import sys
 import os
+import time
+import hmac
+from concurrent.futures import ThreadPoolExecutor, wait
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models import (
     global_state, carregar_ativos, obter_carteira, adicionar_ativo_carteira, 
     remover_ativo_carteira, atualizar_ativo_carteira, obter_movimentacoes, obter_historico_carteira,
-
+    iterar_movimentacoes, listar_paginado, usuario_contexto, evolucao_financeira_diaria, CAMPOS_CARTEIRA,
     salvar_receita, carregar_receitas_mes_ano, atualizar_receita, remover_receita,
     adicionar_cartao, atualizar_cartao, remover_cartao, 
     adicionar_outro_gasto, carregar_outros_mes_ano, atualizar_outro_gasto, remover_outro_gasto, 
@@ -38,8 +41,11 @@ from models import (
     create_asset_type,
     rename_asset_type,
     delete_asset_type,
-    atualizar_precos_indicadores_carteira,
+    atualizar_carteira_coordenado,
+    obter_linha_tempo_posicoes,
+    invalidar_refresh_carteira,
     obter_taxas_indexadores,
+    sgs_futuro,
     _upgrade_controle_schema,
     LISTA_ACOES,
     LISTA_FIIS,
@@ -55,12 +61,10 @@ from models import (
     compute_goals_projection,
     obter_preco_historico,
     obter_preco_atual,
-    simular_choques_indexadores,
     obter_cenarios_predefinidos,
-    executar_monte_carlo,
 )
 from fii_scraper import obter_metadata_fii
-from models import cache
+from models import cache, cache_publico
 import requests
 try:
     import cloudscraper # type: ignore
@@ -69,11 +73,12 @@ except Exception:
 
 FRONTEND_DIST = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'dist'))
 
-server = Flask(
-    __name__,
-    static_folder=FRONTEND_DIST,
-    static_url_path=''
-)
+# Sem static_folder: o dist é servido por serve_frontend a partir do manifesto em memória
+server = Flask(__name__, static_folder=None)
+
+from json_provider import FastJSONProvider
+server.json_provider_class = FastJSONProvider
+server.json = FastJSONProvider(server)
 
 
 try:
@@ -92,10 +97,109 @@ except Exception:
 
 try:
     cache.init_app(server)
+    cache_publico.init_app(server)
 except Exception:
     pass
 
 
+def _publico(chave, ttl_aberto, produzir, ttl_fechado_max=6 * 3600):
+    """Get-or-set no cache público de dados de mercado (chave sem usuário)
+
+    `produzir` retornando None não é guardado (erro/sem dados tenta de novo).
+    """
+    valor = cache_publico.get(chave)
+    if valor is None:
+        valor = produzir()
+        if valor is not None:
+            cache_publico.set(chave, valor, timeout=ttl_mercado(ttl_aberto, ttl_fechado_max))
+    return valor
+
+
+# ==================== MÉTRICAS ====================
+
+from optimizations import performance_monitor, instrument_cache, instrument_http_session
+from optimizations import historico_colunar, historico_registros, ttl_mercado
+import ticker_search
+import jobs
+import async_http
+from simulacao import (executar_monte_carlo, params_monte_carlo, eventos_monte_carlo,
+                       simular_choques_indexadores, avaliar_cenarios, CHOQUES_HORIZONTE_MESES,
+                       chave_resultado, resultado_em_cache, com_cache)
+from cotacoes_stream import atualizador as atualizador_cotacoes, eventos_carteira
+from rebalanceamento import sugerir_rebalanceamento
+from agendador import iniciar_agendador
+from static_assets import ManifestoEstatico
+import logos_cache
+from complete_b3_logos_mapping import get_logo_url, LOGOS_POR_TICKER, LOGOS_CRYPTO, LOGOS_VERSAO
+from relatorios import solicitar_relatorio, status_relatorio, arquivo_relatorio, marcar_dados_alterados, NOMES_ARQUIVO
+
+try:
+    instrument_cache(cache, performance_monitor)
+    instrument_cache(cache_publico, performance_monitor)
+    instrument_http_session(requests.Session, performance_monitor)
+    try:
+        from curl_cffi import requests as _curl_requests  # sessão HTTP usada pelo yfinance
+        instrument_http_session(_curl_requests.Session, performance_monitor)
+    except Exception:
+        pass
+except Exception as e:
+    print(f"WARN: falha ao instrumentar métricas: {e}")
+
+
+@server.before_request
+def _metrics_inicio_request():
+    g._metrics_inicio = time.perf_counter()
+
+
+@server.after_request
+def _metrics_fim_request(response):
+    try:
+        inicio = getattr(g, '_metrics_inicio', None)
+        if inicio is not None:
+            rota = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+            performance_monitor.log_request(rota, request.method, response.status_code, time.perf_counter() - inicio)
+    except Exception:
+        pass
+    return response
+
+
+# Escritas na carteira: além da versão dos dados, o próximo refresh não pode reaproveitar o anterior
+_ENDPOINTS_ESCRITA_CARTEIRA = frozenset({
+    'api_adicionar_ativo', 'api_atualizar_ativo', 'api_remover_ativo', 'api_migrar_precos_compra',
+    'api_asset_types',
+})
+# Rotas que escrevem dados do usuário: mudam a versão e invalidam os PDFs em cache. POSTs só de
+# cálculo ou leitura (simulador, projeções, jobs, start_load, refresh de preços) ficam de fora;
+# o refresh de preços tem marcador próprio (relatorios.marcar_precos_atualizados)
+_ENDPOINTS_ESCRITA = _ENDPOINTS_ESCRITA_CARTEIRA | {
+    'api_rebalance_config', 'api_rebalance_history', 'api_goals', 'api_rf_catalog',
+    'api_receitas', 'api_outros', 'api_cartoes', 'api_cartoes_cadastrados', 'api_compras_cartao',
+    'api_marcar_cartao_pago', 'api_desmarcar_cartao_pago',
+    'api_adicionar_marmita', 'api_atualizar_marmita', 'api_remover_marmita',
+}
+
+
+@server.after_request
+def _invalidar_relatorios(response):
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400 \
+            and request.endpoint in _ENDPOINTS_ESCRITA:
+        usuario = getattr(g, '_usuario_atual_cached', None)
+        if usuario:
+            marcar_dados_alterados(usuario)
+            if request.endpoint in _ENDPOINTS_ESCRITA_CARTEIRA:
+                invalidar_refresh_carteira(usuario)
+    return response
+
+
+def _metrics_autorizado():
+    """Só com METRICS_TOKEN configurado e enviado em `Authorization: Bearer`"""
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return False
+    auth = request.headers.get('Authorization') or ''
+    return auth.startswith('Bearer ') and hmac.compare_digest(auth[len('Bearer '):].strip(), token)
+
+
 try:
     FRONTEND_ORIGIN = os.getenv('FRONTEND_ORIGIN')
     allowed_origins = set()
@@ -470,38 +574,11 @@ def api_analise_ativos():
         tipo = data.get('tipo', 'acoes')  
         filtros = data.get('filtros', {})
         
-        from models import (
-            processar_ativos_acoes_com_filtros,
-            processar_ativos_bdrs_com_filtros,
-            processar_ativos_fiis_com_filtros
-        )
-        
-        if tipo == 'acoes':
-            dados = processar_ativos_acoes_com_filtros(
-                filtros.get('roe_min', 0),
-                filtros.get('dy_min', 0),
-                filtros.get('pl_min', 0),
-                filtros.get('pl_max', float('inf')),
-                filtros.get('pvp_max', float('inf'))
-            )
-        elif tipo == 'bdrs':
-            dados = processar_ativos_bdrs_com_filtros(
-                filtros.get('roe_min', 0),
-                filtros.get('dy_min', 0),
-                filtros.get('pl_min', 0),
-                filtros.get('pl_max', float('inf')),
-                filtros.get('pvp_max', float('inf'))
-            )
-        elif tipo == 'fiis':
-            dados = processar_ativos_fiis_com_filtros(
-                filtros.get('dy_min', 0),
-                filtros.get('dy_max', float('inf')),
-                filtros.get('liq_min', 0),
-                filtros.get('tipo_fii'),
-                filtros.get('segmento_fii')
-            )
-        else:
+        from models import filtrar_ativos
+
+        if tipo not in ('acoes', 'bdrs', 'fiis'):
             return jsonify({"error": "Tipo inválido"}), 400
+        dados = filtrar_ativos(tipo, filtros)
             
         return jsonify(dados)
     except Exception as e:
@@ -620,13 +697,19 @@ def api_analise_resumo():
 
 @server.route("/api/start_load", methods=["POST"])
 def api_iniciar():
-    carregar_ativos()
-    return jsonify({"status": "Carregamento iniciado"}), 202
+    try:
+        usuario = get_usuario_atual()
+        if not usuario:
+            return jsonify({"error": "Não autenticado"}), 401
+        job = jobs.submeter(server, usuario, 'carregar_ativos')
+        return _resposta_job(dict(job, status_carregamento="Carregamento iniciado"))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @server.route("/api/get_data", methods=["GET"])
 def api_get_data():
     df = global_state.get("df_ativos")
-    return jsonify(df.to_dict("records") if isinstance(df, pd.DataFrame) else [])
+    return jsonify(df if isinstance(df, pd.DataFrame) else [])
 
 @server.route("/api/ativo/<ticker>", methods=["GET"])
 def api_get_ativo_details(ticker):
@@ -635,28 +718,23 @@ def api_get_ativo_details(ticker):
         
         if '-' not in ticker and '.' not in ticker and len(ticker) <= 6:
             ticker += '.SA'
+
+        points = request.args.get('points', type=int)
+        formato = request.args.get('formato')
+        chave_publica = f"ativo:{ticker}:{formato or ''}:{points or ''}"
+        cached = cache_publico.get(chave_publica)
+        if cached is not None:
+            return jsonify(cached)
         
         acao = yf.Ticker(ticker)
         info = acao.info or {}
         historico = acao.history(period="max")
         dividends = acao.dividends if hasattr(acao, 'dividends') else None
         
-        def convert_timestamps(obj):
-            if isinstance(obj, dict):
-                return {k: convert_timestamps(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_timestamps(item) for item in obj]
-            elif hasattr(obj, 'isoformat'): 
-                return obj.isoformat()
-            else:
-                return obj
-        
-        historico_json = []
-        if historico is not None and not historico.empty:
-            for index, row in historico.iterrows():
-                row_dict = row.to_dict()
-                row_dict['Date'] = index.isoformat()
-                historico_json.append(row_dict)
+        if formato == 'colunar':
+            historico_json = historico_colunar(historico, points=points)
+        else:
+            historico_json = historico_registros(historico, points=points)
         
         dividends_json = {}
         if dividends is not None and not dividends.empty:
@@ -740,6 +818,9 @@ def api_get_ativo_details(ticker):
             "dividends": dividends_json,
             "fii": fii_extra
         }
+        # formato colunar vazio ({'date': []}) é truthy: decide pelo DataFrame
+        if info or (historico is not None and not historico.empty):
+            cache_publico.set(chave_publica, dados, timeout=ttl_mercado(300))
         
         return jsonify(dados)
     except Exception as e:
@@ -778,6 +859,13 @@ def api_get_ativo_historico(ticker):
         ticker = ticker.strip().upper()
         if '-' not in ticker and '.' not in ticker and len(ticker) <= 6:
             ticker += '.SA'
+
+        points = request.args.get('points', type=int)
+        formato = request.args.get('formato')
+        chave_publica = f"historico:{ticker}:{periodo}:{formato or ''}:{points or ''}"
+        cached = cache_publico.get(chave_publica)
+        if cached is not None:
+            return jsonify(cached)
         
         acao = yf.Ticker(ticker)
         historico = acao.history(period=periodo)
@@ -794,12 +882,12 @@ def api_get_ativo_historico(ticker):
             
             historico = historico[historico.index >= dt_ini]
         
-        historico_json = []
+        if formato == 'colunar':
+            historico_json = historico_colunar(historico, points=points)
+        else:
+            historico_json = historico_registros(historico, points=points)
         if historico is not None and not historico.empty:
-            for index, row in historico.iterrows():
-                row_dict = row.to_dict()
-                row_dict['Date'] = index.isoformat()
-                historico_json.append(row_dict)
+            cache_publico.set(chave_publica, historico_json, timeout=ttl_mercado(900))
         
         return jsonify(historico_json)
     except Exception as e:
@@ -861,20 +949,26 @@ def api_comparar_ativos():
                 else:
                     ticker_yf = ticker
                 
-                acao = yf.Ticker(ticker_yf)
-                info = acao.info or {}
-                
-                resultados.append({
-                    "ticker": ticker,
-                    "nome": info.get('longName', '-'),
-                    "preco_atual": info.get('currentPrice') or info.get('regularMarketPrice') or info.get('previousClose'),
-                    "pl": info.get('trailingPE'),
-                    "pvp": info.get('priceToBook'),
-                    "dy": info.get('dividendYield'),
-                    "roe": info.get('returnOnEquity'),
-                    "setor": info.get('sector', '-'),
-                    "pais": info.get('country', '-'),
-                })
+                def _indicadores():
+                    info = yf.Ticker(ticker_yf).info or {}
+                    if not info.get('longName') and not (info.get('currentPrice') or info.get('regularMarketPrice') or info.get('previousClose')):
+                        return None  # info vazio (falha/limite do yfinance): não cacheia os '-'
+                    return {
+                        "ticker": ticker,
+                        "nome": info.get('longName', '-'),
+                        "preco_atual": info.get('currentPrice') or info.get('regularMarketPrice') or info.get('previousClose'),
+                        "pl": info.get('trailingPE'),
+                        "pvp": info.get('priceToBook'),
+                        "dy": info.get('dividendYield'),
+                        "roe": info.get('returnOnEquity'),
+                        "setor": info.get('sector', '-'),
+                        "pais": info.get('country', '-'),
+                    }
+
+                indicadores = _publico(f"comparar:{ticker_yf}", 300, _indicadores)
+                if indicadores is None:
+                    raise ValueError("dados indisponíveis")
+                resultados.append(dict(indicadores, ticker=ticker))
             except Exception as e:
                 resultados.append({
                     "ticker": ticker,
@@ -916,11 +1010,42 @@ def api_get_ticker_sugestoes():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@server.route("/api/tickers/search", methods=["GET"])
+def api_buscar_tickers():
+    """Autocomplete de tickers pelo índice em memória; posições do usuário primeiro"""
+    try:
+        q = (request.args.get('q') or '').strip()
+        if not q:
+            return jsonify([])
+        try:
+            limite = max(1, min(int(request.args.get('limit', 10)), 50))
+        except ValueError:
+            return jsonify({"error": "limit inválido"}), 400
+        carteira = []
+        usuario = get_usuario_atual()
+        if usuario:
+            # autocomplete dispara a cada tecla: reaproveita o cache de /api/carteira;
+            # sem ele, só as colunas usadas na busca (sem preços nem scraping de FII)
+            posicoes = cache.get(f"carteira:{usuario}") if cache else None
+            if posicoes is None:
+                posicoes = obter_carteira(campos=['ticker', 'nome_completo', 'tipo'])
+            if isinstance(posicoes, list):
+                carteira = posicoes
+        return jsonify(ticker_search.buscar(q, limite=limite, carteira=carteira))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _url_logo(ticker):
+    """URL pública da logo: o proxy local quando LOGOS_PROXY está ligado"""
+    url = get_logo_url(ticker)
+    if url and logos_cache.LOGOS_PROXY:
+        return f"/api/logos/img/{ticker.upper()}?v={LOGOS_VERSAO}"
+    return url
+
 @server.route("/api/logo/<ticker>", methods=["GET"])
 def api_get_logo_url(ticker):
     try:
-        from complete_b3_logos_mapping import get_logo_url
-        logo_url = get_logo_url(ticker)
+        logo_url = _url_logo(ticker)
         return jsonify({"logo_url": logo_url})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -932,19 +1057,81 @@ def api_get_logos_batch():
         tickers = data.get('tickers') or []
         if not isinstance(tickers, list):
             return jsonify({"error": "tickers deve ser lista"}), 400
-        from complete_b3_logos_mapping import get_logo_url
         out = {}
         for t in tickers[:500]:
             try:
-                out[t] = get_logo_url(str(t))
+                out[t] = _url_logo(str(t))
             except Exception:
                 out[t] = None
         return jsonify({"logos": out})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@server.route("/api/logos/manifest", methods=["GET"])
+def api_logos_manifest():
+    """Mapeamento completo ticker -> logo numa resposta só, versionado por ETag"""
+    try:
+        etag = f"{LOGOS_VERSAO}-{int(logos_cache.LOGOS_PROXY)}"
+        if request.if_none_match.contains(etag):
+            resp = make_response('', 304)
+        else:
+            if logos_cache.LOGOS_PROXY:
+                logos = {t: f"/api/logos/img/{t.upper()}?v={LOGOS_VERSAO}" for t in LOGOS_POR_TICKER}
+                crypto = {s: f"/api/logos/img/{s.upper()}-USD?v={LOGOS_VERSAO}" for s in LOGOS_CRYPTO}
+            else:
+                logos, crypto = LOGOS_POR_TICKER, LOGOS_CRYPTO
+            resp = jsonify({"versao": LOGOS_VERSAO, "logos": logos, "crypto": crypto})
+        resp.set_etag(etag)
+        # o cliente não conhece a versão antes de baixar: revalida pelo ETag após 1 dia
+        resp.headers['Cache-Control'] = 'public, max-age=86400'
+        return resp
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@server.route("/api/logos/img/<ticker>", methods=["GET"])
+def api_logo_imagem(ticker):
+    """Imagem da logo servida do volume local (baixada do img.logo.dev uma vez)"""
+    try:
+        url = get_logo_url(ticker)
+        if not url:
+            return jsonify({"error": "Logo não encontrada"}), 404
+        if not logos_cache.LOGOS_PROXY:
+            return redirect(url, code=302)
+        encontrado = logos_cache.obter_logo(ticker, url)
+        if not encontrado:
+            return redirect(url, code=302)
+        caminho, meta = encontrado
+        resp = send_file(caminho, mimetype=meta.get('content_type') or 'image/png', etag=meta['etag'],
+                         conditional=True, max_age=7 * 86400)
+        resp.headers['Cache-Control'] = 'public, max-age=604800, stale-while-revalidate=86400'
+        return resp
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ==================== MÉTRICAS ====================
+
+@server.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    if not _metrics_autorizado():
+        return jsonify({"error": "Não autorizado"}), 401
+    resp = make_response(performance_monitor.render_prometheus())
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@server.route("/api/metrics/json", methods=["GET"])
+def api_metrics_json():
+    if not _metrics_autorizado():
+        return jsonify({"error": "Não autorizado"}), 401
+    try:
+        return jsonify(performance_monitor.get_performance_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # ==================== SERVE FRONTEND (SPA) ====================
 
+manifesto_estatico = ManifestoEstatico(FRONTEND_DIST)
+
 @server.route('/', defaults={'path': ''})
 @server.route('/<path:path>')
 def serve_frontend(path):
@@ -952,18 +1139,11 @@ def serve_frontend(path):
     if path.startswith('api/'):
         return jsonify({"error": "Not Found"}), 404
 
- 
-    requested_path = os.path.join(server.static_folder, path) if path else None
-    if path and os.path.exists(requested_path):
-        return send_from_directory(server.static_folder, path)
-    
-    if path in ('sw.js', 'manifest.webmanifest', 'icons/icon-192.png', 'icons/icon-512.png'):
-        return send_from_directory(server.static_folder, path)
-
-
-    index_path = os.path.join(server.static_folder, 'index.html')
-    if os.path.exists(index_path):
-        return send_from_directory(server.static_folder, 'index.html')
+    arquivo = manifesto_estatico.resolver(path)
+    if arquivo is not None:
+        return manifesto_estatico.responder(arquivo, request)
+    if path.startswith('assets/'):
+        return jsonify({"error": "Not Found"}), 404
     return jsonify({"message": "Frontend não construído. Rode npm run build em frontend/"}), 200
 
 # ==================== APIs DE CARTEIRA ====================
@@ -979,25 +1159,41 @@ def api_get_carteira():
        
         if refresh:
             try:
-                atualizar_precos_indicadores_carteira()
-                if usuario_atual and cache:
+                resultado = atualizar_carteira_coordenado(forcar=True)
+                if usuario_atual and cache and not resultado.get('recente'):
                     cache.delete(f"carteira:{usuario_atual}")
                     cache.delete(f"carteira_insights:{usuario_atual}")
             except Exception as _:
                 pass
 
+        try:
+            campos = _campos_pedidos()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        compacto = _modo_compacto()
+
+        def _formatar(carteira):
+            if not isinstance(carteira, list):
+                return carteira
+            if campos:
+                carteira = [{c: a.get(c) for c in campos} for a in carteira]
+            return _compactar(carteira, campos) if compacto else carteira
+
         cache_key = f"carteira:{usuario_atual}" if (usuario_atual and not refresh) else None
         if cache_key and cache:
             cached = cache.get(cache_key)
             if cached is not None:
-                return jsonify(cached)
+                return jsonify(_formatar(cached))
+        if campos:
+            # só as colunas pedidas saem do banco; não passa pelo cache da carteira completa
+            return jsonify(_formatar(obter_carteira(campos=campos)))
         carteira = obter_carteira()
         if cache_key and cache:
             try:
                 cache.set(cache_key, carteira, timeout=600)  # 10 minutos
             except Exception:
                 pass
-        return jsonify(carteira)
+        return jsonify(_formatar(carteira))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1028,13 +1224,13 @@ def api_migrar_precos_compra():
 def api_refresh_carteira():
     try:
         print("DEBUG: Iniciando refresh da carteira...")
-        result = atualizar_precos_indicadores_carteira()
+        result = atualizar_carteira_coordenado(forcar=True)
         print(f"DEBUG: Resultado do refresh: {result}")
         
         
         try:
             usuario_atual = get_usuario_atual()
-            if usuario_atual and cache:
+            if usuario_atual and cache and not result.get('recente'):
                 cache.delete(f"carteira:{usuario_atual}")
                 cache.delete(f"carteira_insights:{usuario_atual}")
         except Exception:
@@ -1052,12 +1248,12 @@ def api_refresh_indexadores():
   
     try:
         print("DEBUG: Iniciando refresh específico de indexadores...")
-        result = atualizar_precos_indicadores_carteira()
+        result = atualizar_carteira_coordenado()
         print(f"DEBUG: Resultado do refresh de indexadores: {result}")
  
         try:
             usuario_atual = get_usuario_atual()
-            if usuario_atual and cache:
+            if usuario_atual and cache and not result.get('recente'):
                 cache.delete(f"carteira:{usuario_atual}")
                 cache.delete(f"carteira_insights:{usuario_atual}")
         except Exception:
@@ -1070,6 +1266,45 @@ def api_refresh_indexadores():
         print(f"DEBUG: Erro no refresh de indexadores: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@server.route("/api/carteira/stream", methods=["GET"])
+def api_carteira_stream():
+    """SSE: snapshot da carteira e depois deltas de preço/valor_total a cada atualização"""
+    try:
+        usuario = get_usuario_atual()
+        if not usuario:
+            return jsonify({"error": "Não autenticado"}), 401
+        carteira = obter_carteira(campos=['ticker', 'quantidade', 'preco_atual', 'valor_total', 'tipo'])
+        if not isinstance(carteira, list):
+            return jsonify({"error": "Erro ao obter carteira"}), 500
+        posicoes = {}
+        for ativo in carteira:
+            ticker = ativo.get('ticker')
+            if not ticker or ativo.get('tipo') == 'Renda Fixa':
+                continue
+            posicao = posicoes.setdefault(ticker, {'quantidade': 0.0, 'preco_atual': ativo.get('preco_atual'), 'valor_total': 0.0})
+            posicao['quantidade'] += float(ativo.get('quantidade') or 0)
+            posicao['valor_total'] = round(posicao['valor_total'] + float(ativo.get('valor_total') or 0), 2)
+
+        if atualizador_cotacoes.app is None:
+            atualizador_cotacoes.app = server
+        assinatura = atualizador_cotacoes.inscrever(posicoes)
+        if assinatura is None:
+            # sem thread livre para mais uma conexão longa: o cliente volta ao polling
+            resp = jsonify({"error": "Limite de conexões de stream atingido"})
+            resp.status_code = 503
+            resp.headers['Retry-After'] = '60'
+            return resp
+
+        resp = server.response_class(stream_with_context(eventos_carteira(assinatura, posicoes)), mimetype='text/event-stream')
+        # cliente que desconecta antes do primeiro chunk nunca inicia o gerador
+        # (o finally dele não roda): a resposta fechada libera a vaga
+        resp.call_on_close(lambda: atualizador_cotacoes.cancelar(assinatura))
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Accel-Buffering'] = 'no'
+        return resp
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @server.route("/api/carteira/insights", methods=["GET"])
 def api_carteira_insights():
     try:
@@ -1248,8 +1483,92 @@ def api_goals_projecao():
             return jsonify({"error": "Não autenticado"}), 401
         payload = request.get_json() or {}
         goal = payload or (get_goals() or {})
-        proj = compute_goals_projection(goal or {})
+        proj = com_cache('goals_projecao', goal or {}, lambda carteira: compute_goals_projection(goal or {}, carteira))
         return jsonify(proj)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ==================== JOBS EM BACKGROUND ====================
+
+def _resposta_job(job):
+    """202 + Location enquanto o job não terminou; 200 quando já terminou"""
+    job['status_url'] = f"/api/jobs/{job['id']}"
+    job['resultado_url'] = f"/api/jobs/{job['id']}/resultado"
+    resp = jsonify(job)
+    if job['status'] in jobs.ATIVOS:
+        resp.status_code = 202
+        resp.headers['Location'] = job['status_url']
+        resp.headers['Retry-After'] = '1'
+    return resp
+
+
+@server.route('/api/jobs', methods=['POST'])
+def api_submeter_job():
+    try:
+        usuario = get_usuario_atual()
+        if not usuario:
+            return jsonify({"error": "Não autenticado"}), 401
+        data = request.get_json() or {}
+        params = data.get('params') or {}
+        if not isinstance(params, dict):
+            return jsonify({"error": "params deve ser objeto"}), 400
+        try:
+            job = jobs.submeter(server, usuario, data.get('tipo'), params)
+        except ValueError as e:
+            return jsonify({"error": str(e), "tipos": jobs.tipos_registrados()}), 400
+        return _resposta_job(job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server.route('/api/jobs', methods=['GET'])
+def api_listar_jobs():
+    try:
+        usuario = get_usuario_atual()
+        if not usuario:
+            return jsonify({"error": "Não autenticado"}), 401
+        return jsonify(jobs.listar_jobs(usuario, min(request.args.get('limit', 20, type=int) or 20, 100)))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server.route('/api/jobs/<job_id>', methods=['GET'])
+def api_status_job(job_id):
+    try:
+        job = jobs.obter_job(get_usuario_atual(), job_id)
+        if job is None:
+            return jsonify({"error": "Job não encontrado"}), 404
+        return _resposta_job(job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server.route('/api/jobs/<job_id>/resultado', methods=['GET'])
+def api_resultado_job(job_id):
+    try:
+        job = jobs.obter_job(get_usuario_atual(), job_id, com_resultado=True)
+        if job is None:
+            return jsonify({"error": "Job não encontrado"}), 404
+        if job['status'] != 'concluido':
+            return jsonify({"error": "Job ainda não concluído", "status": job['status'], "erro": job.get('erro')}), 409
+        return jsonify(job.get('resultado'))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server.route('/api/jobs/<job_id>', methods=['DELETE'])
+def api_cancelar_job(job_id):
+    try:
+        usuario = get_usuario_atual()
+        if not usuario:
+            return jsonify({"error": "Não autenticado"}), 401
+        job = jobs.cancelar(usuario, job_id)
+        if job is None:
+            return jsonify({"error": "Job não encontrado"}), 404
+        return jsonify(job)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1271,41 +1590,30 @@ def export_movimentacoes_csv():
         if not usuario:
             return jsonify({"error": "Não autenticado"}), 401
         mes, ano, inicio, fim = _parse_periodo_args()
-        if inicio or fim:
-            movs = obter_movimentacoes() or []
-            def to_date(s):
-                from datetime import datetime
-                try:
-                    return datetime.strptime(s[:10], '%Y-%m-%d')
-                except Exception:
-                    return None
-            di = to_date(inicio) if inicio else None
-            df = to_date(fim) if fim else None
-            filtered = []
-            for m in movs:
-                dt = to_date(m.get('data') or '')
-                if dt is None:
-                    continue
-                if di and dt < di:
-                    continue
-                if df and dt > df:
-                    continue
-                filtered.append(m)
-            rows = filtered
-        else:
-            rows = obter_movimentacoes(mes, ano) or []
 
         import csv, io
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['data', 'ticker', 'nome', 'quantidade', 'preco', 'tipo'])
-        for r in rows:
-            writer.writerow([
-                r.get('data'), r.get('ticker'), r.get('nome_completo'), r.get('quantidade'), r.get('preco'), r.get('tipo')
-            ])
-        resp = make_response(output.getvalue())
+
+        def gerar():
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(['data', 'ticker', 'nome', 'quantidade', 'preco', 'tipo'])
+            yield output.getvalue()
+            output.seek(0); output.truncate(0)
+            pendentes = 0
+            for row in iterar_movimentacoes(usuario, mes, ano, inicio, fim):
+                writer.writerow(row)
+                pendentes += 1
+                if pendentes >= 500:
+                    yield output.getvalue()
+                    output.seek(0); output.truncate(0)
+                    pendentes = 0
+            if pendentes:
+                yield output.getvalue()
+
+        resp = server.response_class(stream_with_context(gerar()), mimetype='text/csv')
         resp.headers['Content-Type'] = 'text/csv; charset=utf-8'
         resp.headers['Content-Disposition'] = 'attachment; filename="movimentacoes.csv"'
+        resp.headers['Cache-Control'] = 'no-store'
         return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1359,115 +1667,84 @@ def export_rendimentos_csv():
         return jsonify({"error": str(e)}), 500
 
 
+def _relatorio_pdf(tipo, params):
+    """Serve o PDF se já estiver pronto; senão agenda a geração e responde 202"""
+    usuario = get_usuario_atual()
+    if not usuario:
+        return jsonify({"error": "Não autenticado"}), 401
+    status = solicitar_relatorio(server, usuario, tipo, params)
+    if status.get('status') == 'concluido':
+        return _baixar_relatorio(usuario, status['job_id'], tipo)
+    job_id = status['job_id']
+    status['status_url'] = f"/api/relatorios/jobs/{job_id}"
+    status['download_url'] = f"/api/relatorios/jobs/{job_id}/download"
+    resp = jsonify(status)
+    resp.status_code = 202
+    resp.headers['Location'] = status['status_url']
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+
+def _baixar_relatorio(usuario, job_id, tipo=None):
+    caminho = arquivo_relatorio(usuario, job_id)
+    if not caminho:
+        return jsonify({"error": "Relatório não encontrado"}), 404
+    if tipo is None:
+        tipo = (status_relatorio(usuario, job_id) or {}).get('tipo')
+    resp = send_file(caminho, as_attachment=True, download_name=NOMES_ARQUIVO.get(tipo, 'relatorio.pdf'),
+                     mimetype='application/pdf', max_age=0)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
 @server.route('/api/relatorios/movimentacoes.pdf', methods=['GET'])
 def export_movimentacoes_pdf():
     try:
-        usuario = get_usuario_atual()
-        if not usuario:
-            return jsonify({"error": "Não autenticado"}), 401
         mes, ano, inicio, fim = _parse_periodo_args()
-        if inicio or fim:
-            rows = obter_movimentacoes() or []
-        else:
-            rows = obter_movimentacoes(mes, ano) or []
-        try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.pdfgen import canvas
-            from io import BytesIO
-        except Exception:
-            return jsonify({"error": "PDF indisponível no momento (dependência ausente)"}), 500
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        y = height - 40
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(40, y, "Relatório de Movimentações")
-        y -= 20
-        c.setFont("Helvetica", 9)
-        for r in rows:
-            if y < 40:
-                c.showPage(); y = height - 40; c.setFont("Helvetica", 9)
-            line = f"{r.get('data','')}  {r.get('ticker',''):8}  {r.get('tipo',''):7}  qtd={r.get('quantidade','')}  preco={r.get('preco','')}"
-            c.drawString(40, y, line)
-            y -= 14
-        c.showPage()
-        c.save()
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name='movimentacoes.pdf', mimetype='application/pdf')
+        return _relatorio_pdf('movimentacoes', {'mes': mes, 'ano': ano, 'inicio': inicio, 'fim': fim})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @server.route('/api/relatorios/posicoes.pdf', methods=['GET'])
 def export_posicoes_pdf():
+    try:
+        return _relatorio_pdf('posicoes', {})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server.route('/api/relatorios/rendimentos.pdf', methods=['GET'])
+def export_rendimentos_pdf():
+    try:
+        return _relatorio_pdf('rendimentos', {'periodo': request.args.get('periodo', 'mensal') or 'mensal'})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server.route('/api/relatorios/jobs/<job_id>', methods=['GET'])
+def api_relatorio_status(job_id):
     try:
         usuario = get_usuario_atual()
         if not usuario:
             return jsonify({"error": "Não autenticado"}), 401
-        itens = obter_carteira() or []
-        try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.pdfgen import canvas
-            from io import BytesIO
-        except Exception:
-            return jsonify({"error": "PDF indisponível no momento (dependência ausente)"}), 500
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        y = height - 40
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(40, y, "Relatório de Posições")
-        y -= 20
-        c.setFont("Helvetica", 9)
-        for it in itens:
-            if y < 40:
-                c.showPage(); y = height - 40; c.setFont("Helvetica", 9)
-            line = f"{it.get('ticker',''):8}  {it.get('nome_completo','')[:40]}  qtd={it.get('quantidade','')}  val={it.get('valor_total','')}"
-            c.drawString(40, y, line)
-            y -= 14
-        c.showPage()
-        c.save()
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name='posicoes.pdf', mimetype='application/pdf')
+        status = status_relatorio(usuario, job_id)
+        if status is None:
+            return jsonify({"error": "Relatório não encontrado"}), 404
+        if status.get('status') == 'concluido':
+            status['download_url'] = f"/api/relatorios/jobs/{job_id}/download"
+        return jsonify(status)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@server.route('/api/relatorios/rendimentos.pdf', methods=['GET'])
-def export_rendimentos_pdf():
+@server.route('/api/relatorios/jobs/<job_id>/download', methods=['GET'])
+def api_relatorio_download(job_id):
     try:
         usuario = get_usuario_atual()
         if not usuario:
             return jsonify({"error": "Não autenticado"}), 401
-        periodo = request.args.get('periodo', 'mensal')
-        hist = obter_historico_carteira_comparado(periodo or 'mensal') or {}
-        datas = hist.get('datas') or []
-        carteira = hist.get('carteira_valor') or []
-        try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.pdfgen import canvas
-            from io import BytesIO
-        except Exception:
-            return jsonify({"error": "PDF indisponível no momento (dependência ausente)"}), 500
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        y = height - 40
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(40, y, "Relatório de Rendimentos")
-        y -= 20
-        c.setFont("Helvetica", 9)
-        for i, d in enumerate(datas):
-            if y < 40:
-                c.showPage(); y = height - 40; c.setFont("Helvetica", 9)
-            val = carteira[i] if i < len(carteira) else None
-            line = f"{d}: {val}"
-            c.drawString(40, y, line)
-            y -= 14
-        c.showPage()
-        c.save()
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name='rendimentos.pdf', mimetype='application/pdf')
+        return _baixar_relatorio(usuario, job_id)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1602,12 +1879,39 @@ def api_atualizar_ativo(id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _pedido_paginado():
+    """Listas aceitam ?limit=/&cursor=; sem eles a resposta continua sendo a lista completa"""
+    return 'limit' in request.args or 'cursor' in request.args
+
+
+def _responder_paginado(tabela, filtros_permitidos, **filtros_fixos):
+    try:
+        filtros = {k: request.args.get(k) for k in filtros_permitidos if request.args.get(k)}
+        filtros.update(filtros_fixos)
+        pagina = listar_paginado(
+            tabela,
+            limite=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor') or None,
+            filtros=filtros,
+            q=request.args.get('q') or None,
+            mes=request.args.get('mes') or None,
+            ano=request.args.get('ano') or None,
+            inicio=request.args.get('inicio') or None,
+            fim=request.args.get('fim') or None,
+        )
+        return jsonify(pagina)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @server.route("/api/carteira/movimentacoes", methods=["GET"])
 def api_get_movimentacoes():
 
     try:
         mes = request.args.get('mes', type=int)
         ano = request.args.get('ano', type=int)
+        if _pedido_paginado():
+            return _responder_paginado('movimentacoes', ('ticker', 'tipo'))
         
         usuario_atual = get_usuario_atual()
         cache_key = None
@@ -1650,6 +1954,28 @@ def api_rebalance_status():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@server.route("/api/carteira/rebalance/sugestao", methods=["POST"])
+def api_rebalance_sugestao():
+    """Ordens por ticker para um aporte (ou rebalanceamento completo com vender=true)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            res = sugerir_rebalanceamento(
+                aporte=data.get('aporte', 0),
+                vender=bool(data.get('vender', False)),
+                minimo_operacao=data.get('minimo_operacao', 0),
+                fracionario=bool(data.get('fracionario', True)),
+                pesos_ativos=data.get('pesos_ativos') or None,
+                targets=data.get('targets') or None,
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        if "error" in res:
+            return jsonify(res), 401
+        return jsonify(res)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @server.route("/api/carteira/rebalance/history", methods=["GET", "POST"])
 def api_rebalance_history():
     try:
@@ -1668,34 +1994,19 @@ def api_rebalance_history():
 @server.route("/api/indicadores", methods=["GET"])
 def api_indicadores():
     try:
-
-        def sgs_last(series_id, use_range=False):
-            if use_range:
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=90)
-                url = (f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{series_id}/dados?"
-                       f"formato=json&dataInicial={start_date.strftime('%d/%m/%Y')}"
-                       f"&dataFinal={end_date.strftime('%d/%m/%Y')}")
-                r = requests.get(url, timeout=10)
-                r.raise_for_status()
-                arr = r.json()
-                return arr[-1] if arr else None
-            else:
-                url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{series_id}/dados/ultimos/1?formato=json"
-                r = requests.get(url, timeout=10)
-                r.raise_for_status()
-                arr = r.json()
-                return arr[0] if arr else None
-
-        selic = sgs_last(432, use_range=True)
-        cdi = sgs_last(12, use_range=True)
-        ipca = sgs_last(433)
+        # As três séries saem juntas; o request espera só a mais lenta
+        inicio = datetime.now() - timedelta(days=90)
+        futuros = {
+            "selic": sgs_futuro(432, inicio=inicio),
+            "cdi": sgs_futuro(12, inicio=inicio),
+            "ipca": sgs_futuro(433, ultimos=1),
+        }
+        resposta = {}
+        for nome, futuro in futuros.items():
+            arr = futuro.result(timeout=12)
+            resposta[nome] = arr[-1] if arr else None
         
-        return jsonify({
-            "selic": selic,
-            "cdi": cdi,
-            "ipca": ipca,
-        })
+        return jsonify(resposta)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1801,13 +2112,13 @@ def api_tesouro_titulos():
             "Accept": "application/json, text/plain, */*",
             "Referer": "https://www.tesourodireto.com.br/",
         }
-        r = requests.get(url, timeout=15, headers=headers)
+        r = async_http.get(url, timeout=15, headers=headers).result()
         r.raise_for_status()
         try:
             data = r.json()
         except Exception:
             
-            r2 = requests.get(url + f"?cb={int(datetime.now().timestamp())}", timeout=15, headers=headers)
+            r2 = async_http.get(url, params={"cb": int(datetime.now().timestamp())}, timeout=15, headers=headers).result()
             r2.raise_for_status()
             data = r2.json()
 
@@ -1950,7 +2261,19 @@ def api_get_historico_carteira():
     try:
         agregacao = request.args.get('periodo', 'mensal')  
         print(f"DEBUG: API /api/carteira/historico chamada com agregacao: {agregacao}")
+        usuario_atual = get_usuario_atual()
+        cache_key = f"carteira_historico:{usuario_atual}:{agregacao}" if usuario_atual else None
+        if cache_key:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return jsonify(cached)
         dados = obter_historico_carteira_comparado(agregacao)
+        if cache_key and isinstance(dados, dict) and 'error' not in dados:
+            try:
+                # resposta parcial (fonte fora do prazo) fica pouco tempo para a próxima tentar completar
+                cache.set(cache_key, dados, timeout=60 if dados.get('indisponiveis') else 900)  # 15 minutos
+            except Exception:
+                pass
         return jsonify(dados)
     except Exception as e:
         print(f"DEBUG: Erro na API: {e}")
@@ -1994,28 +2317,31 @@ def api_get_proventos():
                     ticker_normalizado = ticker
                 
 
-                ativo = yf.Ticker(ticker_normalizado)
-                
+                def _dividendos():
+                    ativo = yf.Ticker(ticker_normalizado)
+                    dividendos = ativo.dividends
+                    if dividendos is None or dividendos.empty:
+                        return None  # sem proventos (ou falha do yfinance): não cacheia
+                    info = ativo.info
+                    return {
+                        'nome': info.get('longName', ticker_normalizado),
+                        'dividendos': [(data.replace(tzinfo=None), float(valor)) for data, valor in dividendos.items()],
+                    }
 
-                dividendos = ativo.dividends
-                
-                if dividendos is not None and not dividendos.empty:
-                    proventos = []
-                    for data, valor in dividendos.items():
-                      
-                        data_sem_timezone = data.replace(tzinfo=None)
-                        
+                # histórico completo fica no cache público; o filtro de período é aplicado aqui
+                cached = _publico(f"proventos:{ticker_normalizado}", 3600, _dividendos, ttl_fechado_max=12 * 3600)
 
+                if cached:
+                    proventos = []
+                    for data_sem_timezone, valor in cached['dividendos']:
                         if data_inicio is None or data_sem_timezone >= data_inicio:
                             proventos.append({
-                                'data': data.strftime('%Y-%m-%d'),
-                                'valor': float(valor),
+                                'data': data_sem_timezone.strftime('%Y-%m-%d'),
+                                'valor': valor,
                                 'tipo': 'Dividendo'
                             })
-                    
 
-                    info = ativo.info
-                    nome = info.get('longName', ticker_normalizado)
+                    nome = cached['nome']
                     
                     resultado.append({
                         'ticker': ticker,
@@ -2070,6 +2396,8 @@ def api_get_proventos_recebidos():
                 data_inicio = hoje - timedelta(days=365*5)
                 data_inicio = data_inicio.replace(hour=0, minute=0, second=0, microsecond=0)
         
+        # quantidade em cada data-com vem da linha do tempo das movimentações
+        linha_tempo = obter_linha_tempo_posicoes()
         resultado = []
         
         for ativo in carteira:
@@ -2088,12 +2416,24 @@ def api_get_proventos_recebidos():
                 
                 if dividendos is not None and not dividendos.empty:
                     proventos_recebidos = []
-                    for data, valor in dividendos.items():
+                    quantidades_data_com = None
+                    if linha_tempo is not None and ticker in linha_tempo:
+                        # data do dividendo é a data-ex: tem direito quem tinha o ativo no dia anterior
+                        datas_ex = dividendos.index
+                        if datas_ex.tz is not None:
+                            datas_ex = datas_ex.tz_localize(None)
+                        datas_com = (datas_ex - timedelta(days=1)).values
+                        quantidades_data_com = linha_tempo.quantidades(ticker, datas_com)
+                    for i, (data, valor) in enumerate(dividendos.items()):
                         # Converter para datetime sem timezone para comparação
                         data_sem_timezone = data.replace(tzinfo=None)
-                        
+
+                        if quantidades_data_com is not None:
+                            quantidade = float(quantidades_data_com[i])
+                            if quantidade <= 0:
+                                continue
                         # Só considerar dividendos pagos após a data de aquisição
-                        if data_aquisicao:
+                        elif data_aquisicao:
                             try:
                                 data_aquisicao_dt = datetime.strptime(data_aquisicao, '%Y-%m-%d %H:%M:%S')
                                 if data_sem_timezone < data_aquisicao_dt:
@@ -2127,7 +2467,7 @@ def api_get_proventos_recebidos():
                         resultado.append({
                             'ticker': ticker,
                             'nome': nome,
-                            'quantidade_carteira': quantidade,
+                            'quantidade_carteira': ativo['quantidade'],
                             'data_aquisicao': data_aquisicao,
                             'proventos_recebidos': proventos_recebidos,
                             'total_recebido': sum(p['valor_recebido'] for p in proventos_recebidos)
@@ -2349,6 +2689,8 @@ def api_receitas():
                 return jsonify({"message": "Receita removida com sucesso"})
             return jsonify({"error": "ID é obrigatório"}), 400
         else:
+            if _pedido_paginado():
+                return _responder_paginado('receitas', ('categoria', 'tipo', 'nome'))
             mes = request.args.get('mes', type=str)
             ano = request.args.get('ano', type=str)
             usuario = get_usuario_atual()
@@ -2441,6 +2783,8 @@ def api_outros():
                 return jsonify({"message": "Gasto removido com sucesso"})
             return jsonify({"error": "ID é obrigatório"}), 400
         else:
+            if _pedido_paginado():
+                return _responder_paginado('outros_gastos', ('categoria', 'tipo'))
             mes = request.args.get('mes', type=str)
             ano = request.args.get('ano', type=str)
             usuario = get_usuario_atual()
@@ -2500,50 +2844,9 @@ def api_evolucao_financeira():
         ano = request.args.get('ano', type=str)
         
         
-        df_receita = carregar_receitas_mes_ano(mes, ano)
-        df_outros = pd.DataFrame(carregar_outros_mes_ano(mes, ano))
-        
-    
-        if not df_receita.empty:
-            df_receita["data"] = pd.to_datetime(df_receita["data"])
-            df_receita_grouped = df_receita.groupby("data")["valor"].sum().reset_index(name="receitas")
-        else:
-            df_receita_grouped = pd.DataFrame(columns=["data", "receitas"])
-        
-      
-        df_outros["data"] = pd.to_datetime(df_outros["data"]) if not df_outros.empty else pd.Series(dtype='datetime64[ns]')
-        df_outros_ = df_outros[["data", "valor"]] if not df_outros.empty else pd.DataFrame(columns=["data", "valor"])
-        df_despesas = df_outros_ if not df_outros_.empty else pd.DataFrame(columns=["data", "valor"])
-        
-        if df_despesas.empty:
-            df_despesas_grouped = pd.DataFrame({"data": [], "despesas": []})
-        else:
-            df_despesas_grouped = df_despesas.groupby("data")["valor"].sum().reset_index(name="despesas")
-        
-
-        dias = pd.date_range(
-            start=f"{ano}-{mes.zfill(2)}-01", 
-            end=pd.Timestamp(f"{ano}-{mes.zfill(2)}-01") + pd.offsets.MonthEnd(0)
+        evolucao, _, _ = evolucao_financeira_diaria(
+            mes, ano, carregar_receitas_mes_ano(mes, ano), carregar_outros_mes_ano(mes, ano)
         )
-        df_base = pd.DataFrame({"data": dias})
-        
- 
-        df_merged = pd.merge(df_base, df_receita_grouped, on="data", how="left").merge(df_despesas_grouped, on="data", how="left")
-        df_merged["receitas"] = df_merged["receitas"].fillna(0)
-        df_merged["despesas"] = df_merged["despesas"].fillna(0)
-        df_merged["saldo_dia"] = df_merged["receitas"] - df_merged["despesas"]
-        df_merged["saldo_acumulado"] = df_merged["saldo_dia"].cumsum()
-        
-
-        evolucao = []
-        for _, row in df_merged.iterrows():
-            evolucao.append({
-                'data': row['data'].strftime('%Y-%m-%d'),
-                'receitas': float(row['receitas']),
-                'despesas': float(row['despesas']),
-                'saldo_dia': float(row['saldo_dia']),
-                'saldo_acumulado': float(row['saldo_acumulado'])
-            })
         
         return jsonify(evolucao)
     except Exception as e:
@@ -2629,6 +2932,88 @@ def api_receitas_despesas():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+_SECOES_RESUMO = ('carteira', 'receitas', 'outros', 'marmitas', 'saldo', 'evolucao_financeira', 'gastos_mensais', 'total_despesas')
+
+
+def _campos_pedidos():
+    """?fields=ticker,valor_total -> ['ticker', 'valor_total'] (None = todos)
+
+    Campos desconhecidos são ignorados; se nenhum for válido, ValueError.
+    """
+    bruto = request.args.get('fields', type=str)
+    if not bruto:
+        return None
+    campos = [c.strip() for c in bruto.split(',') if c.strip() in CAMPOS_CARTEIRA]
+    if not campos:
+        raise ValueError("Nenhum campo válido em fields")
+    return list(dict.fromkeys(campos))
+
+
+def _modo_compacto():
+    return request.args.get('compact') in ('1', 'true', 'True')
+
+
+def _secoes_resumo():
+    """?include=carteira,saldo -> (seções, com_registros)
+
+    Sem include, volta tudo como antes. Com include, as listas de registros
+    só vêm se 'registros' estiver entre os itens.
+    """
+    bruto = request.args.get('include', type=str)
+    if not bruto:
+        return set(_SECOES_RESUMO), True
+    itens = {i.strip() for i in bruto.split(',') if i.strip()}
+    return itens.intersection(_SECOES_RESUMO), 'registros' in itens
+
+
+def _compactar(registros, colunas=None):
+    """Lista de dicts -> {"columns": [...], "rows": [[...], ...]} (sem repetir as chaves)"""
+    registros = registros or []
+    if colunas is None:
+        colunas = list(registros[0].keys()) if registros else []
+    return {'columns': colunas, 'rows': [[r.get(c) for c in colunas] for r in registros]}
+
+
+def _compactar_resumo(resumo):
+    """Modo compacto do resumo: listas viram colunas/linhas e some o que o cliente deriva (contagens)"""
+    compacto = {}
+    for chave, valor in resumo.items():
+        if isinstance(valor, dict):
+            valor = {k: v for k, v in valor.items() if k not in ('quantidade', 'quantidade_ativos')}
+            for lista in ('ativos', 'registros'):
+                if lista in valor:
+                    valor[lista] = _compactar(valor[lista])
+        elif isinstance(valor, list):
+            valor = _compactar(valor)
+        compacto[chave] = valor
+    return compacto
+
+
+_resumo_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='resumo')
+# Prazo (s) para todas as consultas de um resumo; o que passar disso é cancelado
+RESUMO_TIMEOUT = float(os.getenv('RESUMO_TIMEOUT', '20'))
+
+
+def _coletar_em_paralelo(usuario, tarefas):
+    """Executa as consultas independentes do dashboard em paralelo
+
+    Cada tarefa roda com app context próprio e o usuário fixado na thread
+    (get_usuario_atual não enxerga o request fora da thread web).
+    """
+    def _executar(funcao):
+        with server.app_context(), usuario_contexto(usuario):
+            return funcao()
+
+    futuros = {nome: _resumo_pool.submit(_executar, funcao) for nome, funcao in tarefas.items()}
+    _, pendentes = wait(futuros.values(), timeout=RESUMO_TIMEOUT)
+    if pendentes:
+        # as que ainda estão na fila não chegam a rodar; as em execução terminam sozinhas
+        for futuro in pendentes:
+            futuro.cancel()
+        raise TimeoutError(f"Resumo excedeu {RESUMO_TIMEOUT:g}s")
+    return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+
 @server.route("/api/home/resumo", methods=["GET"])
 def api_home_resumo():
 
@@ -2641,7 +3026,8 @@ def api_home_resumo():
                 user = 'anon'
             mes_q = request.args.get('mes', type=str) or ''
             ano_q = request.args.get('ano', type=str) or ''
-            return f"home_resumo:{user}:{mes_q}:{ano_q}"
+            formato = ':'.join(request.args.get(k, type=str) or '' for k in ('include', 'fields', 'compact'))
+            return f"home_resumo:{user}:{mes_q}:{ano_q}:{formato}"
         if cache:
             cached_payload = cache.get(_cache_key())
             if cached_payload is not None:
@@ -2657,130 +3043,95 @@ def api_home_resumo():
             return jsonify({"error": "Mês e ano são obrigatórios"}), 400
         
 
-        carteira = obter_carteira()
-        total_investido = sum(ativo.get('valor_total', 0) for ativo in carteira)
-        ativos_por_tipo = {}
-        for ativo in carteira:
-            tipo = ativo.get('tipo', 'Desconhecido')
-            ativos_por_tipo[tipo] = ativos_por_tipo.get(tipo, 0) + ativo.get('valor_total', 0)
-        
-
-        df_receitas = carregar_receitas_mes_ano(mes, ano)
-        receitas = df_receitas.to_dict('records') if not df_receitas.empty else []
-        total_receitas = df_receitas['valor'].sum() if not df_receitas.empty else 0
-        
-  
-    
-        total_cartoes = 0
-        
-   
-        outros = carregar_outros_mes_ano(mes, ano)
-        total_outros = sum(outro.get('valor', 0) for outro in outros)
-        
-
-        marmitas = consultar_marmitas(mes, ano)
-        marmitas_formatted = []
-        total_marmitas = 0
-        for registro in marmitas:
-            marmita = {
-                'id': registro[0],
-                'data': registro[1],
-                'valor': float(registro[2]) if registro[2] else 0,
-                'comprou': bool(registro[3])
-            }
-            marmitas_formatted.append(marmita)
-            total_marmitas += marmita['valor']
-        
-     
-        saldo = calcular_saldo_mes_ano(mes, ano)
-        
-  
-        df_receita = carregar_receitas_mes_ano(mes, ano)
-        df_outros = pd.DataFrame(carregar_outros_mes_ano(mes, ano))
-        
-       
-        if not df_receita.empty:
-            df_receita["data"] = pd.to_datetime(df_receita["data"])
-            df_receita_grouped = df_receita.groupby("data")["valor"].sum().reset_index(name="receitas")
-        else:
-            df_receita_grouped = pd.DataFrame(columns=["data", "receitas"])
-        
-   
-        df_outros["data"] = pd.to_datetime(df_outros["data"]) if not df_outros.empty else pd.Series(dtype='datetime64[ns]')
-        df_outros_ = df_outros[["data", "valor"]] if not df_outros.empty else pd.DataFrame(columns=["data", "valor"])
-        df_despesas = df_outros_ if not df_outros_.empty else pd.DataFrame(columns=["data", "valor"])
-        
-        if df_despesas.empty:
-            df_despesas_grouped = pd.DataFrame({"data": [], "despesas": []})
-        else:
-            df_despesas_grouped = df_despesas.groupby("data")["valor"].sum().reset_index(name="despesas")
-        
-
-        dias = pd.date_range(
-            start=f"{ano}-{mes.zfill(2)}-01", 
-            end=pd.Timestamp(f"{ano}-{mes.zfill(2)}-01") + pd.offsets.MonthEnd(0)
-        )
-        df_base = pd.DataFrame({"data": dias})
-        
-
-        df_merged = pd.merge(df_base, df_receita_grouped, on="data", how="left").merge(df_despesas_grouped, on="data", how="left")
-        df_merged["receitas"] = df_merged["receitas"].fillna(0)
-        df_merged["despesas"] = df_merged["despesas"].fillna(0)
-        df_merged["saldo_dia"] = df_merged["receitas"] - df_merged["despesas"]
-        df_merged["saldo_acumulado"] = df_merged["saldo_dia"].cumsum()
-        
-
-        evolucao = []
-        for _, row in df_merged.iterrows():
-            evolucao.append({
-                'data': row['data'].strftime('%Y-%m-%d'),
-                'receitas': float(row['receitas']),
-                'despesas': float(row['despesas']),
-                'saldo_dia': float(row['saldo_dia']),
-                'saldo_acumulado': float(row['saldo_acumulado'])
-            })
-        
-
-        df_gastos = gastos_mensais('6m')
-        gastos_mensais_data = []
-        for _, row in df_gastos.iterrows():
-            gastos_mensais_data.append({
-                'mes': row['AnoMes'],
-                'valor': float(row['valor'])
-            })
-        
-
-        resumo = {
-            'carteira': {
-                'ativos': carteira,
+        secoes, com_registros = _secoes_resumo()
+        try:
+            campos_ativos = _campos_pedidos()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        compacto = _modo_compacto()
+
+        tarefas = {}
+        if 'carteira' in secoes:
+            if com_registros and not campos_ativos:
+                tarefas['carteira'] = obter_carteira
+            else:
+                # totais por tipo precisam só de tipo/valor_total; o resto só se pedido em fields
+                campos_carteira = list(campos_ativos or []) if com_registros else []
+                campos_carteira += ['tipo', 'valor_total']
+                tarefas['carteira'] = lambda: obter_carteira(campos=campos_carteira)
+        if secoes & {'receitas', 'outros', 'saldo', 'evolucao_financeira', 'total_despesas'}:
+            tarefas['receitas'] = lambda: carregar_receitas_mes_ano(mes, ano)
+            tarefas['outros'] = lambda: carregar_outros_mes_ano(mes, ano)
+        if secoes & {'marmitas', 'total_despesas'}:
+            tarefas['marmitas'] = lambda: consultar_marmitas(mes, ano)
+        if 'gastos_mensais' in secoes:
+            tarefas['gastos'] = lambda: gastos_mensais('6m')
+        dados = _coletar_em_paralelo(usuario, tarefas)
+
+        resumo = {}
+        if 'carteira' in dados:
+            carteira = dados['carteira'] or []
+            total_investido = sum(ativo.get('valor_total', 0) or 0 for ativo in carteira)
+            ativos_por_tipo = {}
+            for ativo in carteira:
+                tipo = ativo.get('tipo', 'Desconhecido')
+                ativos_por_tipo[tipo] = ativos_por_tipo.get(tipo, 0) + (ativo.get('valor_total', 0) or 0)
+            resumo['carteira'] = {
                 'total_investido': total_investido,
                 'quantidade_ativos': len(carteira),
                 'distribuicao_por_tipo': ativos_por_tipo
-            },
-            'receitas': {
-                'registros': receitas,
-                'total': total_receitas,
-                'quantidade': len(receitas)
-            },
-            
-            'outros': {
-                'registros': outros,
-                'total': total_outros,
-                'quantidade': len(outros)
-            },
-            'marmitas': {
-                'registros': marmitas_formatted,
-                'total': total_marmitas,
-                'quantidade': len(marmitas_formatted)
-            },
-            'saldo': saldo,
-            'evolucao_financeira': evolucao,
-            'gastos_mensais': gastos_mensais_data,
-            'total_despesas': total_outros + total_marmitas
-        }
-        
-
-        
+            }
+            if com_registros:
+                ativos = carteira
+                if campos_ativos:
+                    ativos = [{c: a.get(c) for c in campos_ativos} for a in carteira]
+                resumo['carteira']['ativos'] = ativos
+
+        if 'receitas' in dados:
+            df_receitas = dados['receitas']
+            outros = dados['outros']
+            # totais, saldo e evolução saem dos mesmos arrays (antes: 2 leituras + SUM separado)
+            evolucao, total_receitas, total_outros = evolucao_financeira_diaria(mes, ano, df_receitas, outros)
+            if 'receitas' in secoes:
+                resumo['receitas'] = {'total': total_receitas, 'quantidade': len(df_receitas)}
+                if com_registros:
+                    resumo['receitas']['registros'] = df_receitas.to_dict('records') if not df_receitas.empty else []
+            if 'outros' in secoes:
+                resumo['outros'] = {'total': total_outros, 'quantidade': len(outros)}
+                if com_registros:
+                    resumo['outros']['registros'] = outros
+            if 'saldo' in secoes:
+                resumo['saldo'] = total_receitas - total_outros
+            if 'evolucao_financeira' in secoes:
+                resumo['evolucao_financeira'] = evolucao
+
+        if 'marmitas' in dados:
+            marmitas_formatted = [
+                {
+                    'id': registro[0],
+                    'data': registro[1],
+                    'valor': float(registro[2]) if registro[2] else 0,
+                    'comprou': bool(registro[3])
+                }
+                for registro in dados['marmitas']
+            ]
+            total_marmitas = sum(m['valor'] for m in marmitas_formatted)
+            if 'marmitas' in secoes:
+                resumo['marmitas'] = {'total': total_marmitas, 'quantidade': len(marmitas_formatted)}
+                if com_registros:
+                    resumo['marmitas']['registros'] = marmitas_formatted
+            if 'total_despesas' in secoes:
+                resumo['total_despesas'] = total_outros + total_marmitas
+
+        if 'gastos' in dados:
+            df_gastos = dados['gastos']
+            resumo['gastos_mensais'] = [
+                {'mes': anomes, 'valor': float(valor)}
+                for anomes, valor in zip(df_gastos['AnoMes'].tolist(), df_gastos['valor'].tolist())
+            ] if not df_gastos.empty else []
+
+        if compacto:
+            resumo = _compactar_resumo(resumo)
 
         try:
             if cache:
@@ -2788,6 +3139,9 @@ def api_home_resumo():
         except Exception:
             pass
         return jsonify(resumo)
+    except TimeoutError as e:
+        print(f"Timeout na API home/resumo: {str(e)}")
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"Erro na API home/resumo: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -2796,19 +3150,22 @@ def api_home_resumo():
 @server.route("/api/exchange-rate/<symbol>", methods=["GET"])
 def api_get_exchange_rate(symbol):
     try:
-      
-        ticker = yf.Ticker(symbol)
-        historico = ticker.history(period='1d')
-        
-        if historico is not None and not historico.empty:
-
+        def _cotacao():
+            historico = yf.Ticker(symbol).history(period='1d')
+            if historico is None or historico.empty:
+                return None
             latest_data = historico.iloc[-1]
-            return jsonify({
+            return {
                 "symbol": symbol,
                 "rate": float(latest_data['Close']),
                 "date": latest_data.name.isoformat(),
                 "volume": float(latest_data['Volume']) if 'Volume' in latest_data else 0
-            })
+            }
+
+        # câmbio negocia fora do pregão da B3: fechado, o TTL é limitado a 30 min
+        cotacao = _publico(f"cambio:{symbol}", 120, _cotacao, ttl_fechado_max=1800)
+        if cotacao is not None:
+            return jsonify(cotacao)
         else:
             return jsonify({"error": "Dados não encontrados"}), 404
             
@@ -2901,6 +3258,8 @@ def api_compras_cartao():
             ano = request.args.get('ano')
             if not cartao_id:
                 return jsonify({"error": "ID do cartão é obrigatório"}), 400
+            if _pedido_paginado():
+                return _responder_paginado('compras_cartao', ('categoria',), cartao_id=int(cartao_id))
             compras = listar_compras_cartao(int(cartao_id), mes, ano)
             return jsonify(compras)
         
@@ -3045,7 +3404,10 @@ def api_simulador_choques():
         choques_ipca = data.get('choques_ipca', 0)
         choques_selic = data.get('choques_selic', 0)
         
-        resultado = simular_choques_indexadores(choques_cdi, choques_ipca, choques_selic)
+        params = {'cdi': float(choques_cdi or 0), 'ipca': float(choques_ipca or 0), 'selic': float(choques_selic or 0)}
+        resultado = com_cache('choques', params,
+                              lambda carteira: simular_choques_indexadores(choques_cdi, choques_ipca, choques_selic,
+                                                                           carteira=carteira))
         
         if "error" in resultado:
             return jsonify(resultado), 400
@@ -3055,6 +3417,25 @@ def api_simulador_choques():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@server.route("/api/simulador/choques/lote", methods=["POST"])
+def api_simulador_choques_lote():
+    """Avalia vários cenários de choque numa chamada (padrão: os cenários pré-definidos)"""
+    try:
+        if not get_usuario_atual():
+            return jsonify({"error": "Não autenticado"}), 401
+        data = request.get_json(silent=True) or {}
+        cenarios = data.get('cenarios') or obter_cenarios_predefinidos()
+        horizonte = data.get('horizonte_meses', CHOQUES_HORIZONTE_MESES)
+        params = {'cenarios': cenarios, 'horizonte_meses': horizonte}
+        try:
+            resultado = com_cache('choques_lote', params,
+                                  lambda carteira: avaliar_cenarios(cenarios, carteira, horizonte_meses=int(horizonte)))
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(resultado)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @server.route("/api/simulador/cenarios", methods=["GET"])
 def api_simulador_cenarios():
 
@@ -3073,8 +3454,17 @@ def api_simulador_monte_carlo():
         n_simulacoes = data.get('nSimulacoes', 10000)
         periodo_anos = data.get('periodoAnos', 5)
         confianca = data.get('confianca', 95)
+        seed = data.get('seed')
+        agrupamento = data.get('agrupamento', 'classe')
         
-        resultado = executar_monte_carlo(n_simulacoes, periodo_anos, confianca)
+        try:
+            params = params_monte_carlo(n_simulacoes, periodo_anos, confianca, seed, agrupamento)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # sem seed a chave usa seed=None: repete o resultado (com a seed sorteada) até a carteira mudar
+        resultado = com_cache('monte_carlo', params,
+                              lambda carteira: executar_monte_carlo(n_simulacoes, periodo_anos, confianca, seed=params['seed'],
+                                                                    agrupamento=agrupamento, carteira=carteira))
         
         if "error" in resultado:
             return jsonify(resultado), 400
@@ -3084,6 +3474,41 @@ def api_simulador_monte_carlo():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@server.route("/api/simulador/monte-carlo/stream", methods=["GET"])
+def api_simulador_monte_carlo_stream():
+    """Monte Carlo progressivo (SSE): percentis parciais após 1k, 10k e 100k trajetórias e o resultado final"""
+    try:
+        usuario_atual = get_usuario_atual()
+        if not usuario_atual:
+            return jsonify({"error": "Não autenticado"}), 401
+        try:
+            params = params_monte_carlo(request.args.get('nSimulacoes', 10000), request.args.get('periodoAnos', 5),
+                                        request.args.get('confianca', 95), request.args.get('seed'),
+                                        request.args.get('agrupamento', 'classe'))
+            carteira = obter_carteira() or []
+            # mesma chave do POST: o resultado do modo progressivo serve aos dois
+            chave = chave_resultado(usuario_atual, 'monte_carlo', params, carteira)
+            resultado = resultado_em_cache(chave)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # parâmetros estimados dentro do gerador, depois do primeiro evento
+        eventos = eventos_monte_carlo(params, carteira, chave, resultado)
+        resp = server.response_class(stream_with_context(eventos), mimetype='text/event-stream')
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Accel-Buffering'] = 'no'
+        return resp
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ==================== AGENDADOR (PRÉ-AQUECIMENTO) ====================
+
+# Ligado por padrão em produção; AGENDADOR=0/1 sobrescreve
+_agendador_padrao = '1' if (os.getenv('FLY_APP_NAME') or os.getenv('ENVIRONMENT') == 'production') else '0'
+if os.getenv('AGENDADOR', _agendador_padrao) == '1':
+    iniciar_agendador(server)
+
 
 if __name__ == "__main__":
     server.run(debug=False, port=5005, host='0.0.0.0') 
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Cliente HTTP assíncrono para chamadas externas (BCB, FundsExplorer, Tesouro).
+
+Um event loop asyncio roda numa thread dedicada com um httpx.AsyncClient
+(pool de conexões keep-alive). O código Flask, que é síncrono, recebe
+concurrent.futures.Future: dispara várias requisições, segue trabalhando e só
+bloqueia no .result(). Assim um fan-out (ex.: as três séries SGS) ocupa um
+único thread do gunicorn pelo tempo da requisição mais lenta, não da soma.
+
+Sem httpx instalado, as mesmas funções usam requests num pool de threads.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+
+try:
+    from .optimizations import performance_monitor
+except ImportError:
+    from optimizations import performance_monitor
+
+try:
+    import httpx  # type: ignore
+except Exception:
+    httpx = None
+
+HTTP_MAX_CONEXOES = int(os.getenv('HTTP_MAX_CONEXOES', '50'))
+TIMEOUT_PADRAO = 10
+
+
+class Resposta:
+    """Subconjunto comum de requests.Response / httpx.Response"""
+
+    __slots__ = ('status_code', 'content', 'headers', 'url', 'encoding')
+
+    def __init__(self, status_code, content, headers, url, encoding=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.url = url
+        self.encoding = encoding or 'utf-8'
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        import json
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} para {self.url}")
+
+
+# ==================== EVENT LOOP ====================
+
+_loop = None
+_cliente = None
+_pool_fallback = None
+_lock = threading.Lock()
+
+
+def _iniciar_loop():
+    pronto = threading.Event()
+
+    def _rodar():
+        global _loop, _cliente
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        _cliente = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONEXOES, max_keepalive_connections=20),
+            timeout=TIMEOUT_PADRAO,
+            follow_redirects=True,
+        )
+        _loop = loop
+        pronto.set()
+        loop.run_forever()
+
+    threading.Thread(target=_rodar, name='async-http', daemon=True).start()
+    pronto.wait()
+
+
+def _garantir():
+    global _pool_fallback
+    if _loop is not None or _pool_fallback is not None:
+        return
+    with _lock:
+        if _loop is not None or _pool_fallback is not None:
+            return
+        if httpx is not None:
+            _iniciar_loop()
+        else:
+            _pool_fallback = ThreadPoolExecutor(max_workers=HTTP_MAX_CONEXOES // 5, thread_name_prefix='http')
+
+
+async def _get_async(url, params, headers, timeout):
+    # mesmas métricas de upstream que o requests.Session instrumentado registra
+    host = urlsplit(str(url)).hostname or 'desconhecido'
+    inicio = time.perf_counter()
+    erro = False
+    try:
+        r = await _cliente.get(url, params=params, headers=headers, timeout=timeout)
+        erro = r.status_code >= 500
+        return Resposta(r.status_code, r.content, r.headers, str(r.url), r.encoding)
+    except Exception:
+        erro = True
+        raise
+    finally:
+        performance_monitor.log_upstream(host, time.perf_counter() - inicio, erro)
+
+
+def _get_bloqueante(url, params, headers, timeout):
+    r = requests.get(url, params=params, headers=headers, timeout=timeout)
+    return Resposta(r.status_code, r.content, r.headers, r.url, r.encoding)
+
+
+# ==================== API SÍNCRONA (FUTURES) ====================
+
+def get(url, params=None, headers=None, timeout=TIMEOUT_PADRAO) -> Future:
+    """GET assíncrono; retorna um Future[Resposta]"""
+    _garantir()
+    if _pool_fallback is not None:
+        return _pool_fallback.submit(_get_bloqueante, url, params, headers, timeout)
+    return asyncio.run_coroutine_threadsafe(_get_async(url, params, headers, timeout), _loop)
+
+
+def _json_ok(futuro: Future, destino: Future):
+    # destino cancelado (prazo do chamador): não há a quem entregar
+    if not destino.set_running_or_notify_cancel():
+        return
+    try:
+        resposta = futuro.result()
+        resposta.raise_for_status()
+        destino.set_result(resposta.json())
+    except BaseException as e:
+        destino.set_exception(e)
+
+
+def get_json(url, params=None, headers=None, timeout=TIMEOUT_PADRAO) -> Future:
+    """GET que resolve para o JSON da resposta (erro HTTP vira exceção no .result()).
+
+    Cancelar o Future devolvido cancela também a requisição no loop assíncrono.
+    """
+    destino = Future()
+    interno = get(url, params=params, headers=headers, timeout=timeout)
+    destino.add_done_callback(lambda d: d.cancelled() and interno.cancel())
+    interno.add_done_callback(lambda futuro: _json_ok(futuro, destino))
+    return destino
+
+
+def resultados(futuros, timeout=None, padrao=None):
+    """Espera uma lista/dict de futures; falha ou timeout de um item vira `padrao`"""
+    itens = futuros.items() if isinstance(futuros, dict) else enumerate(futuros)
+    itens = list(itens)
+    wait([f for _, f in itens], timeout=timeout)
+    saida = {}
+    for chave, futuro in itens:
+        if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+            saida[chave] = futuro.result()
+        else:
+            if not futuro.done():
+                futuro.cancel()
+            saida[chave] = padrao
+    return saida if isinstance(futuros, dict) else [saida[i] for i in range(len(itens))]
@@ -0,0 +1,116 @@
+"""
+Benchmark de serialização JSON: provider padrão do Flask x FastJSONProvider.
+
+Uso: python backend/bench_json.py [repeticoes]
+
+Os payloads imitam o formato real de /api/carteira, /api/ativo/<t>/historico
+(period=max) e /api/home/resumo, com dados sintéticos.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from json_provider import FastJSONProvider
+from optimizations import historico_colunar, historico_registros
+
+
+def payload_carteira(n=300):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        'id': np.arange(n),
+        'ticker': [f"ATV{i:03d}.SA" for i in range(n)],
+        'nome_completo': [f"Ativo {i}" for i in range(n)],
+        'quantidade': rng.integers(1, 1000, n).astype(float),
+        'preco_atual': rng.uniform(5, 200, n),
+        'preco_compra': rng.uniform(5, 200, n),
+        'valor_total': rng.uniform(100, 50000, n),
+        'tipo': rng.choice(['Ação', 'FII', 'Renda Fixa'], n),
+        'dy': rng.uniform(0, 0.15, n),
+        'pl': rng.uniform(-5, 40, n),
+        'pvp': rng.uniform(0.3, 4, n),
+        'roe': rng.uniform(-0.2, 0.4, n),
+        'data_adicao': pd.date_range('2020-01-01', periods=n, freq='D').strftime('%Y-%m-%d'),
+    })
+    df.loc[::7, 'pl'] = np.nan
+    return df
+
+
+def payload_historico(n=9000):
+    rng = np.random.default_rng(2)
+    idx = pd.date_range('1990-01-01', periods=n, freq='B', tz='America/New_York')
+    close = 10 + np.cumsum(rng.normal(0, 0.2, n))
+    return pd.DataFrame({
+        'Open': close + rng.normal(0, 0.05, n),
+        'High': close + 0.2,
+        'Low': close - 0.2,
+        'Close': close,
+        'Volume': rng.integers(1e5, 1e7, n).astype(float),
+        'Dividends': 0.0,
+        'Stock Splits': 0.0,
+    }, index=idx)
+
+
+def payload_home_resumo(meses=24):
+    rng = np.random.default_rng(3)
+    evolucao = [
+        {'data': f"{2023 + i // 12}-{i % 12 + 1:02d}", 'receitas': float(rng.uniform(5000, 9000)),
+         'despesas': float(rng.uniform(3000, 7000)), 'saldo_acumulado': float(rng.uniform(0, 1e5))}
+        for i in range(meses)
+    ]
+    return {
+        'mes': '10', 'ano': '2026',
+        'receitas': payload_carteira(40)[['id', 'nome_completo', 'valor_total', 'data_adicao']].to_dict('records'),
+        'cartoes': [{'id': i, 'nome': f"Cartão {i}", 'total': np.float64(rng.uniform(0, 5000))} for i in range(6)],
+        'outros': [{'id': i, 'nome': f"Outro {i}", 'valor': float(rng.uniform(0, 500))} for i in range(30)],
+        'marmitas': [{'id': i, 'data': '2026-10-01', 'valor': 18.5, 'comprou': 1} for i in range(60)],
+        'evolucao': evolucao,
+        'carteira': {'valor_total': np.float64(123456.78), 'quantidade_ativos': np.int64(42)},
+    }
+
+
+def medir(funcao, repeticoes):
+    funcao()
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        tamanho = len(funcao())
+    return (time.perf_counter() - inicio) / repeticoes * 1000, tamanho
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    app = Flask(__name__)
+    padrao = DefaultJSONProvider(app)
+    rapido = FastJSONProvider(app)
+
+    carteira = payload_carteira()
+    historico = payload_historico()
+    resumo = payload_home_resumo()
+
+    casos = [
+        ('carteira (to_dict + json)', lambda: padrao.response(carteira.to_dict('records')).get_data()),
+        ('carteira (DataFrame direto)', lambda: rapido.response(carteira).get_data()),
+        ('historico max (iterrows + json)', lambda: padrao.response(
+            [dict(row.to_dict(), Date=i.isoformat()) for i, row in historico.iterrows()]).get_data()),
+        ('historico max (registros + orjson)', lambda: rapido.response(historico_registros(historico)).get_data()),
+        ('historico max (colunar + orjson)', lambda: rapido.response(historico_colunar(historico)).get_data()),
+        ('historico max (colunar, points=500)', lambda: rapido.response(historico_colunar(historico, points=500)).get_data()),
+        ('home resumo (json)', lambda: padrao.response(
+            {**resumo, 'carteira': {k: float(v) for k, v in resumo['carteira'].items()},
+             'cartoes': [dict(c, total=float(c['total'])) for c in resumo['cartoes']]}).get_data()),
+        ('home resumo (orjson)', lambda: rapido.response(resumo).get_data()),
+    ]
+
+    with app.app_context():
+        print(f"{'payload':40s} {'ms':>10s} {'bytes':>12s}")
+        for nome, funcao in casos:
+            ms, tamanho = medir(funcao, repeticoes)
+            print(f"{nome:40s} {ms:10.2f} {tamanho:12d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import hashlib
+import json
 
 
 COMPLETE_B3_LOGOS_MAPPING = {
@@ -974,6 +976,25 @@ COMPLETE_B3_LOGOS_MAPPING = {
 }
 
 
+CRYPTO_SYMBOLS_SUPORTADOS = (
+    'btc', 'eth', 'usdc', 'usdt', 'xrp', 'sol', 'doge',
+    'ada', 'matic', 'dot', 'link', 'bnb', 'avax', 'ltc',
+    'atom', 'uni', 'xlm', 'algo', 'vet', 'icp', 'fil',
+    'aave', 'mkr', 'comp', 'yfi', 'snx', 'crv', 'sushi',
+    'trx', 'etc', 'bch', 'xmr', 'dash', 'zec', 'xtz'
+)
+_CRYPTO_URL = "https://img.logo.dev/crypto/{}?token=pk_Dhx4NNGHRFe5mo7gEtJaWA&retina=true"
+
+# Índice normalizado (chave em minúsculas), montado uma vez no import
+LOGOS_POR_TICKER = {key.lower(): url for key, url in COMPLETE_B3_LOGOS_MAPPING.items()}
+LOGOS_CRYPTO = {symbol: _CRYPTO_URL.format(symbol) for symbol in CRYPTO_SYMBOLS_SUPORTADOS}
+
+# Muda sempre que o mapeamento muda: usada como ETag/versão do manifesto
+LOGOS_VERSAO = hashlib.sha1(
+    json.dumps([sorted(LOGOS_POR_TICKER.items()), sorted(LOGOS_CRYPTO.items())]).encode('utf-8')
+).hexdigest()[:16]
+
+
 def get_logo_url(ticker):
    
     if not ticker:
@@ -984,28 +1005,10 @@ def get_logo_url(ticker):
     if '-USD' in ticker_upper or '-USDT' in ticker_upper:
         # Extrair o símbolo da cripto (ex: BTC-USD -> btc)
         crypto_symbol = ticker_upper.split('-')[0].lower()
-        
-   
-        crypto_symbols_supported = [
-            'btc', 'eth', 'usdc', 'usdt', 'xrp', 'sol', 'doge', 
-            'ada', 'matic', 'dot', 'link', 'bnb', 'avax', 'ltc',
-            'atom', 'uni', 'xlm', 'algo', 'vet', 'icp', 'fil',
-            'aave', 'mkr', 'comp', 'yfi', 'snx', 'crv', 'sushi',
-            'trx', 'etc', 'bch', 'xmr', 'dash', 'zec', 'xtz'
-        ]
-        
-        if crypto_symbol in crypto_symbols_supported:
-            return f"https://img.logo.dev/crypto/{crypto_symbol}?token=pk_Dhx4NNGHRFe5mo7gEtJaWA&retina=true"
-    
+        if crypto_symbol in LOGOS_CRYPTO:
+            return LOGOS_CRYPTO[crypto_symbol]
 
-    ticker_normalized = ticker.lower()
-    
-
-    for key, url in COMPLETE_B3_LOGOS_MAPPING.items():
-        if key.lower() == ticker_normalized:
-            return url
-    
-    return None
+    return LOGOS_POR_TICKER.get(ticker.lower())
 
 def add_logo_column_to_data(data, ticker_column='ticker'):
 
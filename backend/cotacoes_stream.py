@@ -0,0 +1,180 @@
+"""
+Cotações ao vivo para o stream SSE da carteira (/api/carteira/stream).
+
+Um único atualizador por processo busca, a cada intervalo, os preços da
+união dos tickers de todas as conexões abertas (obter_precos_batch, que ainda
+passa pelo cache_publico) e entrega só os preços que mudaram para as filas
+das conexões interessadas. N usuários com os mesmos tickers custam uma busca
+por intervalo, não N.
+
+Cada conexão SSE ocupa uma thread do gunicorn enquanto está aberta, por isso
+há limite de conexões por processo e duração máxima (o EventSource do
+navegador reconecta sozinho).
+"""
+
+import os
+import queue
+import threading
+import time
+
+try:
+    from . import models
+    from .optimizations import b3_aberta
+except ImportError:
+    import models
+    from optimizations import b3_aberta
+
+SSE_INTERVALO = int(os.getenv('SSE_INTERVALO', '15'))
+# Fora do pregão os preços quase não mudam
+SSE_INTERVALO_FECHADO = int(os.getenv('SSE_INTERVALO_FECHADO', '300'))
+# Por processo; cada conexão prende uma thread do gunicorn (ver --threads no Dockerfile)
+SSE_MAX_CONEXOES = int(os.getenv('SSE_MAX_CONEXOES', '8'))
+SSE_DURACAO_MAX = int(os.getenv('SSE_DURACAO_MAX', '300'))
+SSE_KEEPALIVE = 15
+
+
+class Assinatura:
+    def __init__(self, tickers):
+        self.tickers = frozenset(tickers)
+        self.fila = queue.Queue()
+
+
+class AtualizadorCotacoes:
+    """Busca compartilhada de preços para todas as conexões SSE do processo"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._assinaturas = set()
+        self._ultimos = {}
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread = None
+
+    def conexoes(self):
+        with self._lock:
+            return len(self._assinaturas)
+
+    def ultimos(self, tickers):
+        with self._lock:
+            return {t: self._ultimos[t] for t in tickers if t in self._ultimos}
+
+    def inscrever(self, tickers):
+        """Retorna a Assinatura, ou None se o limite de conexões do processo foi atingido"""
+        assinatura = Assinatura(tickers)
+        with self._lock:
+            if len(self._assinaturas) >= SSE_MAX_CONEXOES:
+                return None
+            self._assinaturas.add(assinatura)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='cotacoes-sse', daemon=True)
+                self._thread.start()
+        # ticker novo: não espera o próximo ciclo
+        self._acordar.set()
+        return assinatura
+
+    def cancelar(self, assinatura):
+        """Idempotente: chamado pelo gerador e pelo fechamento da resposta"""
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def _tickers(self):
+        with self._lock:
+            tickers = set()
+            for assinatura in self._assinaturas:
+                tickers |= assinatura.tickers
+            return tickers
+
+    def atualizar(self):
+        """Um ciclo: busca a união dos tickers e publica as mudanças"""
+        tickers = self._tickers()
+        if not tickers:
+            return {}
+        intervalo = SSE_INTERVALO if b3_aberta() else SSE_INTERVALO_FECHADO
+        if self.app is not None:
+            with self.app.app_context():
+                precos = models.obter_precos_batch(sorted(tickers), ttl=intervalo)
+        else:
+            precos = models.obter_precos_batch(sorted(tickers), ttl=intervalo)
+        mudancas = {}
+        with self._lock:
+            for ticker, dados in precos.items():
+                preco = (dados or {}).get('preco_atual')
+                if preco is None:
+                    continue
+                if self._ultimos.get(ticker) != preco:
+                    mudancas[ticker] = preco
+                self._ultimos[ticker] = preco
+            assinaturas = list(self._assinaturas)
+        if mudancas:
+            for assinatura in assinaturas:
+                parte = {t: p for t, p in mudancas.items() if t in assinatura.tickers}
+                if parte:
+                    assinatura.fila.put(parte)
+        return mudancas
+
+    def _loop(self):
+        while True:
+            if not self._tickers():
+                # sem conexões: encerra; a próxima inscrição recria a thread
+                with self._lock:
+                    if not self._assinaturas:
+                        self._thread = None
+                        return
+            try:
+                self.atualizar()
+            except Exception as e:
+                print(f"Erro ao atualizar cotações do stream: {e}")
+            self._acordar.clear()
+            self._acordar.wait(SSE_INTERVALO if b3_aberta() else SSE_INTERVALO_FECHADO)
+
+
+atualizador = AtualizadorCotacoes()
+
+
+def eventos_carteira(assinatura, posicoes):
+    """Gerador SSE: snapshot inicial e depois deltas de preço/valor_total
+
+    `posicoes`: {ticker: {'quantidade', 'preco_atual', 'valor_total'}} lidos do banco.
+    """
+    import json
+
+    def _evento(nome, dados):
+        return f"event: {nome}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n"
+
+    try:
+        yield f"retry: {SSE_KEEPALIVE * 1000}\n\n"
+        for ticker, preco in atualizador.ultimos(posicoes).items():
+            _aplicar(posicoes, ticker, preco)
+        yield _evento('snapshot', {
+            'itens': posicoes,
+            'valor_total': _total(posicoes),
+            'ts': time.time(),
+        })
+        limite = time.time() + SSE_DURACAO_MAX
+        while time.time() < limite:
+            try:
+                mudancas = assinatura.fila.get(timeout=SSE_KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            deltas = {}
+            for ticker, preco in mudancas.items():
+                if _aplicar(posicoes, ticker, preco):
+                    deltas[ticker] = {k: posicoes[ticker][k] for k in ('preco_atual', 'valor_total')}
+            if deltas:
+                yield _evento('precos', {'itens': deltas, 'valor_total': _total(posicoes), 'ts': time.time()})
+    finally:
+        atualizador.cancelar(assinatura)
+
+
+def _aplicar(posicoes, ticker, preco):
+    posicao = posicoes.get(ticker)
+    if posicao is None or posicao.get('preco_atual') == preco:
+        return False
+    posicao['preco_atual'] = preco
+    posicao['valor_total'] = round(float(posicao.get('quantidade') or 0) * float(preco), 2)
+    return True
+
+
+def _total(posicoes):
+    return round(sum(float(p.get('valor_total') or 0) for p in posicoes.values()), 2)
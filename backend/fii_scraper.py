@@ -2,29 +2,66 @@
 Módulo otimizado para scraping de dados de FIIs brasileiros
 Fontes: FundsExplorer (usando regex no HTML bruto)
 """
-import requests
 import re
 import time
-from typing import Optional, Dict
+from concurrent.futures import Future
+from typing import Optional, Dict, Iterable
+
+try:
+    from . import async_http
+except ImportError:
+    import async_http
+
+_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+}
+
+
+def _ticker_limpo(ticker: str) -> str:
+    return ticker.replace('.SA', '').replace('.sa', '').upper()
+
+
+def _buscar_pagina(ticker_limpo: str) -> Future:
+    """Future com a página do FII no FundsExplorer (cliente HTTP assíncrono)"""
+    print(f"[FundsExplorer] Buscando {ticker_limpo}...")
+    return async_http.get(f'https://www.fundsexplorer.com.br/funds/{ticker_limpo}', headers=_HEADERS, timeout=15)
 
 
 def obter_dados_fii_fundsexplorer(ticker: str) -> Optional[Dict]:
     """
     Obtém dados de FII do FundsExplorer usando regex no HTML bruto
     """
-    ticker_limpo = ticker.replace('.SA', '').replace('.sa', '').upper()
-    
-    url = f'https://www.fundsexplorer.com.br/funds/{ticker_limpo}'
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-    }
-    
+    ticker_limpo = _ticker_limpo(ticker)
+    try:
+        return _extrair_dados(ticker_limpo, _buscar_pagina(ticker_limpo).result())
+    except Exception as e:
+        print(f"[ERRO] Exception: {e}")
+        return None
+
+
+def obter_dados_fiis_fundsexplorer(tickers: Iterable[str], timeout: float = 20) -> Dict[str, Optional[Dict]]:
+    """
+    Vários FIIs de uma vez: as páginas são baixadas em paralelo
+    Retorna {ticker original: dados ou None}
+    """
+    tickers = list(dict.fromkeys(t for t in tickers if t))
+    futuros = {t: _buscar_pagina(_ticker_limpo(t)) for t in tickers}
+    respostas = async_http.resultados(futuros, timeout=timeout)
+    saida = {}
+    for ticker, response in respostas.items():
+        try:
+            saida[ticker] = _extrair_dados(_ticker_limpo(ticker), response) if response is not None else None
+        except Exception as e:
+            print(f"[ERRO] Exception: {e}")
+            saida[ticker] = None
+    return saida
+
+
+def _extrair_dados(ticker_limpo: str, response) -> Optional[Dict]:
+    """Extrai tipo/segmento/gestora da resposta do FundsExplorer"""
     try:
-        print(f"[FundsExplorer] Buscando {ticker_limpo}...")
-        response = requests.get(url, headers=headers, timeout=15)
-        
         if response.status_code != 200:
             print(f"[ERRO] Status {response.status_code}")
             return None
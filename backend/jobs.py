@@ -0,0 +1,397 @@
+"""
+Jobs em background com progresso, cancelamento e retenção do resultado.
+
+Cada job é uma linha na tabela `jobs` (public.jobs no Postgres, ou no banco de
+usuários SQLite), então qualquer worker do gunicorn responde ao polling. A
+execução acontece num pool de threads do processo que recebeu o pedido; o
+job atualiza `atualizado_em` a cada progresso, e um job sem atualização há
+mais de JOB_TIMEOUT (worker reiniciado no meio) é dado como interrompido.
+
+Um índice único parcial (chave, só jobs ativos) garante um único job ativo
+por chave mesmo com pedidos simultâneos em workers diferentes.
+
+Tipos de job são registrados com @tarefa('nome'); a função recebe um
+ContextoJob (progresso/cancelamento) e os parâmetros, e devolve algo
+serializável em JSON.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from . import models
+    from . import simulacao
+    from . import snapshots
+except ImportError:
+    import models
+    import simulacao
+    import snapshots
+
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', '2'))
+JOBS_RETENCAO = int(os.getenv('JOBS_RETENCAO_HORAS', '24')) * 3600
+JOB_TIMEOUT = 600
+# Intervalo mínimo entre gravações de progresso no banco
+_INTERVALO_PROGRESSO = 0.5
+
+ATIVOS = ('pendente', 'executando')
+FINAIS = ('concluido', 'erro', 'cancelado')
+
+_COLUNAS = ('id', 'usuario', 'tipo', 'chave', 'status', 'progresso', 'mensagem', 'params',
+            'resultado', 'erro', 'cancelar', 'criado_em', 'iniciado_em', 'concluido_em', 'atualizado_em')
+
+
+class JobCancelado(BaseException):
+    """BaseException (como CancelledError): atravessa os `except Exception` do models"""
+
+
+# ==================== REGISTRO DE TIPOS ====================
+
+_TAREFAS = {}
+
+
+def tarefa(nome, por_usuario=True):
+    """Registra uma função como tipo de job. por_usuario=False deduplica entre usuários"""
+    def decorador(funcao):
+        _TAREFAS[nome] = (funcao, por_usuario)
+        return funcao
+    return decorador
+
+
+def tipos_registrados():
+    return sorted(_TAREFAS)
+
+
+# ==================== BANCO ====================
+
+_tabela_ok = False
+
+# Job ativo sem atualização há mais de JOB_TIMEOUT: o processo que o executava morreu
+_EXPIRAR_ORFAOS = (
+    "UPDATE {tabela} SET status = 'erro', erro = COALESCE(erro, 'Job interrompido'), concluido_em = ? "
+    "WHERE status IN ('pendente', 'executando') AND atualizado_em < ?"
+)
+
+
+def _conn():
+    if models._is_postgres():
+        return models._get_pg_conn()
+    conn = sqlite3.connect(models.USUARIOS_DB_PATH, timeout=30)
+    return conn
+
+
+def _sql(query):
+    """`{tabela}` -> jobs (public.jobs no Postgres) e placeholders ? -> %s"""
+    if models._is_postgres():
+        return query.replace('{tabela}', 'public.jobs').replace('?', '%s')
+    return query.replace('{tabela}', 'jobs')
+
+
+def _executar_sql(query, params=(), fetch=None):
+    garantir_tabela()
+    conn = _conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(_sql(query), params)
+        if fetch == 'one':
+            resultado = cur.fetchone()
+        elif fetch == 'all':
+            resultado = cur.fetchall()
+        else:
+            resultado = cur.rowcount
+        conn.commit()
+        return resultado
+    finally:
+        conn.close()
+
+
+def garantir_tabela():
+    global _tabela_ok
+    if _tabela_ok:
+        return
+    real = 'DOUBLE PRECISION' if models._is_postgres() else 'REAL'
+    conn = _conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(_sql(f'''
+            CREATE TABLE IF NOT EXISTS {{tabela}} (
+                id TEXT PRIMARY KEY,
+                usuario TEXT,
+                tipo TEXT NOT NULL,
+                chave TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progresso {real} DEFAULT 0,
+                mensagem TEXT,
+                params TEXT,
+                resultado TEXT,
+                erro TEXT,
+                cancelar INTEGER DEFAULT 0,
+                criado_em {real} NOT NULL,
+                iniciado_em {real},
+                concluido_em {real},
+                atualizado_em {real} NOT NULL
+            )
+        '''))
+        cur.execute(_sql('CREATE INDEX IF NOT EXISTS idx_jobs_chave_status ON {tabela} (chave, status)'))
+        cur.execute(_sql('CREATE INDEX IF NOT EXISTS idx_jobs_usuario_criado ON {tabela} (usuario, criado_em)'))
+        conn.commit()
+        # No máximo um job ativo por chave entre todos os workers (o _pool_lock
+        # só vale dentro do processo). Jobs órfãos saem do índice antes.
+        try:
+            agora = time.time()
+            cur.execute(_sql(_EXPIRAR_ORFAOS), (agora, agora - JOB_TIMEOUT))
+            cur.execute(_sql(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_chave_ativo ON {tabela} (chave) "
+                "WHERE status IN ('pendente', 'executando') AND cancelar = 0"
+            ))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Aviso: índice único de jobs ativos não criado: {e}")
+    finally:
+        conn.close()
+    _tabela_ok = True
+
+
+def _linha_para_job(linha, com_resultado=False):
+    job = dict(zip(_COLUNAS, linha))
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    resultado = job.pop('resultado')
+    if com_resultado:
+        job['resultado'] = json.loads(resultado) if resultado else None
+    job['cancelar'] = bool(job['cancelar'])
+    if job['status'] in ATIVOS and time.time() - (job['atualizado_em'] or 0) > JOB_TIMEOUT:
+        # processo que executava morreu: nunca vai terminar
+        job['status'] = 'erro'
+        job['erro'] = job['erro'] or 'Job interrompido'
+    job.pop('chave', None)
+    return job
+
+
+def _visivel(job, usuario):
+    """Dono vê tudo; job global (por_usuario=False) de outro usuário é visível sem dono/parâmetros"""
+    if job['usuario'] == usuario:
+        return job
+    if not _TAREFAS.get(job['tipo'], (None, True))[1]:
+        return {k: v for k, v in job.items() if k not in ('usuario', 'params')}
+    return None
+
+
+def obter_job(usuario, job_id, com_resultado=False):
+    linha = _executar_sql(f"SELECT {', '.join(_COLUNAS)} FROM {{tabela}} WHERE id = ?", (job_id,), fetch='one')
+    return _visivel(_linha_para_job(linha, com_resultado), usuario) if linha else None
+
+
+def listar_jobs(usuario, limite=20):
+    linhas = _executar_sql(
+        f"SELECT {', '.join(_COLUNAS)} FROM {{tabela}} WHERE usuario = ? ORDER BY criado_em DESC LIMIT ?",
+        (usuario, int(limite)), fetch='all'
+    )
+    return [_linha_para_job(linha) for linha in linhas]
+
+
+def _limpar_antigos():
+    limite = time.time() - JOBS_RETENCAO
+    _executar_sql(
+        "DELETE FROM {tabela} WHERE (status IN ('concluido', 'erro', 'cancelado') AND concluido_em < ?) "
+        "OR atualizado_em < ?",
+        (limite, limite)
+    )
+
+
+# ==================== EXECUÇÃO ====================
+
+class ContextoJob:
+    """Passado para a função do job: reporta progresso e verifica cancelamento"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._ultima_gravacao = 0.0
+
+    def cancelado(self):
+        linha = _executar_sql("SELECT cancelar FROM {tabela} WHERE id = ?", (self.job_id,), fetch='one')
+        return bool(linha and linha[0])
+
+    def progresso(self, fracao, mensagem=None):
+        """fracao em [0, 1]; levanta JobCancelado se o usuário cancelou"""
+        agora = time.time()
+        if agora - self._ultima_gravacao < _INTERVALO_PROGRESSO and fracao < 1:
+            return
+        self._ultima_gravacao = agora
+        _executar_sql(
+            "UPDATE {tabela} SET progresso = ?, mensagem = COALESCE(?, mensagem), atualizado_em = ? WHERE id = ?",
+            (round(max(0.0, min(1.0, float(fracao))) * 100, 1), mensagem, agora, self.job_id)
+        )
+        if self.cancelado():
+            raise JobCancelado()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obter_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=JOBS_WORKERS, thread_name_prefix='jobs')
+        return _pool
+
+
+def _finalizar(job_id, status, resultado=None, erro=None):
+    agora = time.time()
+    _executar_sql(
+        "UPDATE {tabela} SET status = ?, resultado = ?, erro = ?, concluido_em = ?, atualizado_em = ?, "
+        "progresso = CASE WHEN ? = 'concluido' THEN 100 ELSE progresso END WHERE id = ?",
+        (status, resultado, erro, agora, agora, status, job_id)
+    )
+
+
+def _executar(app, job_id, usuario, tipo, params):
+    funcao, _ = _TAREFAS[tipo]
+    ctx = ContextoJob(job_id)
+    try:
+        agora = time.time()
+        iniciou = _executar_sql(
+            "UPDATE {tabela} SET status = 'executando', iniciado_em = ?, atualizado_em = ? "
+            "WHERE id = ? AND status = 'pendente' AND cancelar = 0",
+            (agora, agora, job_id)
+        )
+        if not iniciou:
+            _finalizar(job_id, 'cancelado')
+            return
+        with app.app_context(), models.usuario_contexto(usuario):
+            resultado = funcao(ctx, **params)
+        _finalizar(job_id, 'concluido', resultado=app.json.dumps(resultado))
+    except JobCancelado:
+        _finalizar(job_id, 'cancelado')
+    except Exception as e:
+        print(f"Erro no job {tipo} ({job_id}) de {usuario}: {e}")
+        try:
+            _finalizar(job_id, 'erro', erro=str(e))
+        except Exception:
+            pass
+
+
+def _chave(usuario, tipo, params, por_usuario):
+    partes = {'tipo': tipo, 'params': params, 'usuario': usuario if por_usuario else None}
+    return hashlib.sha256(json.dumps(partes, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+def _job_ativo(chave, usuario):
+    linha = _executar_sql(
+        f"SELECT {', '.join(_COLUNAS)} FROM {{tabela}} WHERE chave = ? AND status IN ('pendente', 'executando') "
+        "AND cancelar = 0 ORDER BY criado_em DESC LIMIT 1",
+        (chave,), fetch='one'
+    )
+    return _visivel(_linha_para_job(linha), usuario) if linha else None
+
+
+def submeter(app, usuario, tipo, params=None):
+    """Cria o job (ou devolve o mesmo job já em andamento) e agenda a execução"""
+    if tipo not in _TAREFAS:
+        raise ValueError(f"Tipo de job inválido: {tipo}")
+    params = dict(params or {})
+    _, por_usuario = _TAREFAS[tipo]
+    chave = _chave(usuario, tipo, params, por_usuario)
+    try:
+        _limpar_antigos()
+    except Exception:
+        pass
+
+    with _pool_lock:
+        _executar_sql(_EXPIRAR_ORFAOS + " AND chave = ?", (time.time(), time.time() - JOB_TIMEOUT, chave))
+        existente = _job_ativo(chave, usuario)
+        if existente:
+            return existente
+
+        job_id = uuid.uuid4().hex
+        agora = time.time()
+        try:
+            _executar_sql(
+                "INSERT INTO {tabela} (id, usuario, tipo, chave, status, progresso, params, cancelar, criado_em, atualizado_em) "
+                "VALUES (?, ?, ?, ?, 'pendente', 0, ?, 0, ?, ?)",
+                (job_id, usuario, tipo, chave, json.dumps(params), agora, agora)
+            )
+        except Exception:
+            # outro worker criou o mesmo job entre o SELECT e o INSERT (índice único)
+            existente = _job_ativo(chave, usuario)
+            if existente:
+                return existente
+            raise
+    _obter_pool().submit(_executar, app, job_id, usuario, tipo, params)
+    return obter_job(usuario, job_id)
+
+
+def cancelar(usuario, job_id):
+    """Pede o cancelamento; job pendente é cancelado na hora, em execução no próximo progresso"""
+    agora = time.time()
+    _executar_sql(
+        "UPDATE {tabela} SET cancelar = 1, atualizado_em = ? WHERE id = ? AND usuario = ? AND status IN ('pendente', 'executando')",
+        (agora, job_id, usuario)
+    )
+    _executar_sql(
+        "UPDATE {tabela} SET status = 'cancelado', concluido_em = ? WHERE id = ? AND usuario = ? AND status = 'pendente'",
+        (agora, job_id, usuario)
+    )
+    return obter_job(usuario, job_id)
+
+
+# ==================== TIPOS DE JOB ====================
+
+@tarefa('carregar_ativos', por_usuario=False)
+def _job_carregar_ativos(ctx):
+    models.carregar_ativos(progresso=ctx.progresso)
+    df = models.global_state.get("df_ativos")
+    return {"ativos": 0 if df is None else int(len(df))}
+
+
+@tarefa('atualizar_carteira')
+def _job_atualizar_carteira(ctx):
+    ctx.progresso(0, 'Atualizando preços da carteira')
+    resultado = models.atualizar_carteira_coordenado(forcar=True)
+    usuario = models.get_usuario_atual()
+    if usuario:
+        models.cache.delete(f"carteira:{usuario}")
+        models.cache.delete(f"carteira_insights:{usuario}")
+    return resultado
+
+
+@tarefa('snapshots_carteira')
+def _job_snapshots_carteira(ctx):
+    usuario = models.get_usuario_atual()
+    dias = snapshots.reconstruir(usuario, progresso=ctx.progresso)
+    if dias is None:
+        raise RuntimeError("Base de preços incompleta; tente novamente")
+    ctx.progresso(0.9, 'Gravando snapshot do dia')
+    total = snapshots.gravar_snapshot_hoje(usuario)
+    return {"dias_reconstruidos": dias, "valor_total": total}
+
+
+@tarefa('filtrar_ativos', por_usuario=False)
+def _job_filtrar_ativos(ctx, tipo='acoes', filtros=None):
+    if tipo not in ('acoes', 'bdrs', 'fiis'):
+        raise ValueError("Tipo inválido")
+    ctx.progresso(0, 'Filtrando ativos')
+    return models.filtrar_ativos(tipo, filtros)
+
+
+@tarefa('monte_carlo')
+def _job_monte_carlo(ctx, n_simulacoes=10000, periodo_anos=5, confianca=95, seed=None, agrupamento='classe'):
+    params = simulacao.params_monte_carlo(n_simulacoes, periodo_anos, confianca, seed, agrupamento)
+
+    def calcular(carteira):
+        ctx.progresso(0, 'Estimando parâmetros')
+        plano = simulacao.preparar_monte_carlo(params, carteira)
+        resultado = None
+        for feitas, resultado in simulacao.resultados_monte_carlo(plano):
+            ctx.progresso(0.1 + 0.9 * feitas / plano['n'], f'{feitas} trajetórias')
+        return resultado
+
+    # mesma chave de cache das rotas do simulador
+    return simulacao.com_cache('monte_carlo', params, calcular)
@@ -0,0 +1,127 @@
+"""
+Provider JSON do Flask com suporte nativo a tipos do pandas/NumPy.
+
+Usa orjson quando disponível (serializa arrays e escalares NumPy sem passar
+por objetos Python) e cai para o json da biblioteca padrão caso contrário.
+Datas continuam no formato HTTP (RFC 822) usado pelo provider padrão do
+Flask, para não mudar o contrato com o frontend.
+"""
+
+import dataclasses
+import decimal
+import math
+import uuid
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+
+def _default(obj):
+    """Tipos que nem o orjson nem o json padrão sabem serializar"""
+    if isinstance(obj, date):
+        if obj is pd.NaT:
+            return None
+        return http_date(obj)
+    if isinstance(obj, decimal.Decimal):
+        valor = float(obj)
+        return valor if math.isfinite(valor) else None
+    if isinstance(obj, np.generic):
+        valor = obj.item()
+        if isinstance(valor, float) and not math.isfinite(valor):
+            return None
+        if isinstance(valor, date):
+            return http_date(valor)
+        return valor
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict('records')
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.tolist()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _normalizar(obj):
+    """Para o json padrão: aplica _default já na montagem e troca NaN/Infinity
+    por None, como o orjson faz (o json padrão escreveria NaN, que não é JSON)"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if obj is None or isinstance(obj, (str, int)):
+        return obj
+    if isinstance(obj, dict):
+        return {k: _normalizar(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalizar(v) for v in obj]
+    return _normalizar(_default(obj))
+
+
+def _dataframe_sem_datas(df):
+    """DataFrame que pode ir direto pelo encoder C do pandas (sem colunas de data)"""
+    return not any(
+        pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_timedelta64_dtype(dtype)
+        for dtype in df.dtypes
+    ) and not isinstance(df.index, pd.MultiIndex)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider com orjson e suporte a NumPy/pandas/Decimal"""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+    if orjson is not None:
+        _OPCOES = (
+            orjson.OPT_SERIALIZE_NUMPY
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+    def dumps_bytes(self, obj, **kwargs) -> bytes:
+        if orjson is not None and not kwargs.get('indent'):
+            opcoes = self._OPCOES | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+            try:
+                return orjson.dumps(obj, default=_default, option=opcoes)
+            except TypeError:
+                # inteiros > 64 bits, chaves exóticas etc.: deixa o json padrão tentar
+                pass
+        return super().dumps(_normalizar(obj), **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self.dumps_bytes(obj, **kwargs).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        dump_args = {}
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args['indent'] = 2
+
+        # DataFrame no topo: o encoder C do pandas gera os registros sem
+        # montar a lista de dicts intermediária
+        if isinstance(obj, pd.DataFrame) and not dump_args and _dataframe_sem_datas(obj):
+            corpo = obj.to_json(orient='records', force_ascii=False, double_precision=15)
+            return self._app.response_class(corpo + "\n", mimetype=self.mimetype)
+
+        if not dump_args:
+            dump_args['separators'] = (',', ':')
+        return self._app.response_class(self.dumps_bytes(obj, **dump_args) + b"\n", mimetype=self.mimetype)
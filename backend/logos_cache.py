@@ -0,0 +1,104 @@
+"""
+Proxy de logos com cache em disco.
+
+Com LOGOS_PROXY=1 o manifesto de logos aponta para /api/logos/img/<ticker> e
+as imagens são baixadas do img.logo.dev uma única vez, gravadas no volume
+local (LOGOS_DIR) e servidas com ETag. Sem a variável, a rota só redireciona
+para a URL de origem.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+LOGOS_DIR = os.getenv('LOGOS_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'bancos_usuarios', '_logos'
+)
+LOGOS_PROXY = os.getenv('LOGOS_PROXY', '').lower() in ('1', 'true', 'yes', 'on')
+# Depois disso a imagem é baixada de novo (o ETag só muda se o conteúdo mudar)
+LOGOS_TTL = int(os.getenv('LOGOS_TTL_DIAS', '30')) * 86400
+# Falha de download não é repetida antes disso
+_FALHA_TTL = 3600
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock_para(chave):
+    with _locks_lock:
+        return _locks.setdefault(chave, threading.Lock())
+
+
+def _caminhos(ticker):
+    seguro = ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in ticker.lower())
+    base = os.path.join(LOGOS_DIR, seguro)
+    return base + '.img', base + '.json'
+
+
+def _ler_meta(caminho_meta):
+    try:
+        with open(caminho_meta, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar(caminho, conteudo, modo='wb'):
+    tmp = f"{caminho}.{os.getpid()}.tmp"
+    with open(tmp, modo) as f:
+        f.write(conteudo)
+    os.replace(tmp, caminho)
+
+
+def _baixar(url, caminho_img, caminho_meta):
+    r = requests.get(url, timeout=10)
+    tipo = r.headers.get('Content-Type', '')
+    if r.status_code != 200 or not tipo.startswith('image/'):
+        print(f"Logo indisponível em {url}: HTTP {r.status_code} {tipo}")
+        return None
+    _gravar(caminho_img, r.content)
+    meta = {
+        'content_type': tipo,
+        'etag': hashlib.sha1(r.content).hexdigest()[:20],
+        'baixado_em': time.time(),
+        'origem': url,
+    }
+    _gravar(caminho_meta, json.dumps(meta), 'w')
+    return meta
+
+
+def obter_logo(ticker, url):
+    """Retorna (caminho, meta) da imagem em disco, baixando se preciso; None se não houver"""
+    os.makedirs(LOGOS_DIR, exist_ok=True)
+    caminho_img, caminho_meta = _caminhos(ticker)
+    meta = _ler_meta(caminho_meta)
+    agora = time.time()
+    if meta and meta.get('etag') and os.path.exists(caminho_img) and agora - meta.get('baixado_em', 0) < LOGOS_TTL:
+        return caminho_img, meta
+    if meta and meta.get('erro') and agora - meta.get('baixado_em', 0) < _FALHA_TTL:
+        return None
+
+    with _lock_para(caminho_img):
+        # outra thread pode ter baixado enquanto esperávamos o lock
+        meta = _ler_meta(caminho_meta)
+        if meta and meta.get('etag') and os.path.exists(caminho_img) \
+                and time.time() - meta.get('baixado_em', 0) < LOGOS_TTL:
+            return caminho_img, meta
+        try:
+            novo = _baixar(url, caminho_img, caminho_meta)
+        except requests.RequestException as e:
+            print(f"Erro ao baixar logo de {ticker}: {e}")
+            novo = None
+        if novo:
+            return caminho_img, novo
+        if meta and meta.get('etag') and os.path.exists(caminho_img):
+            # origem fora do ar: serve a cópia antiga e tenta de novo em _FALHA_TTL
+            meta['baixado_em'] = time.time() - LOGOS_TTL + _FALHA_TTL
+            _gravar(caminho_meta, json.dumps(meta), 'w')
+            return caminho_img, meta
+        _gravar(caminho_meta, json.dumps({'erro': True, 'baixado_em': time.time()}), 'w')
+        return None
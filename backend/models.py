@@ -1,5 +1,9 @@
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import base64
 import pandas as pd
+import numpy as np
 import yfinance as yf
 from flask import Flask
 from flask_caching import Cache
@@ -986,6 +990,19 @@ def set_usuario_atual(username):
     with SESSION_LOCK:
         USUARIO_ATUAL = username
 
+
+_usuario_contexto = threading.local()
+
+@contextmanager
+def usuario_contexto(username):
+    """Fixa o usuário de get_usuario_atual() na thread atual (jobs em background, fora do request)"""
+    anterior = getattr(_usuario_contexto, 'username', None)
+    _usuario_contexto.username = username
+    try:
+        yield username
+    finally:
+        _usuario_contexto.username = anterior
+
 def _create_sessions_table_if_needed():
     if _is_postgres():
         conn = _get_pg_conn()
@@ -1087,6 +1104,10 @@ def invalidar_todas_sessoes() -> None:
             pass
 def get_usuario_atual():
     print("DEBUG: get_usuario_atual chamada")
+
+    usuario_fixado = getattr(_usuario_contexto, 'username', None)
+    if usuario_fixado:
+        return usuario_fixado
    
     try:
         from flask import request, g
@@ -1259,29 +1280,74 @@ try:
     from .assets_lists import LISTA_ACOES, LISTA_FIIS, LISTA_BDRS
 except ImportError:
     from assets_lists import LISTA_ACOES, LISTA_FIIS, LISTA_BDRS
+try:
+    from . import ticker_search
+    from . import async_http
+except ImportError:
+    import ticker_search
+    import async_http
+
+try:
+    from .optimizations import performance_monitor, ttl_mercado
+except ImportError:
+    from optimizations import performance_monitor, ttl_mercado
+try:
+    from .posicoes import LinhaTempoPosicoes, valores_em
+except ImportError:
+    from posicoes import LinhaTempoPosicoes, valores_em
 
 df_ativos = None
 carregamento_em_andamento = False
 lock = threading.Lock()  
 
 
-cache = Cache(config={'CACHE_TYPE': 'SimpleCache'})
+def _config_cache(prefixo, **extra):
+    """Config do flask-caching a partir do ambiente.
+
+    SimpleCache (padrão) é por processo; com CACHE_TYPE=FileSystemCache ou
+    RedisCache os workers do gunicorn compartilham o cache (o agendador aquece
+    para todos). O prefixo separa as instâncias: no Redis o clear() apaga só
+    as chaves com o prefixo, não o banco inteiro.
+    """
+    tipo = os.getenv('CACHE_TYPE', 'SimpleCache')
+    config = {'CACHE_TYPE': tipo, 'CACHE_KEY_PREFIX': f"finmas_{prefixo}:"}
+    if tipo == 'FileSystemCache':
+        base = os.getenv('CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bancos_usuarios', '_cache')
+        config['CACHE_DIR'] = os.path.join(base, prefixo)
+        config['CACHE_THRESHOLD'] = int(os.getenv('CACHE_THRESHOLD', '5000'))
+    elif tipo == 'RedisCache':
+        config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL') or os.getenv('REDIS_URL')
+    config.update(extra)
+    return config
+
+
+cache = Cache(config=_config_cache('usuario'))
+# Dados públicos de mercado (por ticker, iguais para todos os usuários). Instância
+# separada: o cache.clear() disparado por escritas do usuário não apaga este.
+cache_publico = Cache(config=_config_cache('publico', CACHE_THRESHOLD=2000))
 
 global_state = {"df_ativos": None, "carregando": False}
 
-def carregar_ativos():
+def carregar_ativos(progresso=None):
+    """Carrega e filtra ações, BDRs e FIIs; `progresso(fracao, mensagem)` é chamado por ticker (jobs.py)"""
     acoes = LISTA_ACOES
     fiis = LISTA_FIIS
     bdrs = LISTA_BDRS
-    
+    total = len(acoes) + len(bdrs) + len(fiis)
+
+    def _etapa(feitos, tamanho, mensagem):
+        if progresso is None:
+            return None
+        return lambda fracao: progresso((feitos + fracao * tamanho) / total, mensagem)
+
     try:
         print("🔄 Iniciando carregamento de ativos...")
         
 
 
-        acoes_filtradas = processar_ativos(acoes, 'Ação')
-        bdrs_filtradas = processar_ativos(bdrs, 'BDR')
-        fiis_filtradas = processar_ativos(fiis, 'FII')
+        acoes_filtradas = processar_ativos(acoes, 'Ação', _etapa(0, len(acoes), 'Carregando ações'))
+        bdrs_filtradas = processar_ativos(bdrs, 'BDR', _etapa(len(acoes), len(bdrs), 'Carregando BDRs'))
+        fiis_filtradas = processar_ativos(fiis, 'FII', _etapa(len(acoes) + len(bdrs), len(fiis), 'Carregando FIIs'))
 
 
 
@@ -1300,6 +1366,8 @@ def carregar_ativos():
             print(f" Colunas disponíveis: {df_ativos.columns.tolist()}")
 
         global_state["df_ativos"] = df_ativos
+        if not df_ativos.empty:
+            ticker_search.atualizar(df_ativos.to_dict('records'))
 
     except Exception as e:
         print(f" Erro no carregamento dos ativos: {e}")
@@ -1539,9 +1607,13 @@ def aplicar_filtros_fiis(dados):
 
 
 
-def processar_ativos(lista, tipo):
+def processar_ativos(lista, tipo, progresso=None):
 
-    dados = [obter_informacoes(ticker, tipo) for ticker in lista]
+    dados = []
+    for i, ticker in enumerate(lista):
+        dados.append(obter_informacoes(ticker, tipo))
+        if progresso:
+            progresso((i + 1) / len(lista))
     dados = [d for d in dados if d is not None] 
 
     print(f"🔍 {tipo}: {len(dados)} ativos recuperados antes dos filtros.")
@@ -1841,13 +1913,15 @@ def processar_ativos_fiis_com_filtros(dy_min, dy_max, liq_min, tipo_fii=None, se
     # Aplicar filtros de tipo e segmento se fornecidos
     if tipo_fii or segmento_fii:
         filtrados_final = []
+        # Metadados de todos os candidatos baixados em paralelo
+        from fii_scraper import obter_dados_fiis_fundsexplorer
+        metadados = obter_dados_fiis_fundsexplorer([a.get('ticker', '') for a in filtrados])
         for ativo in filtrados:
             ticker = ativo.get('ticker', '')
             
             # Buscar metadados do FII
             try:
-                from fii_scraper import obter_dados_fii_fundsexplorer
-                metadata = obter_dados_fii_fundsexplorer(ticker)
+                metadata = metadados.get(ticker)
                 
                 if metadata:
                     ativo_tipo = metadata.get('tipo')
@@ -1887,6 +1961,29 @@ def processar_ativos_fiis_com_filtros(dy_min, dy_max, liq_min, tipo_fii=None, se
     
     return sorted(filtrados, key=lambda x: x['dividend_yield'], reverse=True)[:10]
 
+
+def filtrar_ativos(tipo, filtros=None):
+    """Screener por tipo ('acoes', 'bdrs', 'fiis'); usado pela rota e pelo job"""
+    filtros = filtros or {}
+    if tipo in ('acoes', 'bdrs'):
+        processar = processar_ativos_acoes_com_filtros if tipo == 'acoes' else processar_ativos_bdrs_com_filtros
+        return processar(
+            filtros.get('roe_min', 0),
+            filtros.get('dy_min', 0),
+            filtros.get('pl_min', 0),
+            filtros.get('pl_max', float('inf')),
+            filtros.get('pvp_max', float('inf'))
+        )
+    if tipo == 'fiis':
+        return processar_ativos_fiis_com_filtros(
+            filtros.get('dy_min', 0),
+            filtros.get('dy_max', float('inf')),
+            filtros.get('liq_min', 0),
+            filtros.get('tipo_fii'),
+            filtros.get('segmento_fii')
+        )
+    raise ValueError("Tipo inválido")
+
 # ==================== FUNÇÕES DE CARTEIRA ====================
 
 def init_carteira_db(usuario=None):
@@ -2114,39 +2211,38 @@ def obter_informacoes_ativo(ticker):
         print(f"Erro ao obter informações de {ticker}: {e}")
         return None
 
+def sgs_futuro(serie_id, inicio=None, fim=None, ultimos=None):
+    """Série SGS do BCB como Future (async_http): lista de {'data', 'valor'}"""
+    if ultimos:
+        url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{serie_id}/dados/ultimos/{int(ultimos)}"
+        return async_http.get_json(url, params={'formato': 'json'})
+    params = {'formato': 'json'}
+    if inicio:
+        params['dataInicial'] = inicio.strftime('%d/%m/%Y')
+        params['dataFinal'] = (fim or datetime.now()).strftime('%d/%m/%Y')
+    return async_http.get_json(f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{serie_id}/dados", params=params)
+
+
 def obter_taxas_indexadores():
     """Obtém as taxas atuais dos indexadores (SELIC, CDI, IPCA)"""
     try:
-        import requests
-        from datetime import datetime, timedelta
-        
-        def sgs_last(series_id, use_range=False):
+        inicio = datetime.now() - timedelta(days=90)
+        # As três séries em paralelo no cliente assíncrono
+        series = async_http.resultados({
+            'selic': sgs_futuro(432, inicio=inicio),  # SELIC (série 432) - taxa anual
+            'cdi': sgs_futuro(12, inicio=inicio),     # CDI (série 12) - taxa anual
+            'ipca': sgs_futuro(433, ultimos=1),       # IPCA (série 433) - taxa mensal
+        }, timeout=12)
+
+        def _ultimo(arr):
             try:
-                if use_range:
-                    end_date = datetime.now()
-                    start_date = end_date - timedelta(days=90)
-                    url = (f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{series_id}/dados?"
-                           f"formato=json&dataInicial={start_date.strftime('%d/%m/%Y')}"
-                           f"&dataFinal={end_date.strftime('%d/%m/%Y')}")
-                    r = requests.get(url, timeout=10)
-                    r.raise_for_status()
-                    arr = r.json()
-                    return float(arr[-1]['valor']) if arr else None
-                else:
-                    url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{series_id}/dados/ultimos/1?formato=json"
-                    r = requests.get(url, timeout=10)
-                    r.raise_for_status()
-                    arr = r.json()
-                    return float(arr[0]['valor']) if arr else None
-            except Exception:
+                return float(arr[-1]['valor']) if arr else None
+            except (KeyError, TypeError, ValueError):
                 return None
-        
-        # SELIC (série 432) - taxa anual
-        selic = sgs_last(432, use_range=True)
-        # CDI (série 12) - taxa anual
-        cdi = sgs_last(12, use_range=True)
-        # IPCA (série 433) - taxa mensal
-        ipca = sgs_last(433)
+
+        selic = _ultimo(series['selic'])
+        cdi = _ultimo(series['cdi'])
+        ipca = _ultimo(series['ipca'])
         
         print(f"DEBUG: Taxas obtidas - SELIC: {selic}%, CDI: {cdi}%, IPCA: {ipca}%")
         
@@ -2184,7 +2280,6 @@ def obter_taxas_indexadores():
 def _obter_taxa_media_historica(indexador, data_inicio):
     """Obtém a taxa média histórica de um indexador desde uma data específica"""
     try:
-        import requests
         from datetime import datetime, timedelta
         
         # Determinar série do indexador
@@ -2204,16 +2299,7 @@ def _obter_taxa_media_historica(indexador, data_inicio):
         
         # Buscar dados históricos do Banco Central
         try:
-            url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{serie_id}/dados"
-            params = {
-                'formato': 'json',
-                'dataInicial': data_inicio.strftime('%d/%m/%Y'),
-                'dataFinal': data_fim.strftime('%d/%m/%Y')
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            dados = response.json()
+            dados = sgs_futuro(serie_id, inicio=data_inicio, fim=data_fim).result()
             
             if not dados:
                 print(f"DEBUG: Nenhum dado histórico encontrado para {indexador}")
@@ -2255,21 +2341,9 @@ def _obter_taxa_media_historica(indexador, data_inicio):
 def _obter_ipca_medio_historico(data_inicio):
     """Obtém o IPCA médio mensal histórico desde uma data específica"""
     try:
-        import requests
-        from datetime import datetime
-        
         # Buscar IPCA mensal (série 433)
         try:
-            url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.433/dados"
-            params = {
-                'formato': 'json',
-                'dataInicial': data_inicio.strftime('%d/%m/%Y'),
-                'dataFinal': datetime.now().strftime('%d/%m/%Y')
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            dados = response.json()
+            dados = sgs_futuro(433, inicio=data_inicio).result()
             
             if not dados:
                 print("DEBUG: Nenhum dado histórico de IPCA encontrado")
@@ -2304,7 +2378,6 @@ def _obter_ipca_medio_historico(data_inicio):
 def _obter_taxa_atual_indexador(indexador):
     """Obtém a taxa atual de um indexador usando a mesma abordagem que já funciona"""
     try:
-        import requests
         from datetime import datetime, timedelta
         
         # Determinar série do indexador
@@ -2319,10 +2392,7 @@ def _obter_taxa_atual_indexador(indexador):
         
         # Buscar dados atuais do Banco Central
         try:
-            url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{serie_id}/dados/ultimos/1?formato=json"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            dados = response.json()
+            dados = sgs_futuro(serie_id, ultimos=1).result()
             
             if not dados:
                 print(f"DEBUG: Nenhum dado atual encontrado para {indexador}")
@@ -2499,7 +2569,34 @@ def converter_crypto_usd_para_brl(preco_usd, taxa_usd_brl=None):
     
     return preco_usd * taxa_usd_brl
 
-def obter_precos_batch(tickers):
+def obter_precos_batch(tickers, ttl=300, forcar=False):
+    """
+    Preços em batch com cache compartilhado entre usuários (cache_publico).
+
+    Só os tickers sem preço recente vão ao Yahoo; o agendador busca a união
+    das carteiras ativas de uma vez e as atualizações por usuário reaproveitam.
+    Com `forcar` (refresh pedido pelo usuário) todos vão ao Yahoo e o cache é
+    regravado.
+    """
+    if not tickers:
+        return {}
+    precos = {}
+    faltando = []
+    for ticker in tickers:
+        cached = None if forcar else cache_publico.get(f"preco_batch:{_normalize_ticker_for_yf(ticker)}")
+        if cached is not None:
+            precos[ticker] = cached
+        else:
+            faltando.append(ticker)
+    if faltando:
+        novos = _buscar_precos_batch(faltando)
+        timeout = ttl_mercado(ttl)
+        for ticker, dados in novos.items():
+            cache_publico.set(f"preco_batch:{_normalize_ticker_for_yf(ticker)}", dados, timeout=timeout)
+        precos.update(novos)
+    return precos
+
+def _buscar_precos_batch(tickers):
     """
     Obtém preços de múltiplos tickers em uma única requisição
     Muito mais eficiente que fazer 1 requisição por ticker
@@ -2582,8 +2679,8 @@ def obter_precos_batch(tickers):
         print(f"❌ Erro no batch de preços: {e}")
         return {}
 
-def atualizar_precos_indicadores_carteira():
-  
+def atualizar_precos_indicadores_carteira(forcar=False):
+    """Grava preço e indicadores atuais de cada ativo; `forcar` ignora o cache de preços"""
     try:
         usuario = get_usuario_atual()
         if not usuario:
@@ -2611,7 +2708,7 @@ def atualizar_precos_indicadores_carteira():
                     
                     # Buscar todos os preços de uma vez
                     print(f"🔄 Buscando preços em batch para {len(tickers_para_buscar)} tickers...")
-                    precos_batch = obter_precos_batch(tickers_para_buscar)
+                    precos_batch = obter_precos_batch(tickers_para_buscar, forcar=forcar)
                     
                     # Processar cada ativo com os preços já obtidos
                     for row in rows:
@@ -2682,7 +2779,7 @@ def atualizar_precos_indicadores_carteira():
                 
                 # Buscar todos os preços de uma vez
                 print(f"🔄 Buscando preços em batch para {len(tickers_para_buscar)} tickers (SQLite)...")
-                precos_batch = obter_precos_batch(tickers_para_buscar)
+                precos_batch = obter_precos_batch(tickers_para_buscar, forcar=forcar)
                 
                 for row in rows:
                     _id, _ticker, _qtd = row[0], str(row[1] or ''), float(row[2] or 0)
@@ -2752,6 +2849,85 @@ def atualizar_precos_indicadores_carteira():
     except Exception as e:
         return {"success": False, "message": f"Erro ao atualizar carteira: {str(e)}"}
 
+
+# Refresh concluído há menos que isso (s) é reaproveitado em vez de refeito
+REFRESH_JANELA = int(os.getenv('REFRESH_JANELA', '60'))
+_refresh_lock = threading.Lock()
+_refresh_em_andamento = {}
+
+
+def _chave_refresh(usuario):
+    return f"carteira_refresh:{usuario}"
+
+
+def invalidar_refresh_carteira(usuario):
+    """Carteira alterada: o próximo refresh não pode reaproveitar o anterior"""
+    try:
+        cache.delete(_chave_refresh(usuario))
+    except Exception:
+        pass
+
+
+def _refresh_recente(usuario, janela):
+    try:
+        recente = cache.get(_chave_refresh(usuario))
+    except Exception:
+        return None
+    if recente and time.time() - recente['em'] < janela:
+        return dict(recente['resultado'], recente=True, atualizado_em=recente['em'])
+    return None
+
+
+def atualizar_carteira_coordenado(janela=None, forcar=False):
+    """
+    atualizar_precos_indicadores_carteira com singleflight por usuário.
+
+    Pedidos simultâneos do mesmo usuário (duas abas, clique duplo) esperam a
+    execução em andamento e recebem o mesmo resultado; um refresh concluído
+    há menos de `janela` segundos (REFRESH_JANELA) é devolvido sem refazer.
+    O singleflight vale por processo; a janela vale entre workers quando o
+    cache é compartilhado (FileSystemCache/RedisCache). `forcar` (refresh
+    pedido pelo usuário) busca cotações novas em vez das do cache_publico.
+    """
+    usuario = get_usuario_atual()
+    if not usuario:
+        return atualizar_precos_indicadores_carteira(forcar=forcar)
+    janela = REFRESH_JANELA if janela is None else janela
+
+    with _refresh_lock:
+        futuro = _refresh_em_andamento.get(usuario)
+        dono = futuro is None
+        if dono:
+            recente = _refresh_recente(usuario, janela) if janela > 0 else None
+            if recente is not None:
+                return recente
+            futuro = Future()
+            _refresh_em_andamento[usuario] = futuro
+    if not dono:
+        return futuro.result()
+
+    try:
+        resultado = atualizar_precos_indicadores_carteira(forcar=forcar)
+        if resultado.get("success"):
+            try:
+                cache.set(_chave_refresh(usuario), {'em': time.time(), 'resultado': resultado},
+                          timeout=max(REFRESH_JANELA, janela, 1))
+            except Exception:
+                pass
+            try:
+                from . import relatorios
+            except ImportError:
+                import relatorios
+            relatorios.marcar_precos_atualizados(usuario)
+        futuro.set_result(resultado)
+        return resultado
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    finally:
+        with _refresh_lock:
+            _refresh_em_andamento.pop(usuario, None)
+
 def _calcular_status_vencimento(vencimento):
 
     if not vencimento:
@@ -3326,6 +3502,7 @@ def _ensure_goals_schema():
         finally:
             conn.close()
 
+@performance_monitor.timed_query()
 def get_goals():
     usuario = get_usuario_atual()
     if not usuario:
@@ -3400,56 +3577,61 @@ def save_goals(payload: dict):
     finally:
         conn.close()
 
-def compute_goals_projection(goal: dict):
-   
-    itens = obter_carteira() or []
+def compute_goals_projection(goal: dict, carteira=None):
+    """Roadmap determinístico da meta em forma fechada; com goal['simulacao'],
+    também a probabilidade de atingir o capital alvo (simulacao.simular_meta).
+    `carteira` já lida (ex.: pelo com_cache) evita uma segunda leitura."""
+    itens = (carteira if carteira is not None else obter_carteira()) or []
     total_atual = float(sum((it.get('valor_total') or 0.0) for it in itens)) if itens else 0.0
     tipo = (goal.get('tipo') or 'renda')
     alvo = float(goal.get('alvo') or 0)
     horizonte_meses = int(goal.get('horizonte_meses') or 0) if goal.get('horizonte_meses') is not None else 0
     aporte_mensal = float(goal.get('aporte_mensal') or 0)
     premissas = goal.get('premissas') or {}
+    if not isinstance(premissas, dict):
+        premissas = {}
 
-   
-    dy_por_classe = (premissas.get('dy_por_classe') or {}) if isinstance(premissas, dict) else {}
-    
-  
     taxa_crescimento = goal.get('taxa_crescimento')
     if taxa_crescimento is not None:
         retorno_anual = float(taxa_crescimento)
     else:
-        retorno_anual = float(premissas.get('retorno_anual', 0.10)) if isinstance(premissas, dict) else 0.10
-    
+        retorno_anual = float(premissas.get('retorno_anual', 0.10))
     taxa_mensal = (1 + retorno_anual) ** (1/12) - 1
+    # reajuste anual do aporte (ex.: pela inflação); 0 mantém o aporte fixo
+    reajuste_aporte = float(premissas.get('reajuste_aporte_anual') or 0)
 
-   
     if tipo == 'renda':
-        
-        dy_mensal = float(premissas.get('dy_mensal_global', retorno_anual/12)) if isinstance(premissas, dict) else (retorno_anual/12)
+        dy_mensal = float(premissas.get('dy_mensal_global', retorno_anual/12))
         capital_alvo = alvo / max(1e-9, dy_mensal)
     else:
         capital_alvo = alvo
 
-  
+    n = horizonte_meses if horizonte_meses and horizonte_meses > 0 else 120
+    meses = np.arange(1, n + 1)
+    crescimento = (1 + taxa_mensal) ** meses
+    # saldo acumulado por unidade de aporte: ((1+r)^m - 1)/r com aporte fixo
+    if reajuste_aporte:
+        cronograma = (1 + reajuste_aporte) ** ((meses - 1) // 12)
+        por_aporte = crescimento * np.cumsum(cronograma / crescimento)
+    elif taxa_mensal:
+        cronograma = np.ones(n)
+        por_aporte = (crescimento - 1) / taxa_mensal
+    else:
+        cronograma = np.ones(n)
+        por_aporte = meses.astype(float)
+
     aporte_sugerido = aporte_mensal
     if aporte_sugerido <= 0 and horizonte_meses > 0:
-       
-        from math import isfinite
-        fv_residual = max(0.0, capital_alvo - (total_atual * ((1 + taxa_mensal) ** horizonte_meses)))
-        if taxa_mensal > 0 and horizonte_meses > 0 and isfinite(fv_residual):
-            aporte_sugerido = fv_residual * taxa_mensal / (((1 + taxa_mensal) ** horizonte_meses) - 1)
-        else:
-            aporte_sugerido = fv_residual / max(1, horizonte_meses)
+        fv_residual = max(0.0, capital_alvo - total_atual * crescimento[-1])
+        aporte_sugerido = fv_residual / por_aporte[-1] if np.isfinite(fv_residual) else 0.0
 
+    saldos = total_atual * crescimento + aporte_sugerido * por_aporte
+    roadmap = [
+        {'mes': int(m), 'saldo': round(float(s), 2), 'aporte': round(float(aporte_sugerido * c), 2)}
+        for m, s, c in zip(meses, saldos, cronograma)
+    ]
 
-    n = horizonte_meses if horizonte_meses and horizonte_meses > 0 else 120
-    saldo = total_atual
-    roadmap = []
-    for m in range(1, n + 1):
-        saldo = saldo * (1 + taxa_mensal) + (aporte_sugerido or 0)
-        roadmap.append({ 'mes': m, 'saldo': round(saldo, 2), 'aporte': round(aporte_sugerido or 0, 2) })
-
-    return {
+    resultado = {
         'capital_alvo': round(capital_alvo, 2),
         'aporte_sugerido': round(aporte_sugerido or 0, 2),
         'horizonte_meses': n,
@@ -3459,6 +3641,16 @@ def compute_goals_projection(goal: dict):
         'taxa_manual': taxa_crescimento is not None,
         'roadmap': roadmap,
     }
+    if goal.get('simulacao'):
+        try:
+            from . import simulacao
+        except ImportError:
+            import simulacao
+        resultado['simulacao'] = simulacao.simular_meta(
+            total_atual, aporte_sugerido or 0, n, capital_alvo, retorno_anual, itens,
+            goal.get('simulacao'), reajuste_aporte_anual=reajuste_aporte,
+        )
+    return resultado
 def migrar_preco_compra_existente():
     """
     MIGRAÇÃO ÚNICA: Executa apenas uma vez para corrigir ativos existentes
@@ -3536,15 +3728,29 @@ def migrar_preco_compra_existente():
         print(f"Erro na migração de preco_compra: {e}")
         return {"success": False, "message": str(e)}
 
-def _enriquecer_dados_fii(ativo):
-    """Enriquece dados de FII com metadados do fii_scraper"""
-    if not ativo.get('tipo') or 'fii' not in ativo.get('tipo', '').lower():
+def _eh_fii(ativo):
+    return bool(ativo.get('tipo')) and 'fii' in ativo.get('tipo', '').lower()
+
+def _metadados_fiis(ativos):
+    """Metadados de todos os FIIs da lista, baixados em paralelo (ticker -> dados)"""
+    tickers = [a.get('ticker') for a in ativos if _eh_fii(a) and a.get('ticker')]
+    if not tickers:
+        return {}
+    from fii_scraper import obter_dados_fiis_fundsexplorer
+    return obter_dados_fiis_fundsexplorer(tickers)
+
+def _enriquecer_dados_fii(ativo, metadados=None):
+    """Enriquece dados de FII com metadados do fii_scraper (`metadados`: já baixados por _metadados_fiis)"""
+    if not _eh_fii(ativo):
         return ativo
     
     try:
-        from fii_scraper import obter_dados_fii_fundsexplorer
         ticker = ativo.get('ticker', '')
-        metadata = obter_dados_fii_fundsexplorer(ticker)
+        if metadados is not None:
+            metadata = metadados.get(ticker)
+        else:
+            from fii_scraper import obter_dados_fii_fundsexplorer
+            metadata = obter_dados_fii_fundsexplorer(ticker)
         
         if metadata:
             ativo['tipo_fii'] = metadata.get('tipo')
@@ -3658,19 +3864,81 @@ def obter_carteira_com_metadados_fii():
                 "status_vencimento": status_vencimento,
                 "preco_medio": (row[18] if row_len > 18 else None) if (row_len > 18 and row[18] is not None) else (preco_compra if preco_compra is not None else None),
             }
-            
-            # Enriquecer dados de FIIs com metadados
-            ativo = _enriquecer_dados_fii(ativo)
             ativos.append(ativo)
         
         conn.close()
-        return ativos
+        # Enriquecer dados de FIIs com metadados (todas as páginas em paralelo)
+        metadados = _metadados_fiis(ativos)
+        return [_enriquecer_dados_fii(ativo, metadados) for ativo in ativos]
     except Exception as e:
         print(f"Erro ao obter carteira com metadados: {e}")
         return []
 
-def obter_carteira():
+# Campos aceitos em obter_carteira(campos=...): colunas da tabela + derivados
+CAMPOS_CARTEIRA = (
+    'id', 'ticker', 'nome_completo', 'quantidade', 'preco_atual', 'preco_compra', 'valor_total',
+    'data_adicao', 'tipo', 'dy', 'pl', 'pvp', 'roe', 'indexador', 'indexador_pct', 'vencimento',
+    'status_vencimento', 'tipo_fii', 'segmento_fii',
+)
+_CARTEIRA_DERIVADOS = {
+    'status_vencimento': ('tipo', 'vencimento'),
+    'tipo_fii': ('tipo', 'ticker'),
+    'segmento_fii': ('tipo', 'ticker'),
+}
+_CARTEIRA_NUMERICOS = {'quantidade', 'preco_atual', 'preco_compra', 'valor_total', 'dy', 'pl', 'pvp', 'roe', 'indexador_pct'}
+
+
+def _obter_carteira_campos(usuario, campos):
+    """obter_carteira restrita a `campos`: o SELECT traz só as colunas necessárias
+    e os derivados (vencimento, metadados de FII) só são calculados se pedidos"""
+    pedidos = [c for c in dict.fromkeys(campos) if c in CAMPOS_CARTEIRA]
+    if not pedidos:
+        raise ValueError("Nenhum campo válido em fields")
+    colunas = []
+    for campo in pedidos:
+        for coluna in _CARTEIRA_DERIVADOS.get(campo, (campo,)):
+            if coluna not in colunas:
+                colunas.append(coluna)
+    sql = f"SELECT {', '.join(colunas)} FROM carteira ORDER BY valor_total DESC"
+
+    if _is_postgres():
+        conn = _pg_conn_for_user(usuario)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+    else:
+        conn = sqlite3.connect(get_db_path(usuario, "carteira"), check_same_thread=False)
+        try:
+            rows = conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    precisa_fii = 'tipo_fii' in pedidos or 'segmento_fii' in pedidos
+    linhas = []
+    for row in rows:
+        linha = dict(zip(colunas, row))
+        for coluna in _CARTEIRA_NUMERICOS.intersection(linha):
+            if linha[coluna] is not None:
+                linha[coluna] = float(linha[coluna])
+        if 'status_vencimento' in pedidos:
+            tipo, vencimento = linha.get('tipo'), linha.get('vencimento')
+            linha['status_vencimento'] = (
+                _calcular_status_vencimento(vencimento)
+                if tipo and "renda fixa" in tipo.lower() and vencimento else None
+            )
+        linhas.append(linha)
+    if precisa_fii:
+        metadados = _metadados_fiis(linhas)
+        linhas = [_enriquecer_dados_fii(linha, metadados) for linha in linhas]
+    return [{campo: linha.get(campo) for campo in pedidos} for linha in linhas]
+
 
+@performance_monitor.timed_query()
+def obter_carteira(campos=None):
+    """Posições da carteira; com `campos`, seleciona só essas colunas (ver CAMPOS_CARTEIRA)"""
     try:
         usuario = get_usuario_atual()
         if not usuario:
@@ -3683,6 +3951,9 @@ def obter_carteira():
         except Exception:
             pass
 
+        if campos:
+            return _obter_carteira_campos(usuario, campos)
+
         if _is_postgres():
             conn = _pg_conn_for_user(usuario)
             try:
@@ -3770,13 +4041,12 @@ def obter_carteira():
                 "vencimento": vencimento,
                 "status_vencimento": status_vencimento,
             }
-            
-            # Enriquecer dados de FIIs com metadados
-            ativo = _enriquecer_dados_fii(ativo)
             ativos.append(ativo)
         
         conn.close()
-        return ativos
+        # Enriquecer dados de FIIs com metadados (todas as páginas em paralelo)
+        metadados = _metadados_fiis(ativos)
+        return [_enriquecer_dados_fii(ativo, metadados) for ativo in ativos]
     except Exception as e:
         print(f"Erro ao obter carteira: {e}")
         return []
@@ -3827,6 +4097,7 @@ def save_rebalance_config(periodo: str, targets: dict, last_rebalance_date: str
         conn.close()
     return {"success": True}
 
+@performance_monitor.timed_query()
 def get_rebalance_config():
     import json as _json
     usuario = get_usuario_atual()
@@ -3870,14 +4141,59 @@ def get_rebalance_config():
     finally:
         conn.close()
 
+REBALANCE_COLUNAS_CARTEIRA = ('ticker', 'tipo', 'quantidade', 'preco_atual', 'valor_total')
+
+
+def ler_dados_rebalance(usuario=None):
+    """Config de rebalanceamento e posições (REBALANCE_COLUNAS_CARTEIRA) numa única conexão"""
+    usuario = usuario or get_usuario_atual()
+    if not usuario:
+        return None, []
+    _ensure_rebalance_schema()
+    sql_cfg = 'SELECT periodo, targets_json, start_date, last_rebalance_date, updated_at FROM rebalance_config LIMIT 1'
+    sql_carteira = f"SELECT {', '.join(REBALANCE_COLUNAS_CARTEIRA)} FROM carteira ORDER BY valor_total DESC"
+    if _is_postgres():
+        conn = _pg_conn_for_user(usuario)
+        try:
+            with conn.cursor() as c:
+                c.execute(sql_cfg)
+                row = c.fetchone()
+                c.execute(sql_carteira)
+                rows = c.fetchall()
+        finally:
+            conn.close()
+    else:
+        conn = sqlite3.connect(get_db_path(usuario, "carteira"), check_same_thread=False)
+        try:
+            row = conn.execute(sql_cfg).fetchone()
+            rows = conn.execute(sql_carteira).fetchall()
+        finally:
+            conn.close()
+    cfg = None
+    if row:
+        periodo, targets_json, start_date, last_rebalance_date, updated_at = row
+        cfg = {
+            'periodo': periodo,
+            'targets': json.loads(targets_json or '{}'),
+            'start_date': start_date,
+            'last_rebalance_date': last_rebalance_date,
+            'updated_at': updated_at,
+        }
+    carteira = []
+    for r in rows:
+        ativo = dict(zip(REBALANCE_COLUNAS_CARTEIRA, r))
+        for campo in ('quantidade', 'preco_atual', 'valor_total'):
+            ativo[campo] = float(ativo[campo]) if ativo[campo] is not None else 0.0
+        carteira.append(ativo)
+    return cfg, carteira
+
+
 def compute_rebalance_status():
     from datetime import datetime as _dt
     usuario = get_usuario_atual()
     if not usuario:
         return {"error": "Não autenticado"}
-    _ensure_rebalance_schema()
-    cfg = get_rebalance_config()
-    carteira = obter_carteira() or []
+    cfg, carteira = ler_dados_rebalance(usuario)
     if not cfg or not carteira:
         return {
             'configured': bool(cfg),
@@ -4094,6 +4410,7 @@ def registrar_movimentacao(data, ticker, nome_completo, quantidade, preco, tipo,
             pass
         return {"success": False, "message": f"Erro ao registrar movimentação: {str(e)}"}
 
+@performance_monitor.timed_query()
 def obter_movimentacoes(mes=None, ano=None):
 
     try:
@@ -4165,6 +4482,266 @@ def obter_movimentacoes(mes=None, ano=None):
         print(f"Erro ao obter movimentações: {e}")
         return []
 
+def _intervalo_datas(mes=None, ano=None, inicio=None, fim=None):
+    """(data_inicial, data_final_exclusiva) em 'YYYY-MM-DD' para filtrar no SQL"""
+    def _data(s):
+        try:
+            return datetime.strptime((s or '')[:10], '%Y-%m-%d')
+        except Exception:
+            return None
+
+    if inicio or fim:
+        di = _data(inicio)
+        df = _data(fim)
+        return (
+            di.strftime('%Y-%m-%d') if di else None,
+            (df + timedelta(days=1)).strftime('%Y-%m-%d') if df else None,
+        )
+    if mes and ano:
+        mes_int = int(mes)
+        ano_int = int(ano)
+        if mes_int == 12:
+            prox_ano, prox_mes = ano_int + 1, 1
+        else:
+            prox_ano, prox_mes = ano_int, mes_int + 1
+        return f"{ano_int}-{mes_int:02d}-01", f"{prox_ano}-{prox_mes:02d}-01"
+    if ano:
+        ano_int = int(ano)
+        return f"{ano_int}-01-01", f"{ano_int+1}-01-01"
+    return None, None
+
+
+# ==================== PAGINAÇÃO POR CURSOR (KEYSET) ====================
+
+# tabela -> banco, colunas filtráveis por igualdade, colunas da busca textual e índices
+_PAGINACAO = {
+    'movimentacoes': {
+        'db': 'carteira',
+        'colunas': 'id, data, ticker, nome_completo, quantidade, preco, tipo',
+        'filtros': ('ticker', 'tipo'),
+        'texto': ('ticker', 'nome_completo'),
+        'indices': (('data', 'id'), ('ticker', 'data', 'id'), ('tipo', 'data', 'id')),
+    },
+    'receitas': {
+        'db': 'controle',
+        'colunas': '*',
+        'filtros': ('categoria', 'tipo', 'nome'),
+        'texto': ('nome', 'observacao'),
+        'indices': (('data', 'id'), ('categoria', 'data', 'id')),
+    },
+    'outros_gastos': {
+        'db': 'controle',
+        'colunas': '*',
+        'filtros': ('categoria', 'tipo'),
+        'texto': ('nome', 'observacao'),
+        'indices': (('data', 'id'), ('categoria', 'data', 'id')),
+    },
+    'compras_cartao': {
+        'db': 'controle',
+        'colunas': '*',
+        'filtros': ('cartao_id', 'categoria'),
+        'texto': ('nome', 'observacao'),
+        'indices': (('cartao_id', 'data', 'id'), ('data', 'id')),
+    },
+}
+_indices_paginacao_ok = set()
+
+
+def _garantir_indices_paginacao(conn, usuario, tabela, pg):
+    """Cria (uma vez por processo) os índices compostos que sustentam o keyset"""
+    chave = (usuario, tabela)
+    if chave in _indices_paginacao_ok:
+        return
+    cfg = _PAGINACAO[tabela]
+    cursor = conn.cursor()
+    try:
+        for colunas in cfg['indices']:
+            nome = f"idx_{tabela}_{'_'.join(colunas)}_keyset"
+            sql = f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela}({', '.join(colunas)})"
+            if pg and tabela == 'movimentacoes' and colunas == ('data', 'id'):
+                # índice de cobertura: a primeira página sai só do índice (index-only scan)
+                sql += " INCLUDE (ticker, nome_completo, quantidade, preco, tipo)"
+            cursor.execute(sql)
+        if not pg:
+            # sem estatísticas o SQLite prefere o índice antigo de uma coluna e ordena em memória
+            cursor.execute(f"ANALYZE {tabela}")
+            conn.commit()
+        _indices_paginacao_ok.add(chave)
+    except Exception as e:
+        print(f"Erro ao criar índices de paginação em {tabela}: {e}")
+    finally:
+        cursor.close()
+
+
+def _codificar_cursor(data, id_registro):
+    bruto = json.dumps([data, id_registro], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii').rstrip('=')
+
+
+def _decodificar_cursor(cursor):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data, id_registro = json.loads(bruto)
+        return str(data), int(id_registro)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+def listar_paginado(tabela, limite=50, cursor=None, filtros=None, q=None, mes=None, ano=None, inicio=None, fim=None):
+    """Página de `tabela` ordenada por (data, id) desc, com filtros no SQL
+
+    Retorna {"items": [...], "next_cursor": str | None}. O cursor é a chave
+    (data, id) do último item, então a próxima página é um range scan no
+    índice, com custo independente de quantas páginas vieram antes.
+    """
+    if tabela not in _PAGINACAO:
+        raise ValueError(f"Tabela sem paginação: {tabela}")
+    usuario = get_usuario_atual()
+    if not usuario:
+        return {"items": [], "next_cursor": None}
+    cfg = _PAGINACAO[tabela]
+    limite = max(1, min(int(limite or 50), 500))
+
+    condicoes = []
+    params = []
+    data_ini, data_fim = _intervalo_datas(mes, ano, inicio, fim)
+    if data_ini:
+        condicoes.append('data >= {p}')
+        params.append(data_ini)
+    if data_fim:
+        condicoes.append('data < {p}')
+        params.append(data_fim)
+    for coluna, valor in (filtros or {}).items():
+        if coluna in cfg['filtros'] and valor not in (None, ''):
+            condicoes.append(f'{coluna} = {{p}}')
+            params.append(valor)
+    if q:
+        termo = '%' + q.strip().lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        condicoes.append('(' + ' OR '.join(f"LOWER({c}) LIKE {{p}} ESCAPE '\\'" for c in cfg['texto']) + ')')
+        params.extend([termo] * len(cfg['texto']))
+    if cursor:
+        data_cursor, id_cursor = _decodificar_cursor(cursor)
+        condicoes.append('(data, id) < ({p}, {p})')
+        params.extend([data_cursor, id_cursor])
+    where = (' WHERE ' + ' AND '.join(condicoes)) if condicoes else ''
+    sql = f"SELECT {cfg['colunas']} FROM {tabela}{where} ORDER BY data DESC, id DESC LIMIT {{p}}"
+    params.append(limite + 1)
+
+    pg = _is_postgres()
+    if pg:
+        conn = _pg_conn_for_user(usuario)
+    else:
+        conn = sqlite3.connect(get_db_path(usuario, cfg['db']), check_same_thread=False)
+    try:
+        _garantir_indices_paginacao(conn, usuario, tabela, pg)
+        cur = conn.cursor()
+        cur.execute(sql.replace('{p}', '%s' if pg else '?'), params)
+        colunas = [desc[0] for desc in cur.description]
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    items = [dict(zip(colunas, row)) for row in rows[:limite]]
+    next_cursor = None
+    if len(rows) > limite and items:
+        ultimo = items[-1]
+        next_cursor = _codificar_cursor(ultimo['data'], ultimo['id'])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def iterar_movimentacoes(usuario, mes=None, ano=None, inicio=None, fim=None, lote=500):
+    """Gera (data, ticker, nome_completo, quantidade, preco, tipo) em lotes, sem carregar tudo
+
+    O filtro de datas vai para o SQL e a leitura acontece dentro de uma única
+    transação (REPEATABLE READ no Postgres, transação de leitura no SQLite),
+    então o export inteiro enxerga o mesmo snapshot. No Postgres usa cursor
+    nomeado (server-side), que busca `lote` linhas por vez.
+    """
+    if not usuario:
+        return
+    data_ini, data_fim = _intervalo_datas(mes, ano, inicio, fim)
+    condicoes = []
+    params = []
+    if data_ini:
+        condicoes.append('data >= {p}')
+        params.append(data_ini)
+    if data_fim:
+        condicoes.append('data < {p}')
+        params.append(data_fim)
+    where = (' WHERE ' + ' AND '.join(condicoes)) if condicoes else ''
+    sql = 'SELECT data, ticker, nome_completo, quantidade, preco, tipo FROM movimentacoes' + where + ' ORDER BY data DESC, id DESC'
+
+    if _is_postgres():
+        conn = _pg_conn_for_user(usuario)
+        try:
+            conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+            with conn.transaction():
+                with conn.cursor(name='export_movimentacoes') as cursor:
+                    cursor.itersize = lote
+                    cursor.execute(sql.replace('{p}', '%s'), params)
+                    while True:
+                        rows = cursor.fetchmany(lote)
+                        if not rows:
+                            break
+                        for row in rows:
+                            yield row
+        finally:
+            conn.close()
+    else:
+        db_path = get_db_path(usuario, "carteira")
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            conn.isolation_level = None
+            conn.execute('BEGIN')
+            cursor = conn.execute(sql.replace('{p}', '?'), params)
+            while True:
+                rows = cursor.fetchmany(lote)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+@performance_monitor.timed_query()
+def _movimentacoes_ordenadas(usuario):
+    """(data, ticker, quantidade, preco, tipo) de todas as movimentações, por data"""
+    if _is_postgres():
+        conn = _pg_conn_for_user(usuario)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT data, ticker, quantidade, preco, tipo 
+                    FROM movimentacoes 
+                    ORDER BY data ASC
+                """)
+                return cursor.fetchall()
+        finally:
+            conn.close()
+    db_path = get_db_path(usuario, "carteira")
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT data, ticker, quantidade, preco, tipo 
+            FROM movimentacoes 
+            ORDER BY data ASC
+        """)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def obter_linha_tempo_posicoes(usuario=None):
+    """LinhaTempoPosicoes das movimentações do usuário (None sem usuário)"""
+    usuario = usuario or get_usuario_atual()
+    if not usuario:
+        return None
+    return LinhaTempoPosicoes(_movimentacoes_ordenadas(usuario))
+
+
 def obter_historico_carteira(periodo='mensal'):
     
     try:
@@ -4173,81 +4750,22 @@ def obter_historico_carteira(periodo='mensal'):
         if not usuario:
             print("DEBUG: Usuário não encontrado")
             return []
-            
-        if _is_postgres():
-            conn = _pg_conn_for_user(usuario)
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT data, ticker, quantidade, preco, tipo 
-                        FROM movimentacoes 
-                        ORDER BY data ASC
-                    """)
-                    movimentacoes = cursor.fetchall()
-            finally:
-                conn.close()
-        else:
-            db_path = get_db_path(usuario, "carteira")
-            conn = sqlite3.connect(db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT data, ticker, quantidade, preco, tipo 
-                FROM movimentacoes 
-                ORDER BY data ASC
-            """)
-            movimentacoes = cursor.fetchall()
-        
+
+        movimentacoes = _movimentacoes_ordenadas(usuario)
         print(f"DEBUG: Encontradas {len(movimentacoes)} movimentações para usuário {usuario}")
         
         if not movimentacoes:
             print("DEBUG: Nenhuma movimentação encontrada")
             return []
-        
 
-        print("DEBUG: Primeiras 3 movimentações:")
-        for i, mov in enumerate(movimentacoes[:3]):
-            print(f"  {i+1}. Data: '{mov[0]}', Ticker: {mov[1]}, Qtd: {mov[2]}, Preço: {mov[3]}")
-        
-      
-        historico = []
-        posicoes = {}  
-        
-      
-        for mov in movimentacoes:
-            data_mov = mov[0]
-            ticker = mov[1]
-            quantidade = float(mov[2])
-            preco = float(mov[3])
-            
-    
- 
-            
-
-            if ticker in posicoes:
-                posicoes[ticker] += quantidade
-            else:
-                posicoes[ticker] = quantidade
-            
-            
-            patrimonio_total = 0
-            for ticker_pos, qtd in posicoes.items():
-                if qtd > 0:
-                    
-                    patrimonio_total += qtd * preco
-            
-          
-            item_historico = {
-                'data': data_mov[:10],  
-                'valor_total': patrimonio_total
-            }
-            historico.append(item_historico)
-            print(f"DEBUG: Adicionado ao histórico: {item_historico}")
+        # patrimônio em cada movimentação, com cada ticker a preço da sua última movimentação;
+        # todas as datas avaliadas de uma vez pela linha do tempo
+        linha_tempo = LinhaTempoPosicoes(movimentacoes)
+        datas = [mov[0][:10] for mov in movimentacoes]
+        valores = linha_tempo.valorizar(datas, linha_tempo.series_precos())
+        historico = [{'data': data, 'valor_total': float(valor)} for data, valor in zip(datas, valores)]
         
         print(f"DEBUG: Total de {len(historico)} itens no histórico")
-        print("DEBUG: Primeiros 3 itens do histórico:")
-        for i, item in enumerate(historico[:3]):
-            print(f"  {i+1}. {item}")
-        
         return historico
         
     except Exception as e:
@@ -4282,6 +4800,27 @@ def _gerar_pontos_tempo(gran: str, data_inicio: datetime, data_fim: datetime) ->
     return pontos
 
 
+# Prazo total (s) para a coleta de dados do histórico comparado
+HISTORICO_PRAZO = float(os.getenv('HISTORICO_PRAZO', '20'))
+# Downloads com prazo de request. Um download que estoura o prazo continua
+# ocupando a thread (o yfinance não é interrompível), por isso a sincronização
+# em background (agendador/jobs, sem prazo curto) tem pool próprio.
+_historico_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='historico')
+_sincronizacao_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='historico-bg')
+
+
+def _baixar_historico(simbolo, inicio, fim):
+    hist = yf.Ticker(simbolo).history(start=inicio, end=fim)
+    if hist is None or hist.empty:
+        return None
+    try:
+        if hasattr(hist.index, 'tz') and hist.index.tz is not None:
+            hist.index = hist.index.tz_localize(None)
+    except Exception:
+        pass
+    return hist
+
+
 def obter_historico_carteira_comparado(agregacao: str = 'mensal'):
     
     try:
@@ -4289,28 +4828,7 @@ def obter_historico_carteira_comparado(agregacao: str = 'mensal'):
         if not usuario:
             return {"datas": [], "carteira": [], "ibov": [], "ivvb11": [], "ifix": [], "ipca": []}
 
-        if _is_postgres():
-            conn = _pg_conn_for_user(usuario)
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT data, ticker, quantidade, preco, tipo 
-                        FROM movimentacoes 
-                        ORDER BY data ASC
-                    """)
-                    movimentos = cursor.fetchall()
-            finally:
-                conn.close()
-        else:
-            db_path = get_db_path(usuario, "carteira")
-            conn = sqlite3.connect(db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT data, ticker, quantidade, preco, tipo 
-                FROM movimentacoes 
-                ORDER BY data ASC
-            """)
-            movimentos = cursor.fetchall()
+        movimentos = _movimentacoes_ordenadas(usuario)
 
         if not movimentos:
             return {"datas": [], "carteira": [], "ibov": [], "ivvb11": [], "ifix": [], "ipca": []}
@@ -4324,105 +4842,61 @@ def obter_historico_carteira_comparado(agregacao: str = 'mensal'):
         gran = agregacao if agregacao in ('mensal','trimestral','semestral','anual','maximo','semanal') else 'mensal'
         pontos = _gerar_pontos_tempo(gran, data_ini, data_fim)
 
+        prazo = time.time() + HISTORICO_PRAZO
+        # IPCA e CDI do BCB saem em paralelo enquanto os históricos do yfinance são baixados
+        ipca_futuro = sgs_futuro(433)
+        cdi_futuro = sgs_futuro(12, inicio=data_ini, fim=data_fim)
 
-        tickers = sorted(list({m[1] for m in movimentos}))
-        ticker_to_hist = {}
-        for tk in tickers:
-            try:
-                yf_ticker = yf.Ticker(tk)
-                hist = yf_ticker.history(start=data_ini - timedelta(days=5), end=data_fim + timedelta(days=5))
-               
-                try:
-                    if hasattr(hist.index, 'tz') and hist.index.tz is not None:
-                        hist.index = hist.index.tz_localize(None)
-                except Exception:
-                    pass
-                ticker_to_hist[tk] = hist
-            except Exception:
-                ticker_to_hist[tk] = None
-
-
-        def price_on_or_before(hist_df, dt):
-            if hist_df is None or hist_df.empty:
-                return None
-            
-            try:
-                sub = hist_df[hist_df.index <= dt]
-                if sub.empty:
-                    return None
-                return float(sub['Close'].iloc[-1])
-            except Exception:
-                return None
-
-
-        mov_by_ticker = {}
-        for data_str, tk, qtd, preco, tipo in movimentos:
-            dt = datetime.strptime(data_str[:10], '%Y-%m-%d')
-            mov_by_ticker.setdefault(tk, []).append((dt, float(qtd if qtd is not None else 0.0), str(tipo)))
-
-        def quantity_until(tk, dt):
-            q = 0.0
-            for mdt, mq, mtype in mov_by_ticker.get(tk, []):
-                if mdt <= dt:
-                    if mtype == 'venda':
-                        q -= mq
-                    else:
-                        q += mq
-            return q
 
- 
-        carteira_vals = []
-        datas_labels = []
-        for pt in pontos:
-            total = 0.0
-            for tk in tickers:
-                q = quantity_until(tk, pt)
-                if q <= 0:
-                    continue
-                price = price_on_or_before(ticker_to_hist.get(tk), pt)
-                if price is None:
-                    continue
-                total += q * price
-            carteira_vals.append(total)
-            if gran == 'semanal':
-                datas_labels.append(pt.strftime('%Y-%m-%d'))
-            else:
-                datas_labels.append(pt.strftime('%Y-%m'))
+        try:
+            from . import snapshots
+        except ImportError:
+            import snapshots
 
- 
+        tickers = sorted(list({m[1] for m in movimentos}))
+        simbolos = {tk: _normalize_ticker_for_yf(tk) for tk in tickers}
         indices_map = {
             'ibov': ['^BVSP', 'BOVA11.SA'],
             'ivvb11': ['IVVB11.SA'],
             'ifix': ['^IFIX', 'XFIX11.SA']
         }
+        candidatos = [cand for cands in indices_map.values() for cand in cands]
+        # base local de preços: baixa só o que falta, tudo em paralelo sob o mesmo prazo;
+        # com os snapshots em dia, a carteira nem precisa de preços
+        pendente = snapshots.dias_pendentes(usuario)
+        falhas = snapshots.sincronizar_precos(
+            candidatos + (list(simbolos.values()) if pendente else []), data_ini, prazo
+        )
+        indisponiveis = []
+
+        # snapshots diários para o passado, valor atual da carteira para hoje
+        carteira_vals = snapshots.serie_carteira(usuario, pontos, prazo)
+        if carteira_vals is None:
+            # snapshots não puderam ser completados: recalcula com o que a base local tem
+            base = snapshots.ler_precos(simbolos.values(), inicio=data_ini - timedelta(days=5))
+            precos_hist = {tk: base[s] for tk, s in simbolos.items() if s in base}
+            indisponiveis = [tk for tk, s in simbolos.items() if s in falhas or s not in base]
+            carteira_vals = [float(v) for v in LinhaTempoPosicoes(movimentos).valorizar(pontos, precos_hist)]
+        datas_labels = [pt.strftime('%Y-%m-%d') if gran == 'semanal' else pt.strftime('%Y-%m') for pt in pontos]
+
+ 
+        base_indices = snapshots.ler_precos(candidatos, inicio=data_ini - timedelta(days=5))
         indices_vals = {k: [] for k in indices_map.keys()}
         for key, candidates in indices_map.items():
-            hist = None
-            for cand in candidates:
-                try:
-                    h = yf.Ticker(cand).history(start=data_ini - timedelta(days=5), end=data_fim + timedelta(days=5))
-                    if h is not None and not h.empty:
-                        try:
-                            if hasattr(h.index, 'tz') and h.index.tz is not None:
-                                h.index = h.index.tz_localize(None)
-                        except Exception:
-                            pass
-                        hist = h
-                        break
-                except Exception:
-                    continue
-            for pt in pontos:
-                price = price_on_or_before(hist, pt) if hist is not None else None
-                indices_vals[key].append(float(price) if price is not None else None)
+            # primeiro candidato (na ordem de preferência) com preços na base local
+            serie = next((base_indices[cand] for cand in candidates if len(base_indices.get(cand, ((), ()))[0])), None)
+            if serie is None:
+                indisponiveis.append(key)
+                indices_vals[key] = [None for _ in pontos]
+                continue
+            precos = valores_em(serie[0], serie[1], pontos)
+            indices_vals[key] = [None if np.isnan(p) else float(p) for p in precos]
 
 
         ipca_series = []
         try:
-            import requests
-            url = 'https://api.bcb.gov.br/dados/serie/bcdata.sgs.433/dados?formato=json'
-            resp = requests.get(url, timeout=10)
-            if resp.ok:
-                dados = resp.json()
+            dados = ipca_futuro.result(timeout=max(0.0, prazo - time.time()))
+            if dados:
 
                 ipca_map = {}
                 for item in dados:
@@ -4438,21 +4912,16 @@ def obter_historico_carteira_comparado(agregacao: str = 'mensal'):
                         base *= (1.0 + var/100.0)
                     ipca_series.append(base)
         except Exception:
+            # fora do prazo: cancela a requisição em andamento no loop assíncrono
+            ipca_futuro.cancel()
             ipca_series = [None for _ in datas_labels]
+            indisponiveis.append('ipca')
 
         # CDI acumulado (base 100) por mês usando série diária (SGS 12)
         cdi_series = []
         try:
-            import requests
-            start_date = data_ini.strftime('%d/%m/%Y')
-            end_date = data_fim.strftime('%d/%m/%Y')
-            url_cdi = (
-                f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.12/dados?formato=json"
-                f"&dataInicial={start_date}&dataFinal={end_date}"
-            )
-            r = requests.get(url_cdi, timeout=10)
-            if r.ok:
-                arr = r.json() or []
+            arr = cdi_futuro.result(timeout=max(0.0, prazo - time.time())) or []
+            if arr:
                 # Ordenar por data
                 def _parse_br_date(d):
                     try:
@@ -4490,7 +4959,9 @@ def obter_historico_carteira_comparado(agregacao: str = 'mensal'):
             else:
                 cdi_series = [None for _ in datas_labels]
         except Exception:
+            cdi_futuro.cancel()
             cdi_series = [None for _ in datas_labels]
+            indisponiveis.append('cdi')
 
 
         def rebase(series):
@@ -4557,6 +5028,7 @@ def obter_historico_carteira_comparado(agregacao: str = 'mensal'):
             "ipca": ipca_rebased,
             "cdi": cdi_rebased,
             "carteira_valor": series_dict['carteira'],
+            "indisponiveis": indisponiveis,
         }
     except Exception as e:
         print(f"Erro em obter_historico_carteira_comparado: {e}")
@@ -5067,6 +5539,7 @@ def remover_receita(id_registro):
     """Remover receita - wrapper para compatibilidade"""
     return _remover_registro_generico("receitas", id_registro, "controle")
 
+@performance_monitor.timed_query()
 def carregar_receitas_mes_ano(mes, ano, pessoa=None):
    
     usuario = get_usuario_atual()
@@ -5278,6 +5751,7 @@ def adicionar_outro_gasto(nome, valor, data=None, categoria=None, tipo=None, rec
     conn.commit()
     conn.close()
 
+@performance_monitor.timed_query()
 def carregar_outros_mes_ano(mes, ano):
     
     usuario = get_usuario_atual()
@@ -5418,6 +5892,7 @@ def init_marmitas_db(usuario=None):
     conn.commit()
     conn.close()
 
+@performance_monitor.timed_query()
 def consultar_marmitas(mes=None, ano=None):
     """Consultar marmitas com filtros opcionais"""
     usuario = get_usuario_atual()
@@ -5555,6 +6030,7 @@ def remover_marmita(id_registro):
     conn.commit()
     conn.close()
 
+@performance_monitor.timed_query()
 def gastos_mensais(periodo='6m'):
     """Calcular gastos mensais de marmitas"""
     usuario = get_usuario_atual()
@@ -5606,6 +6082,7 @@ def inicializar_bancos_usuario(usuario):
     init_controle_db(usuario)
     init_marmitas_db(usuario)
 
+@performance_monitor.timed_query()
 def calcular_saldo_mes_ano(mes, ano, pessoa=None):
     
     usuario = get_usuario_atual()
@@ -5662,6 +6139,56 @@ def calcular_saldo_mes_ano(mes, ano, pessoa=None):
     total_despesas = total_outros
     return total_receitas - total_despesas
 
+def _somar_por_dia(datas, valores, inicio, n_dias):
+    """Soma `valores` por dia do intervalo [inicio, inicio + n_dias) com bincount
+
+    Datas ou valores malformados viram NaT/NaN e a linha é ignorada.
+    """
+    if len(datas) == 0:
+        return np.zeros(n_dias)
+    dias = pd.to_datetime(
+        pd.Series([None if d is None else str(d)[:10] for d in datas], dtype=object),
+        format='%Y-%m-%d', errors='coerce'
+    )
+    validas = dias.notna().to_numpy()
+    idx = np.where(validas, (dias.to_numpy(dtype='datetime64[D]') - inicio).astype(np.int64), -1)
+    vals = np.nan_to_num(pd.to_numeric(pd.Series(list(valores), dtype=object), errors='coerce').to_numpy(dtype=np.float64))
+    dentro = validas & (idx >= 0) & (idx < n_dias)
+    return np.bincount(idx[dentro], weights=vals[dentro], minlength=n_dias)
+
+
+def evolucao_financeira_diaria(mes, ano, receitas, outros):
+    """Evolução diária do mês (receitas, despesas, saldo do dia e acumulado)
+
+    `receitas` é o DataFrame de carregar_receitas_mes_ano e `outros` a lista
+    de carregar_outros_mes_ano; nada é consultado aqui. Retorna
+    (evolucao, total_receitas, total_despesas).
+    """
+    inicio = np.datetime64(f"{int(ano)}-{int(mes):02d}-01", 'D')
+    fim = (np.datetime64(f"{int(ano)}-{int(mes):02d}", 'M') + 1).astype('datetime64[D]')
+    n_dias = int((fim - inicio).astype(np.int64))
+
+    if isinstance(receitas, pd.DataFrame) and not receitas.empty:
+        rec_datas, rec_valores = receitas['data'].tolist(), receitas['valor'].tolist()
+    else:
+        rec_datas, rec_valores = [], []
+    outros = outros if isinstance(outros, list) else []
+    out_datas = [o.get('data') for o in outros]
+    out_valores = [o.get('valor') for o in outros]
+
+    receitas_dia = _somar_por_dia(rec_datas, rec_valores, inicio, n_dias)
+    despesas_dia = _somar_por_dia(out_datas, out_valores, inicio, n_dias)
+    saldo_dia = receitas_dia - despesas_dia
+    saldo_acumulado = np.cumsum(saldo_dia)
+    datas = np.datetime_as_string(inicio + np.arange(n_dias), unit='D').tolist()
+
+    evolucao = [
+        {'data': d, 'receitas': r, 'despesas': dp, 'saldo_dia': sd, 'saldo_acumulado': sa}
+        for d, r, dp, sd, sa in zip(datas, receitas_dia.tolist(), despesas_dia.tolist(),
+                                    saldo_dia.tolist(), saldo_acumulado.tolist())
+    ]
+    return evolucao, float(receitas_dia.sum()), float(despesas_dia.sum())
+
 # ==================== FUNÇÕES DE CARTÕES CADASTRADOS ====================
 
 def adicionar_cartao_cadastrado(nome, bandeira, limite, vencimento, cor):
@@ -5691,6 +6218,7 @@ def adicionar_cartao_cadastrado(nome, bandeira, limite, vencimento, cor):
     conn.commit()
     conn.close()
 
+@performance_monitor.timed_query()
 def listar_cartoes_cadastrados():
     """Lista todos os cartões cadastrados"""
     usuario = get_usuario_atual()
@@ -5826,6 +6354,7 @@ def adicionar_compra_cartao(cartao_id, nome, valor, data, categoria=None, observ
     conn.commit()
     conn.close()
 
+@performance_monitor.timed_query()
 def listar_compras_cartao(cartao_id, mes=None, ano=None):
     """Lista compras de um cartão específico"""
     usuario = get_usuario_atual()
@@ -5950,6 +6479,7 @@ def remover_compra_cartao(id_compra):
     conn.commit()
     conn.close()
 
+@performance_monitor.timed_query()
 def calcular_total_compras_cartao(cartao_id, mes=None, ano=None):
     """Calcula o total de compras de um cartão"""
     usuario = get_usuario_atual()
@@ -6162,77 +6692,6 @@ def desmarcar_cartao_como_pago(cartao_id):
 
 # ==================== FUNÇÕES DE SIMULAÇÃO DE CHOQUES ====================
 
-def simular_choques_indexadores(choques_cdi=0, choques_ipca=0, choques_selic=0):
-    """
-    Simula choques nos indexadores e calcula o impacto na carteira
-    """
-    try:
-        usuario = get_usuario_atual()
-        if not usuario:
-            return {"error": "Usuário não autenticado"}
-        
-        carteira = obter_carteira()
-        if not carteira:
-            return {"carteira_simulada": [], "totais": {"valor_atual": 0, "valor_simulado": 0, "variacao": 0, "variacao_percentual": 0}}
-        
-        carteira_simulada = []
-        valor_atual_total = 0
-        valor_simulado_total = 0
-        
-        for ativo in carteira:
-            # Calcular novo preço baseado no indexador
-            novo_preco = ativo['preco_atual']
-            impacto = 0
-            
-            # Aplicar choque baseado no indexador
-            if ativo.get('indexador') == 'CDI':
-                impacto = choques_cdi
-            elif ativo.get('indexador') == 'IPCA':
-                impacto = choques_ipca
-            elif ativo.get('indexador') == 'SELIC':
-                impacto = choques_selic
-            
-            # Calcular novo preço (simplificado: 1% de choque = 1% no preço)
-            if impacto != 0:
-                novo_preco = ativo['preco_atual'] * (1 + impacto / 100)
-            
-            # Calcular novos valores
-            novo_valor_total = novo_preco * ativo['quantidade']
-            variacao = novo_valor_total - ativo['valor_total']
-            variacao_percentual = (variacao / ativo['valor_total']) * 100 if ativo['valor_total'] > 0 else 0
-            
-            # Adicionar à carteira simulada
-            ativo_simulado = {
-                **ativo,
-                'preco_simulado': novo_preco,
-                'valor_total_simulado': novo_valor_total,
-                'variacao': variacao,
-                'variacao_percentual': variacao_percentual
-            }
-            carteira_simulada.append(ativo_simulado)
-            
-            # Somar totais
-            valor_atual_total += ativo['valor_total']
-            valor_simulado_total += novo_valor_total
-        
-        # Calcular totais
-        variacao_total = valor_simulado_total - valor_atual_total
-        variacao_percentual_total = (variacao_total / valor_atual_total) * 100 if valor_atual_total > 0 else 0
-        
-        return {
-            "carteira_simulada": carteira_simulada,
-            "totais": {
-                "valor_atual": valor_atual_total,
-                "valor_simulado": valor_simulado_total,
-                "variacao": variacao_total,
-                "variacao_percentual": variacao_percentual_total
-            }
-        }
-        
-    except Exception as e:
-        print(f"Erro na simulação de choques: {e}")
-        return {"error": str(e)}
-
 def obter_cenarios_predefinidos():
 
     return [
@@ -6261,84 +6720,3 @@ def obter_cenarios_predefinidos():
             "cor": "text-orange-600"
         }
     ]
-
-def executar_monte_carlo(n_simulacoes=10000, periodo_anos=5, confianca=95):
-    """
-    Executa simulação Monte Carlo para a carteira
-    """
-    try:
-        import numpy as np
-        import random
-        
-        print(f"Iniciando Monte Carlo: {n_simulacoes} simulações, {periodo_anos} anos")
-        
-        usuario = get_usuario_atual()
-        if not usuario:
-            return {"error": "Usuário não autenticado"}
-        
-        carteira = obter_carteira()
-        if not carteira:
-            return {"error": "Carteira vazia"}
-        
-        print(f"Carteira encontrada: {len(carteira)} ativos")
-        
-        # Calcular valor atual total
-        valor_atual_total = sum(ativo['valor_total'] for ativo in carteira)
-        print(f"Valor atual total: R$ {valor_atual_total:,.2f}")
-        
-        # Parâmetros para simulação (baseados em dados históricos médios)
-        retorno_medio_anual = 0.12  # 12% ao ano (média histórica do mercado brasileiro)
-        volatilidade_anual = 0.20   # 20% de volatilidade anual
-        
-     
-        cenarios = []
-        
-        for _ in range(n_simulacoes):
-           
-            retorno_anual = np.random.normal(retorno_medio_anual, volatilidade_anual)
-            
-           
-            valor_final = valor_atual_total * ((1 + retorno_anual) ** periodo_anos)
-            cenarios.append(valor_final)
-        
-  
-        cenarios_ordenados = sorted(cenarios)
-        n_cenarios = len(cenarios_ordenados)
-        
-      
-        percentis = {
-            "p5": cenarios_ordenados[int(0.05 * n_cenarios)],
-            "p25": cenarios_ordenados[int(0.25 * n_cenarios)],
-            "p50": cenarios_ordenados[int(0.50 * n_cenarios)],
-            "p75": cenarios_ordenados[int(0.75 * n_cenarios)],
-            "p95": cenarios_ordenados[int(0.95 * n_cenarios)]
-        }
-        
-    
-        valor_esperado = np.mean(cenarios)
-        
-   
-        volatilidade = np.std(cenarios) / valor_esperado
-        
-    
-        cenarios_perda = [c for c in cenarios if c < valor_atual_total]
-        probabilidade_perda = len(cenarios_perda) / n_cenarios * 100
-        
-
-        sharpe = (valor_esperado - valor_atual_total) / (np.std(cenarios) * np.sqrt(periodo_anos))
-        
-        resultado = {
-            "percentis": percentis,
-            "probabilidade_perda": probabilidade_perda,
-            "valor_esperado": valor_esperado,
-            "volatilidade": volatilidade,
-            "sharpe": sharpe,
-            "cenarios": cenarios[:1000]  
-        }
-        
-        print(f"Monte Carlo concluído: Valor esperado R$ {valor_esperado:,.2f}")
-        return resultado
-        
-    except Exception as e:
-        print(f"Erro na simulação Monte Carlo: {e}")
-        return {"error": str(e)}
@@ -1,10 +1,17 @@
 # ==================== OTIMIZAÇÕES PARA PRODUÇÃO ====================
 
 import asyncio
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
 from functools import wraps
 from typing import List, Dict, Any
+from urllib.parse import urlsplit
 import time
 
+import numpy as np
+
 # Cache de queries frequentes
 QUERY_CACHE = {}
 CACHE_TTL = 300  # 5 minutos
@@ -164,47 +171,491 @@ class QueryBatcher:
 
 # ==================== MONITORING ====================
 
+# Buckets (segundos) no formato de histograma do Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
 class PerformanceMonitor:
-    """Monitor de performance para produção"""
-    
-    def __init__(self):
-        self.query_times = {}
-        self.slow_queries = []
-        self.cache_hits = 0
-        self.cache_misses = 0
-    
+    """Monitor de performance para produção
+
+    Cada thread grava em seu próprio shard (threading.local), então o caminho
+    quente não disputa lock nenhum; o lock só é usado ao registrar um shard
+    novo e ao consolidar os shards para leitura.
+    """
+
+    def __init__(self, slow_query_threshold: float = 1.0, buckets: tuple = LATENCY_BUCKETS):
+        self.slow_query_threshold = slow_query_threshold
+        self.buckets = tuple(buckets)
+        self.slow_queries = deque(maxlen=50)
+        self.started_at = time.time()
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    # ---------- escrita (por thread, sem lock) ----------
+
+    def _shard(self) -> Dict[str, Dict]:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {'hist': {}, 'count': {}}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, metric: str, labels: tuple, duration: float):
+        """Registrar uma duração no histograma `metric` com os `labels` dados"""
+        hist = self._shard()['hist']
+        key = (metric, labels)
+        serie = hist.get(key)
+        if serie is None:
+            # [contagem por bucket..., +Inf, soma, máximo]
+            serie = [0] * (len(self.buckets) + 1) + [0.0, 0.0]
+            hist[key] = serie
+        idx = bisect.bisect_left(self.buckets, duration)
+        serie[idx] += 1
+        serie[-2] += duration
+        if duration > serie[-1]:
+            serie[-1] = duration
+
+    def increment(self, metric: str, labels: tuple, value: int = 1):
+        """Incrementar o contador `metric` com os `labels` dados"""
+        counts = self._shard()['count']
+        key = (metric, labels)
+        counts[key] = counts.get(key, 0) + value
+
     def log_query_time(self, query_name: str, duration: float):
         """Log tempo de execução de query"""
-        if query_name not in self.query_times:
-            self.query_times[query_name] = []
-        
-        self.query_times[query_name].append(duration)
-        
+        self.observe('query', (query_name,), duration)
+
         # Identificar queries lentas
-        if duration > 1.0:  # > 1 segundo
+        if duration > self.slow_query_threshold:
             self.slow_queries.append({
                 'query': query_name,
                 'duration': duration,
                 'timestamp': time.time()
             })
-    
+
+    def log_request(self, route: str, method: str, status: int, duration: float):
+        """Log latência de uma rota HTTP"""
+        self.observe('http_request', (route, method), duration)
+        self.increment('http_response', (route, method, str(status)))
+
+    def log_cache(self, namespace: str, hit: bool):
+        """Log acerto/erro de cache por namespace de chave (prefixo antes de ':')"""
+        self.increment('cache', (namespace, 'hit' if hit else 'miss'))
+
+    def log_upstream(self, host: str, duration: float, error: bool = False):
+        """Log chamada a serviço externo (BCB, Yahoo, Tesouro, FundsExplorer...)"""
+        self.observe('upstream', (host,), duration)
+        if error:
+            self.increment('upstream_error', (host,))
+
+    @contextmanager
+    def track_query(self, query_name: str):
+        """Context manager que mede o bloco como uma query"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.log_query_time(query_name, time.perf_counter() - inicio)
+
+    def timed_query(self, query_name: str = None):
+        """Decorator que mede a função como uma query"""
+        def decorator(func):
+            nome = query_name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.log_query_time(nome, time.perf_counter() - inicio)
+            return wrapper
+        return decorator
+
+    # ---------- leitura (consolida shards) ----------
+
+    def _merge(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        hist = {}
+        counts = {}
+        for shard in shards:
+            # dict.copy() é atômico sob o GIL, não precisa parar as threads
+            for key, serie in shard['hist'].copy().items():
+                serie = list(serie)
+                atual = hist.get(key)
+                if atual is None:
+                    hist[key] = serie
+                else:
+                    for i in range(len(serie) - 1):
+                        atual[i] += serie[i]
+                    atual[-1] = max(atual[-1], serie[-1])
+            for key, valor in shard['count'].copy().items():
+                counts[key] = counts.get(key, 0) + valor
+        return hist, counts
+
+    @property
+    def cache_hits(self) -> int:
+        _, counts = self._merge()
+        return sum(v for (m, labels), v in counts.items() if m == 'cache' and labels[1] == 'hit')
+
+    @property
+    def cache_misses(self) -> int:
+        _, counts = self._merge()
+        return sum(v for (m, labels), v in counts.items() if m == 'cache' and labels[1] == 'miss')
+
+    def _quantile(self, serie: list, q: float):
+        total = sum(serie[:len(self.buckets) + 1])
+        if total == 0:
+            return None
+        alvo = q * total
+        acumulado = 0
+        for i, limite in enumerate(self.buckets):
+            acumulado += serie[i]
+            if acumulado >= alvo:
+                return limite
+        return serie[-1]
+
+    def _hist_stats(self, serie: list) -> Dict[str, Any]:
+        count = sum(serie[:len(self.buckets) + 1])
+        return {
+            'count': count,
+            'avg_time': (serie[-2] / count) if count else 0.0,
+            'max_time': serie[-1],
+            'p50': self._quantile(serie, 0.50),
+            'p95': self._quantile(serie, 0.95),
+            'p99': self._quantile(serie, 0.99),
+        }
+
     def get_performance_stats(self) -> Dict[str, Any]:
         """Obter estatísticas de performance"""
-        stats = {}
-        
-        for query_name, times in self.query_times.items():
-            stats[query_name] = {
-                'avg_time': sum(times) / len(times),
-                'max_time': max(times),
-                'min_time': min(times),
-                'count': len(times)
-            }
-        
-        stats['cache_hit_rate'] = self.cache_hits / (self.cache_hits + self.cache_misses) if (self.cache_hits + self.cache_misses) > 0 else 0
-        stats['slow_queries'] = self.slow_queries[-10:]  # Últimas 10 queries lentas
-        
+        hist, counts = self._merge()
+        stats = {
+            'uptime_seconds': time.time() - self.started_at,
+            'routes': {},
+            'queries': {},
+            'cache': {},
+            'upstream': {},
+        }
+
+        for (metric, labels), serie in hist.items():
+            if metric == 'http_request':
+                route, method = labels
+                entry = self._hist_stats(serie)
+                entry['status'] = {
+                    lbl[2]: v for (m, lbl), v in counts.items()
+                    if m == 'http_response' and lbl[0] == route and lbl[1] == method
+                }
+                stats['routes'][f"{method} {route}"] = entry
+            elif metric == 'query':
+                stats['queries'][labels[0]] = self._hist_stats(serie)
+            elif metric == 'upstream':
+                entry = self._hist_stats(serie)
+                entry['errors'] = counts.get(('upstream_error', labels), 0)
+                stats['upstream'][labels[0]] = entry
+
+        hits = misses = 0
+        for (metric, labels), valor in counts.items():
+            if metric != 'cache':
+                continue
+            ns, tipo = labels
+            entry = stats['cache'].setdefault(ns, {'hits': 0, 'misses': 0})
+            entry['hits' if tipo == 'hit' else 'misses'] += valor
+            if tipo == 'hit':
+                hits += valor
+            else:
+                misses += valor
+        for entry in stats['cache'].values():
+            total = entry['hits'] + entry['misses']
+            entry['hit_rate'] = entry['hits'] / total if total > 0 else 0
+
+        stats['cache_hit_rate'] = hits / (hits + misses) if (hits + misses) > 0 else 0
+        stats['slow_queries'] = list(self.slow_queries)[-10:]  # Últimas 10 queries lentas
+
         return stats
 
+    def render_prometheus(self) -> str:
+        """Exportar métricas no formato texto do Prometheus"""
+        hist, counts = self._merge()
+        nomes_hist = {
+            'http_request': ('finmas_http_request_duration_seconds', ('route', 'method'), 'Latência das rotas HTTP'),
+            'query': ('finmas_query_duration_seconds', ('query',), 'Duração das queries de banco'),
+            'upstream': ('finmas_upstream_duration_seconds', ('host',), 'Duração das chamadas a serviços externos'),
+        }
+        nomes_count = {
+            'http_response': ('finmas_http_responses_total', ('route', 'method', 'status'), 'Respostas HTTP por status'),
+            'cache': ('finmas_cache_requests_total', ('namespace', 'result'), 'Consultas ao cache por namespace'),
+            'upstream_error': ('finmas_upstream_errors_total', ('host',), 'Erros em serviços externos'),
+        }
+
+        def fmt_labels(chaves, valores, extra=None):
+            pares = [f'{k}="{_escape_label(v)}"' for k, v in zip(chaves, valores)]
+            if extra:
+                pares.append(extra)
+            return '{' + ','.join(pares) + '}' if pares else ''
+
+        linhas = []
+        for metric, (nome, chaves, ajuda) in nomes_hist.items():
+            series = [(labels, serie) for (m, labels), serie in hist.items() if m == metric]
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} histogram')
+            for labels, serie in sorted(series):
+                acumulado = 0
+                for i, limite in enumerate(self.buckets):
+                    acumulado += serie[i]
+                    le = 'le="%s"' % limite
+                    linhas.append(f'{nome}_bucket{fmt_labels(chaves, labels, le)} {acumulado}')
+                acumulado += serie[len(self.buckets)]
+                le = 'le="+Inf"'
+                linhas.append(f'{nome}_bucket{fmt_labels(chaves, labels, le)} {acumulado}')
+                linhas.append(f'{nome}_sum{fmt_labels(chaves, labels)} {serie[-2]}')
+                linhas.append(f'{nome}_count{fmt_labels(chaves, labels)} {acumulado}')
+        for metric, (nome, chaves, ajuda) in nomes_count.items():
+            series = [(labels, v) for (m, labels), v in counts.items() if m == metric]
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} counter')
+            for labels, valor in sorted(series):
+                linhas.append(f'{nome}{fmt_labels(chaves, labels)} {valor}')
+        linhas.append('# HELP finmas_uptime_seconds Tempo desde o início do processo')
+        linhas.append('# TYPE finmas_uptime_seconds gauge')
+        linhas.append(f'finmas_uptime_seconds {time.time() - self.started_at}')
+        return '\n'.join(linhas) + '\n'
+
+
+def _escape_label(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def cache_namespace(key) -> str:
+    """Namespace de uma chave de cache: `carteira:joao` -> `carteira`"""
+    texto = str(key)
+    if texto.startswith('flask_cache_'):
+        texto = texto[len('flask_cache_'):]
+    return texto.split(':', 1)[0].split('/', 1)[0] or 'default'
+
+
+def instrument_cache(cache, monitor: PerformanceMonitor):
+    """Envolver `cache.get` para contar hit/miss por namespace.
+
+    O wrapper fica na instância, e `@cache.cached`/`@cache.memoize` consultam
+    via `self.get`, então as consultas dos decorators também entram. A chave do
+    memoize é um hash; ela é contada com o nome da função memoizada.
+    """
+    if getattr(cache, '_monitor_instrumented', False):
+        return cache
+    original_get = cache.get
+    original_make_key = cache._memoize_make_cache_key
+    ultima_chave = threading.local()
+
+    @wraps(original_get)
+    def get(key, *args, **kwargs):
+        valor = original_get(key, *args, **kwargs)
+        namespace = getattr(ultima_chave, 'funcao', None) if getattr(ultima_chave, 'chave', None) == key else None
+        ultima_chave.chave = None
+        monitor.log_cache(namespace or cache_namespace(key), valor is not None)
+        return valor
+
+    @wraps(original_make_key)
+    def memoize_make_cache_key(*args, **kwargs):
+        make_key = original_make_key(*args, **kwargs)
+
+        @wraps(make_key)
+        def make_cache_key(f, *f_args, **f_kwargs):
+            chave = make_key(f, *f_args, **f_kwargs)
+            ultima_chave.chave = chave
+            ultima_chave.funcao = getattr(f, '__name__', None)
+            return chave
+        return make_cache_key
+
+    cache.get = get
+    cache._memoize_make_cache_key = memoize_make_cache_key
+    cache._monitor_instrumented = True
+    return cache
+
+
+def instrument_http_session(session_cls, monitor: PerformanceMonitor):
+    """Envolver `Session.request` para contar chamadas externas por host"""
+    if getattr(session_cls, '_monitor_instrumented', False):
+        return session_cls
+    original_request = session_cls.request
+
+    @wraps(original_request)
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(str(url)).hostname or 'desconhecido'
+        inicio = time.perf_counter()
+        erro = False
+        try:
+            resp = original_request(self, method, url, *args, **kwargs)
+            erro = getattr(resp, 'status_code', 200) >= 500
+            return resp
+        except Exception:
+            erro = True
+            raise
+        finally:
+            monitor.log_upstream(host, time.perf_counter() - inicio, erro)
+
+    session_cls.request = request
+    session_cls._monitor_instrumented = True
+    return session_cls
+
+
+performance_monitor = PerformanceMonitor(slow_query_threshold=1.0)
+
+# ==================== SÉRIES HISTÓRICAS (GRÁFICOS) ====================
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Índices escolhidos pelo Largest-Triangle-Three-Buckets
+
+    Mantém o primeiro e o último ponto e, em cada bucket intermediário, o
+    ponto que forma o maior triângulo com o ponto já escolhido e a média do
+    bucket seguinte. A área é calculada de forma vetorizada dentro do bucket.
+    """
+    n = len(x)
+    if n_out is None or n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # NaN não pode vencer a disputa de área; trata como o valor anterior
+    if np.isnan(y).any():
+        mask = np.isnan(y)
+        idx = np.where(~mask, np.arange(n), 0)
+        np.maximum.accumulate(idx, out=idx)
+        y = y[idx]
+        y = np.where(np.isnan(y), 0.0, y)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selecionados = np.empty(n_out, dtype=np.int64)
+    selecionados[0] = 0
+    selecionados[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        ini, fim = edges[i], edges[i + 1]
+        prox_ini = fim
+        prox_fim = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[prox_ini:prox_fim].mean()
+        avg_y = y[prox_ini:prox_fim].mean()
+        bx = x[ini:fim]
+        by = y[ini:fim]
+        areas = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = ini + int(np.argmax(areas))
+        selecionados[i + 1] = a
+    return selecionados
+
+
+def _coluna_json(valores: np.ndarray) -> list:
+    """Array numérico -> lista JSON, com NaN/inf virando None"""
+    arr = np.asarray(valores, dtype=np.float64)
+    invalidos = ~np.isfinite(arr)
+    if invalidos.any():
+        obj = arr.astype(object)
+        obj[invalidos] = None
+        return obj.tolist()
+    return arr.tolist()
+
+
+def historico_colunar(historico, points: int = None, coluna_referencia: str = 'Close') -> Dict[str, list]:
+    """DataFrame de histórico (yfinance) -> {"date": [...], "close": [...], ...}
+
+    Monta cada coluna direto do array NumPy, sem laço por linha. Com `points`,
+    reduz a série via LTTB usando `coluna_referencia` como eixo y.
+    """
+    if historico is None or len(historico) == 0:
+        return {'date': []}
+
+    index = historico.index
+    try:
+        if getattr(index, 'tz', None) is not None:
+            index = index.tz_localize(None)
+    except Exception:
+        pass
+    datas = np.asarray(index.values, dtype='datetime64[ns]')
+
+    sel = None
+    if points:
+        ref = coluna_referencia if coluna_referencia in historico.columns else historico.columns[0]
+        sel = lttb_indices(datas.astype(np.int64).astype(np.float64), historico[ref].to_numpy(dtype=np.float64, na_value=np.nan), int(points))
+        datas = datas[sel]
+
+    payload = {'date': np.datetime_as_string(datas, unit='D').tolist()}
+    for coluna in historico.columns:
+        valores = historico[coluna].to_numpy(dtype=np.float64, na_value=np.nan)
+        if sel is not None:
+            valores = valores[sel]
+        payload[str(coluna).strip().lower().replace(' ', '_')] = _coluna_json(valores)
+    return payload
+
+
+def historico_registros(historico, points: int = None, coluna_referencia: str = 'Close') -> List[Dict[str, Any]]:
+    """DataFrame de histórico -> lista de dicts (formato legado, um por linha)"""
+    if historico is None or len(historico) == 0:
+        return []
+    if points:
+        ref = coluna_referencia if coluna_referencia in historico.columns else historico.columns[0]
+        datas = np.asarray(historico.index.values, dtype='datetime64[ns]')
+        sel = lttb_indices(datas.astype(np.int64).astype(np.float64), historico[ref].to_numpy(dtype=np.float64, na_value=np.nan), int(points))
+        historico = historico.iloc[sel]
+    registros = historico.to_dict('records')
+    for registro, data in zip(registros, historico.index):
+        registro['Date'] = data.isoformat()
+    return registros
+
+# ==================== HORÁRIO DE MERCADO (TTL DE CACHE) ====================
+
+try:
+    from zoneinfo import ZoneInfo
+    FUSO_B3 = ZoneInfo('America/Sao_Paulo')
+except Exception:
+    FUSO_B3 = None
+
+# Pregão regular da B3 (horário de Brasília), com folga para o call de fechamento
+B3_ABERTURA = (10, 0)
+B3_FECHAMENTO = (18, 30)
+
+
+def _agora_b3(agora=None):
+    if agora is not None:
+        return agora
+    from datetime import datetime, timedelta, timezone
+    if FUSO_B3 is not None:
+        return datetime.now(FUSO_B3)
+    return datetime.now(timezone(timedelta(hours=-3)))
+
+
+def b3_aberta(agora=None) -> bool:
+    """True durante o pregão regular (seg-sex, feriados não considerados)"""
+    agora = _agora_b3(agora)
+    if agora.weekday() >= 5:
+        return False
+    return B3_ABERTURA <= (agora.hour, agora.minute) < B3_FECHAMENTO
+
+
+def segundos_ate_abertura(agora=None) -> int:
+    """Segundos até a próxima abertura da B3 (0 se aberta)"""
+    from datetime import timedelta
+    agora = _agora_b3(agora)
+    if b3_aberta(agora):
+        return 0
+    abertura = agora.replace(hour=B3_ABERTURA[0], minute=B3_ABERTURA[1], second=0, microsecond=0)
+    if (agora.hour, agora.minute) >= B3_ABERTURA:
+        abertura += timedelta(days=1)
+    while abertura.weekday() >= 5:
+        abertura += timedelta(days=1)
+    return int((abertura - agora).total_seconds())
+
+
+def ttl_mercado(ttl_aberto: int, ttl_fechado_max: int = 6 * 3600, agora=None) -> int:
+    """TTL de dado de mercado: curto no pregão; fora dele vale até a próxima
+    abertura, limitado a `ttl_fechado_max`"""
+    ate_abrir = segundos_ate_abertura(agora)
+    if ate_abrir <= 0:
+        return ttl_aberto
+    return max(ttl_aberto, min(ate_abrir, ttl_fechado_max))
+
+
 # ==================== CONFIGURAÇÕES PARA RENDER ====================
 
 RENDER_OPTIMIZATIONS = {
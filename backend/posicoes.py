@@ -0,0 +1,129 @@
+"""
+Linha do tempo das posições da carteira a partir das movimentações.
+
+Para cada ticker guardamos as datas das movimentações ordenadas e a
+quantidade acumulada (cumsum, vendas negativas). A quantidade em qualquer
+conjunto de datas sai de um único np.searchsorted, em vez de varrer as
+movimentações para cada ponto. Usado pelo histórico da carteira, pelos
+proventos recebidos e pela valorização numa data.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+
+def _dia(valor):
+    """str 'YYYY-MM-DD...', date ou datetime -> numpy datetime64[D]"""
+    if isinstance(valor, str):
+        return np.datetime64(valor[:10], 'D')
+    if isinstance(valor, datetime):
+        return np.datetime64(valor.date(), 'D')
+    return np.datetime64(valor, 'D')
+
+
+def _dias(datas):
+    if isinstance(datas, np.ndarray) and np.issubdtype(datas.dtype, np.datetime64):
+        return datas.astype('datetime64[D]')
+    return np.array([_dia(d) for d in datas], dtype='datetime64[D]')
+
+
+def valores_em(datas_serie, valores_serie, datas):
+    """Último valor da série com data <= cada data (NaN antes do primeiro)"""
+    datas = _dias(datas)
+    if len(datas_serie) == 0:
+        return np.full(len(datas), np.nan)
+    idx = np.searchsorted(datas_serie, datas, side='right') - 1
+    saida = np.asarray(valores_serie, dtype=float)[np.maximum(idx, 0)]
+    return np.where(idx >= 0, saida, np.nan)
+
+
+class LinhaTempoPosicoes:
+    """Quantidade e último preço de movimentação por ticker ao longo do tempo"""
+
+    def __init__(self, movimentos):
+        """movimentos: iterável de (data, ticker, quantidade, preco, tipo)"""
+        por_ticker = {}
+        for data, ticker, quantidade, preco, tipo in movimentos:
+            if not ticker or not data:
+                continue
+            quantidade = float(quantidade or 0)
+            if str(tipo).lower() == 'venda':
+                quantidade = -quantidade
+            por_ticker.setdefault(ticker, []).append((_dia(data), quantidade, float(preco or 0)))
+
+        self._series = {}
+        for ticker, itens in por_ticker.items():
+            datas = np.array([i[0] for i in itens], dtype='datetime64[D]')
+            # estável: movimentações do mesmo dia mantêm a ordem de registro
+            ordem = np.argsort(datas, kind='stable')
+            datas = datas[ordem]
+            quantidades = np.cumsum(np.array([i[1] for i in itens])[ordem])
+            precos = np.array([i[2] for i in itens])[ordem]
+            self._series[ticker] = (datas, quantidades, precos)
+
+    @property
+    def tickers(self):
+        return sorted(self._series)
+
+    def __contains__(self, ticker):
+        return ticker in self._series
+
+    def primeira_data(self):
+        if not self._series:
+            return None
+        return min(datas[0] for datas, _, _ in self._series.values())
+
+    def quantidades(self, ticker, datas):
+        """Quantidade em carteira ao fim de cada data (0 antes da primeira movimentação)"""
+        serie = self._series.get(ticker)
+        if serie is None:
+            return np.zeros(len(datas))
+        return np.nan_to_num(valores_em(serie[0], serie[1], datas), nan=0.0)
+
+    def matriz(self, datas, tickers=None):
+        """Matriz (tickers x datas) de quantidades"""
+        tickers = self.tickers if tickers is None else list(tickers)
+        datas = _dias(datas)
+        if not tickers:
+            return tickers, np.zeros((0, len(datas)))
+        return tickers, np.vstack([self.quantidades(t, datas) for t in tickers])
+
+    def precos_movimentacao(self, ticker, datas):
+        """Preço da última movimentação do ticker até cada data (NaN antes da primeira)"""
+        serie = self._series.get(ticker)
+        if serie is None:
+            return np.full(len(datas), np.nan)
+        return valores_em(serie[0], serie[2], datas)
+
+    def series_precos(self):
+        """{ticker: (datas, preços das movimentações)} no formato aceito por valorizar"""
+        return {ticker: (datas, precos) for ticker, (datas, _, precos) in self._series.items()}
+
+    def posicoes_em(self, data):
+        """{ticker: quantidade} com posição positiva na data"""
+        dia = np.array([_dia(data)], dtype='datetime64[D]')
+        posicoes = {}
+        for ticker in self._series:
+            quantidade = float(self.quantidades(ticker, dia)[0])
+            if quantidade > 0:
+                posicoes[ticker] = quantidade
+        return posicoes
+
+    def valorizar(self, datas, precos, tickers=None):
+        """Patrimônio em cada data (só de `tickers`, se informado).
+
+        precos: {ticker: (datas, valores)} com séries ordenadas; o preço de cada
+        data é o último <= data. Ticker sem série ou sem preço na data não soma.
+        """
+        datas = _dias(datas)
+        total = np.zeros(len(datas))
+        for ticker in (self._series if tickers is None else tickers):
+            serie = precos.get(ticker)
+            if serie is None:
+                continue
+            quantidades = self.quantidades(ticker, datas)
+            valores = valores_em(_dias(serie[0]), serie[1], datas)
+            validos = (quantidades > 0) & ~np.isnan(valores)
+            total += np.where(validos, quantidades * np.nan_to_num(valores), 0.0)
+        return total
@@ -0,0 +1,213 @@
+"""
+Sugestão de ordens de rebalanceamento por ticker.
+
+As metas (targets_json) são por classe; dentro da classe o alvo de cada ticker
+segue o peso atual dele na classe (ou `pesos_ativos`, se informado). A partir
+do alvo em R$ as ordens saem em passos negociáveis de cada ativo:
+
+- Ações: lote padrão de 100; com `fracionario`, passo de 1 (o que não fecha
+  lote vai para o mercado fracionário, ticker + 'F').
+- FIIs e BDRs: lote de 1.
+- Demais (renda fixa, cripto, ativos manuais): por valor, em centavos.
+
+Tudo é feito sobre arrays NumPy: vendas do excedente (se `vender`), uma
+alocação proporcional do caixa aos déficits e um guloso que gasta o resto
+no ativo com maior déficit enquanto o passo reduz o desvio. Ordens abaixo de
+`minimo_operacao` não são geradas.
+"""
+
+import re
+import time
+
+import numpy as np
+
+try:
+    from . import models
+except ImportError:
+    import models
+
+LOTES_PADRAO = {'Ação': 100, 'FII': 1, 'BDR': 1}
+_TICKER_B3 = re.compile(r'^[A-Z]{4}\d{1,2}$')
+# Passo por valor dos ativos sem lote (R$)
+_PASSO_VALOR = 0.01
+
+
+def _ticker_b3(ticker):
+    """Ticker sem o sufixo .SA (a carteira guarda como digitado, ex.: PETR4.SA)"""
+    ticker = (ticker or '').strip().upper()
+    return ticker[:-3] if ticker.endswith('.SA') else ticker
+
+
+def _passos(carteira, fracionario):
+    """(passo em quantidade, lote padrão) de cada ativo; lote 0 = negociado por valor"""
+    n = len(carteira)
+    passo = np.zeros(n)
+    lote = np.zeros(n, dtype=int)
+    for i, ativo in enumerate(carteira):
+        ticker = _ticker_b3(ativo.get('ticker'))
+        padrao = LOTES_PADRAO.get(ativo.get('tipo'))
+        if padrao and _TICKER_B3.match(ticker):
+            lote[i] = padrao
+            passo[i] = 1 if fracionario else padrao
+        elif ativo['preco_atual'] > 0:
+            passo[i] = _PASSO_VALOR / ativo['preco_atual']
+    return passo, lote
+
+
+def _alvos(carteira, valores, targets, pesos_ativos, patrimonio):
+    """Valor alvo de cada ativo e máscara dos ativos das classes com meta"""
+    tipos = np.array([a.get('tipo') or 'Desconhecido' for a in carteira], dtype=object)
+    metas = {classe: float(pct or 0) for classe, pct in (targets or {}).items()}
+    com_meta = np.isin(tipos, list(metas)) if metas else np.zeros(len(carteira), dtype=bool)
+    # classes sem meta ficam como estão e saem da base de cálculo
+    investivel = patrimonio - valores[~com_meta].sum()
+    soma_metas = sum(metas.values())
+    alvo = valores.copy()
+    sem_ativos = {}
+    for classe, pct in metas.items():
+        valor_classe = investivel * pct / soma_metas if soma_metas > 0 else 0.0
+        idx = np.flatnonzero(tipos == classe)
+        if not len(idx):
+            if valor_classe > 0:
+                sem_ativos[classe] = valor_classe
+            continue
+        pesos = np.array([float(pesos_ativos.get(carteira[i]['ticker'], 0)) for i in idx]) if pesos_ativos else None
+        if pesos is None or pesos.sum() <= 0:
+            pesos = valores[idx]
+        if pesos.sum() <= 0:
+            pesos = np.ones(len(idx))
+        alvo[idx] = valor_classe * pesos / pesos.sum()
+    return alvo, com_meta, sem_ativos
+
+
+def planejar(carteira, targets, aporte=0.0, vender=False, minimo_operacao=0.0, fracionario=True, pesos_ativos=None):
+    """Passos comprados (+) / vendidos (-) por ativo e o caixa que sobra"""
+    precos = np.array([a['preco_atual'] for a in carteira], dtype=float)
+    quantidades = np.array([a['quantidade'] for a in carteira], dtype=float)
+    valores = np.array([a['valor_total'] for a in carteira], dtype=float)
+    passo, lote = _passos(carteira, fracionario)
+    custo = precos * passo
+    patrimonio = valores.sum() + aporte
+    alvo, com_meta, sem_ativos = _alvos(carteira, valores, targets, pesos_ativos or {}, patrimonio)
+    negociavel = com_meta & (custo > 0)
+    custo_seguro = np.where(negociavel, custo, 1.0)
+    caixa = float(aporte)
+    passos = np.zeros(len(carteira))
+
+    if vender:
+        excesso = np.where(negociavel, valores - alvo, 0.0)
+        venda = np.minimum(np.floor(np.clip(excesso, 0, None) / custo_seguro), np.floor(quantidades / np.where(passo > 0, passo, 1.0)))
+        venda = np.where(venda * custo >= minimo_operacao, venda, 0.0)
+        passos -= venda
+        caixa += float((venda * custo).sum())
+
+    deficit = np.where(negociavel, alvo - (valores + passos * custo), 0.0)
+    total_deficit = np.clip(deficit, 0, None).sum()
+    if caixa > 0 and total_deficit > 0:
+        # proporcional: cobre os déficits (ou divide o caixa entre eles) em uma passada
+        parcela = np.clip(deficit, 0, None) * min(1.0, caixa / total_deficit)
+        compra = np.floor(parcela / custo_seguro + 1e-9)
+        compra = np.where(compra * custo >= minimo_operacao, compra, 0.0)
+        passos += compra
+        caixa -= float((compra * custo).sum())
+        deficit -= compra * custo
+
+    # guloso: o resto do caixa vai para o maior déficit enquanto o passo reduz o desvio
+    comprou = passos > 0
+    while caixa > 0:
+        passos_min = np.where(comprou, 1.0, np.maximum(1.0, np.ceil(minimo_operacao / custo_seguro - 1e-9)))
+        gasto_min = passos_min * custo
+        candidatos = negociavel & (gasto_min <= caixa + 1e-9) & (2 * deficit > gasto_min)
+        if not candidatos.any():
+            break
+        i = int(np.argmax(np.where(candidatos, deficit, -np.inf)))
+        n_passos = max(passos_min[i], min(np.floor(deficit[i] / custo[i]), np.floor((caixa + 1e-9) / custo[i])))
+        passos[i] += n_passos
+        comprou[i] = True
+        caixa -= n_passos * custo[i]
+        deficit[i] -= n_passos * custo[i]
+
+    return {
+        'passos': passos,
+        'passo': passo,
+        'lote': lote,
+        'precos': precos,
+        'valores': valores,
+        'alvo': alvo,
+        'caixa': max(caixa, 0.0),
+        'sem_ativos': sem_ativos,
+    }
+
+
+def _distribuicao(carteira, valores):
+    total = valores.sum()
+    dist = {}
+    for ativo, valor in zip(carteira, valores):
+        tipo = ativo.get('tipo') or 'Desconhecido'
+        dist[tipo] = dist.get(tipo, 0.0) + float(valor)
+    return {tipo: (valor / total * 100.0 if total > 0 else 0.0) for tipo, valor in dist.items()}
+
+
+def _ordem(ativo, passos, passo, lote, preco):
+    quantidade = abs(passos) * passo
+    ordem = {
+        'ticker': ativo['ticker'],
+        'tipo': ativo.get('tipo'),
+        'acao': 'comprar' if passos > 0 else 'vender',
+        'preco': preco,
+        'valor': round(float(quantidade * preco), 2),
+    }
+    if lote:
+        quantidade = int(round(quantidade))
+        ordem['quantidade'] = quantidade
+        ordem['lote_padrao'] = (quantidade // lote) * lote
+        ordem['fracionario'] = quantidade % lote
+        if ordem['fracionario'] and lote > 1:
+            ordem['ticker_fracionario'] = f"{_ticker_b3(ativo['ticker'])}F"
+    else:
+        ordem['quantidade'] = round(float(quantidade), 8)
+    return ordem
+
+
+def sugerir_rebalanceamento(aporte=0.0, vender=False, minimo_operacao=0.0, fracionario=True, pesos_ativos=None, targets=None):
+    """Ordens por ticker para levar a carteira às metas por classe (lê config e carteira de uma vez)"""
+    inicio = time.perf_counter()
+    aporte = float(aporte or 0)
+    minimo_operacao = float(minimo_operacao or 0)
+    if aporte < 0 or minimo_operacao < 0:
+        raise ValueError("aporte e minimo_operacao não podem ser negativos")
+    if aporte == 0 and not vender:
+        raise ValueError("Informe um aporte ou permita vendas")
+    usuario = models.get_usuario_atual()
+    if not usuario:
+        return {"error": "Não autenticado"}
+    cfg, carteira = models.ler_dados_rebalance(usuario)
+    targets = targets if targets is not None else ((cfg or {}).get('targets') or {})
+    if not targets:
+        raise ValueError("Defina as metas por classe antes de rebalancear")
+    carteira = [a for a in carteira if a.get('ticker')]
+
+    plano = planejar(carteira, targets, aporte, bool(vender), minimo_operacao, bool(fracionario), pesos_ativos)
+    passos = plano['passos']
+    ordens = [
+        _ordem(carteira[i], passos[i], plano['passo'][i], int(plano['lote'][i]), float(plano['precos'][i]))
+        for i in np.flatnonzero(passos)
+    ]
+    ordens.sort(key=lambda o: (o['acao'] != 'vender', -o['valor']))
+    depois = plano['valores'] + passos * plano['passo'] * plano['precos']
+    return {
+        'modo': 'rebalanceamento' if vender else 'aporte',
+        'aporte': aporte,
+        'vender': bool(vender),
+        'minimo_operacao': minimo_operacao,
+        'fracionario': bool(fracionario),
+        'targets': targets,
+        'ordens': ordens,
+        'total_compras': round(sum(o['valor'] for o in ordens if o['acao'] == 'comprar'), 2),
+        'total_vendas': round(sum(o['valor'] for o in ordens if o['acao'] == 'vender'), 2),
+        'caixa_restante': round(plano['caixa'], 2),
+        'classes_sem_ativos': {classe: round(valor, 2) for classe, valor in plano['sem_ativos'].items()},
+        'distribuicao_atual': _distribuicao(carteira, plano['valores']),
+        'distribuicao_apos': _distribuicao(carteira, depois),
+        'tempo_ms': round((time.perf_counter() - inicio) * 1000, 2),
+    }
@@ -0,0 +1,313 @@
+"""
+Geração de relatórios PDF em background, com cache em disco.
+
+Fluxo: a rota calcula a chave do relatório (usuário, tipo, parâmetros e versão
+dos dados). Se o PDF já existe em disco ele é servido na hora. Senão, a coleta
+dos dados roda num pool de threads (precisa do banco/yfinance) e a
+renderização com reportlab roda num pool de processos, sem ocupar a thread
+web. O status fica em disco ao lado do PDF, então qualquer worker do gunicorn
+responde ao polling.
+
+Este módulo não importa models no topo: os processos do pool importam só os
+renderizadores.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+RELATORIOS_DIR = os.getenv('RELATORIOS_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'bancos_usuarios', '_relatorios'
+)
+RELATORIOS_WORKERS = int(os.getenv('RELATORIOS_WORKERS', '2'))
+RELATORIOS_RETENCAO = int(os.getenv('RELATORIOS_RETENCAO_DIAS', '7')) * 86400
+# Job parado há mais que isso (worker reiniciado no meio) é reagendado
+JOB_TIMEOUT = 600
+
+TIPOS = ('movimentacoes', 'posicoes', 'rendimentos')
+NOMES_ARQUIVO = {
+    'movimentacoes': 'movimentacoes.pdf',
+    'posicoes': 'posicoes.pdf',
+    'rendimentos': 'rendimentos.pdf',
+}
+# Relatórios que dependem de cotação mudam a cada dia e a cada refresh de preços,
+# mesmo sem escrita do usuário
+_DEPENDE_DE_MERCADO = {'posicoes', 'rendimentos'}
+
+
+# ==================== RENDERIZAÇÃO (processo separado) ====================
+
+def _novo_canvas(titulo):
+    from io import BytesIO
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - 40
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, y, titulo)
+    y -= 20
+    c.setFont("Helvetica", 9)
+    return buffer, c, height, y
+
+
+def _escrever_linhas(titulo, linhas):
+    buffer, c, height, y = _novo_canvas(titulo)
+    for line in linhas:
+        if y < 40:
+            c.showPage(); y = height - 40; c.setFont("Helvetica", 9)
+        c.drawString(40, y, line)
+        y -= 14
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def render_movimentacoes(rows):
+    return _escrever_linhas("Relatório de Movimentações", (
+        f"{r.get('data','')}  {r.get('ticker',''):8}  {r.get('tipo',''):7}  qtd={r.get('quantidade','')}  preco={r.get('preco','')}"
+        for r in rows
+    ))
+
+
+def render_posicoes(itens):
+    return _escrever_linhas("Relatório de Posições", (
+        f"{it.get('ticker',''):8}  {(it.get('nome_completo') or '')[:40]}  qtd={it.get('quantidade','')}  val={it.get('valor_total','')}"
+        for it in itens
+    ))
+
+
+def render_rendimentos(datas, carteira):
+    return _escrever_linhas("Relatório de Rendimentos", (
+        f"{d}: {carteira[i] if i < len(carteira) else None}"
+        for i, d in enumerate(datas)
+    ))
+
+
+# ==================== COLETA DE DADOS (thread, com banco) ====================
+
+def _coletar(tipo, params):
+    """Lê os dados do relatório; roda dentro de usuario_contexto + app_context"""
+    from models import iterar_movimentacoes, obter_carteira, obter_historico_carteira_comparado, get_usuario_atual
+
+    if tipo == 'movimentacoes':
+        colunas = ('data', 'ticker', 'nome_completo', 'quantidade', 'preco', 'tipo')
+        rows = [
+            dict(zip(colunas, row)) for row in iterar_movimentacoes(
+                get_usuario_atual(), params.get('mes'), params.get('ano'), params.get('inicio'), params.get('fim')
+            )
+        ]
+        return render_movimentacoes, (rows,)
+    if tipo == 'posicoes':
+        itens = [
+            {k: it.get(k) for k in ('ticker', 'nome_completo', 'quantidade', 'valor_total')}
+            for it in (obter_carteira() or [])
+        ]
+        return render_posicoes, (itens,)
+    hist = obter_historico_carteira_comparado(params.get('periodo') or 'mensal') or {}
+    return render_rendimentos, (list(hist.get('datas') or []), list(hist.get('carteira_valor') or []))
+
+
+# ==================== CACHE EM DISCO ====================
+
+def _dir_usuario(usuario):
+    seguro = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in usuario)
+    caminho = os.path.join(RELATORIOS_DIR, seguro)
+    os.makedirs(caminho, exist_ok=True)
+    return caminho
+
+
+def _mtime_marcador(usuario, nome):
+    try:
+        return os.stat(os.path.join(_dir_usuario(usuario), nome)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _tocar_marcador(usuario, nome):
+    if not usuario:
+        return
+    marcador = os.path.join(_dir_usuario(usuario), nome)
+    try:
+        with open(marcador, 'a'):
+            pass
+        os.utime(marcador, None)
+    except OSError:
+        pass
+
+
+def versao_dados(usuario):
+    """Versão dos dados do usuário: mtime do marcador tocado a cada escrita"""
+    return _mtime_marcador(usuario, '.versao')
+
+
+def versao_precos(usuario):
+    """Versão das cotações da carteira: mtime do marcador tocado a cada refresh de preços"""
+    return _mtime_marcador(usuario, '.precos')
+
+
+def marcar_dados_alterados(usuario):
+    """Invalida os relatórios do usuário (chamado após requests de escrita)"""
+    _tocar_marcador(usuario, '.versao')
+
+
+def marcar_precos_atualizados(usuario):
+    """Invalida posições/rendimentos após um refresh de preços (agendador, job ou rota)"""
+    _tocar_marcador(usuario, '.precos')
+
+
+def chave_relatorio(usuario, tipo, params):
+    partes = {
+        'usuario': usuario,
+        'tipo': tipo,
+        'params': {k: v for k, v in sorted(params.items()) if v},
+        'versao': versao_dados(usuario),
+    }
+    if tipo in _DEPENDE_DE_MERCADO:
+        partes['dia'] = datetime.now().strftime('%Y-%m-%d')
+        partes['precos'] = versao_precos(usuario)
+    return hashlib.sha256(json.dumps(partes, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+def _caminhos(usuario, job_id):
+    base = os.path.join(_dir_usuario(usuario), job_id)
+    return base + '.pdf', base + '.json'
+
+
+def _gravar_status(caminho_status, **status):
+    tmp = caminho_status + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(status, f)
+    os.replace(tmp, caminho_status)
+
+
+def status_relatorio(usuario, job_id):
+    """Status do job lido do disco (funciona de qualquer worker)"""
+    if not job_id.isalnum():
+        return None
+    caminho_pdf, caminho_status = _caminhos(usuario, job_id)
+    status = None
+    try:
+        with open(caminho_status, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if os.path.exists(caminho_pdf):
+        status = dict(status or {}, status='concluido')
+    if status is not None:
+        status['job_id'] = job_id
+    return status
+
+
+def arquivo_relatorio(usuario, job_id):
+    if not job_id.isalnum():
+        return None
+    caminho_pdf, _ = _caminhos(usuario, job_id)
+    return caminho_pdf if os.path.exists(caminho_pdf) else None
+
+
+def _limpar_antigos(usuario):
+    limite = time.time() - RELATORIOS_RETENCAO
+    pasta = _dir_usuario(usuario)
+    for nome in os.listdir(pasta):
+        if nome.startswith('.'):
+            continue
+        caminho = os.path.join(pasta, nome)
+        try:
+            if os.stat(caminho).st_mtime < limite:
+                os.remove(caminho)
+        except OSError:
+            pass
+
+
+# ==================== EXECUÇÃO ====================
+
+_process_pool = None
+_thread_pool = None
+_pools_lock = threading.Lock()
+_em_andamento = set()
+
+
+def _pools():
+    global _process_pool, _thread_pool
+    with _pools_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=RELATORIOS_WORKERS, thread_name_prefix='relatorios')
+        if _process_pool is None:
+            # spawn: o processo filho não herda locks/threads do gunicorn
+            _process_pool = ProcessPoolExecutor(
+                max_workers=RELATORIOS_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _thread_pool, _process_pool
+
+
+def _executar(app, usuario, tipo, params, job_id):
+    global _process_pool
+    from models import usuario_contexto
+
+    caminho_pdf, caminho_status = _caminhos(usuario, job_id)
+    inicio = time.time()
+    try:
+        _gravar_status(caminho_status, status='coletando', tipo=tipo, criado_em=inicio)
+        with app.app_context(), usuario_contexto(usuario):
+            renderizador, args = _coletar(tipo, params)
+        _gravar_status(caminho_status, status='renderizando', tipo=tipo, criado_em=inicio)
+        _, process_pool = _pools()
+        try:
+            conteudo = process_pool.submit(renderizador, *args).result()
+        except BrokenProcessPool:
+            # processo filho morreu (OOM, kill): descarta o pool para o próximo job recriar
+            with _pools_lock:
+                if _process_pool is process_pool:
+                    _process_pool = None
+            raise
+        tmp = caminho_pdf + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(conteudo)
+        os.replace(tmp, caminho_pdf)
+        _gravar_status(caminho_status, status='concluido', tipo=tipo, criado_em=inicio,
+                       concluido_em=time.time(), bytes=len(conteudo))
+    except Exception as e:
+        print(f"Erro ao gerar relatório {tipo} para {usuario}: {e}")
+        try:
+            _gravar_status(caminho_status, status='erro', tipo=tipo, criado_em=inicio, erro=str(e))
+        except Exception:
+            pass
+    finally:
+        with _pools_lock:
+            _em_andamento.discard(job_id)
+
+
+def solicitar_relatorio(app, usuario, tipo, params):
+    """Retorna o status do relatório; agenda a geração se ainda não existir"""
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de relatório inválido: {tipo}")
+    job_id = chave_relatorio(usuario, tipo, params)
+    status = status_relatorio(usuario, job_id)
+    if status and status.get('status') == 'concluido':
+        return status
+    if status and status.get('status') in ('pendente', 'coletando', 'renderizando') \
+            and time.time() - (status.get('criado_em') or 0) < JOB_TIMEOUT:
+        return status
+
+    thread_pool, _ = _pools()
+    with _pools_lock:
+        if job_id in _em_andamento:
+            return {'job_id': job_id, 'status': 'pendente', 'tipo': tipo}
+        _em_andamento.add(job_id)
+    try:
+        _limpar_antigos(usuario)
+    except Exception:
+        pass
+    _, caminho_status = _caminhos(usuario, job_id)
+    _gravar_status(caminho_status, status='pendente', tipo=tipo, criado_em=time.time())
+    thread_pool.submit(_executar, app, usuario, tipo, dict(params), job_id)
+    return {'job_id': job_id, 'status': 'pendente', 'tipo': tipo}
@@ -0,0 +1,755 @@
+"""
+Motor de simulação da carteira (Monte Carlo) em NumPy.
+
+Os parâmetros saem do histórico guardado na base local de preços
+(snapshots.precos_diarios): log-retornos mensais por ativo, média e
+covariância, agregados por classe (tipo) com os pesos atuais da carteira ou
+mantidos por ativo. Ativos sem histórico suficiente (renda fixa, ativos
+manuais, recém-listados) entram sem correlação: renda fixa rende o CDI com
+volatilidade baixa, os demais usam a premissa padrão de 12% a.a. / 20% a.a.
+
+As trajetórias mensais correlacionadas são geradas em blocos (memória limitada
+a SIM_ELEMENTOS_BLOCO normais por vez) e escritas num único buffer float32 com
+o patrimônio mensal de cada trajetória (meses x n, no máximo SIM_MAX_ELEMENTOS:
+96 MB). Os percentis do fan chart saem de uma amostra de SIM_AMOSTRA_FAIXAS
+trajetórias; os do valor final usam todas.
+
+Também ficam aqui os choques em indexadores (vários cenários numa matriz
+ativos x cenários) e a simulação das metas (trajetórias do saldo com aportes).
+
+Os resultados (Monte Carlo, choques, projeção de metas) ficam no cache sob um
+hash de (versão da carteira, parâmetros, seed). No modo progressivo as
+trajetórias saem em etapas (1k, 10k, 100k, ...) e cada etapa publica as
+estimativas parciais pelo stream SSE.
+"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import models
+    from . import snapshots
+except ImportError:
+    import models
+    import snapshots
+
+SIM_HISTORICO_ANOS = int(os.getenv('SIM_HISTORICO_ANOS', '5'))
+SIM_MAX_SIMULACOES = int(os.getenv('SIM_MAX_SIMULACOES', '200000'))
+SIM_MAX_MESES = 600
+# Teto de meses x trajetórias por simulação (buffer float32): 24M = 96 MB, ex. 200k x 10 anos
+SIM_MAX_ELEMENTOS = int(os.getenv('SIM_MAX_ELEMENTOS', str(24_000_000)))
+# Trajetórias usadas nos percentis mês a mês (o np.partition copia a amostra)
+SIM_AMOSTRA_FAIXAS = 20_000
+# Normais geradas por bloco (float32): 8M = 32 MB, e o mesmo para a trajetória refletida
+SIM_ELEMENTOS_BLOCO = int(os.getenv('SIM_ELEMENTOS_BLOCO', str(8_000_000)))
+# Mínimo de meses de histórico para estimar média/covariância de um ativo
+SIM_MIN_MESES = 12
+PERCENTIS = (5, 25, 50, 75, 95)
+# Pontos do modo progressivo em que as estimativas parciais são publicadas
+SIM_ETAPAS = (1_000, 10_000, 100_000)
+SIM_CACHE_TTL = int(os.getenv('SIM_CACHE_TTL', '3600'))
+
+# Premissas para ativos sem histórico (anuais)
+_RETORNO_PADRAO = 0.12
+_VOLATILIDADE_PADRAO = 0.20
+_VOLATILIDADE_RENDA_FIXA = 0.01
+_CDI_PADRAO = 13.65
+
+
+# ==================== PARÂMETROS ====================
+
+def _log_mensal(taxa_anual):
+    return np.log1p(taxa_anual) / 12.0
+
+
+def _psd(cov):
+    """Projeta a covariância (estimada par a par) no cone semidefinido positivo"""
+    cov = (cov + cov.T) / 2.0
+    autovalores, autovetores = np.linalg.eigh(cov)
+    if autovalores.min() >= 0:
+        return cov
+    autovalores = np.clip(autovalores, 0.0, None)
+    return (autovetores * autovalores) @ autovetores.T
+
+
+def _cholesky(cov):
+    k = cov.shape[0]
+    try:
+        return np.linalg.cholesky(cov + np.eye(k) * 1e-12)
+    except np.linalg.LinAlgError:
+        # semidefinida (ativos perfeitamente correlacionados): raiz pela decomposição espectral
+        autovalores, autovetores = np.linalg.eigh(_psd(cov))
+        return autovetores * np.sqrt(np.clip(autovalores, 0.0, None))
+
+
+def _retornos_mensais(simbolos, anos, prazo=None):
+    """DataFrame (meses x símbolo) de log-retornos mensais a partir da base local"""
+    inicio = date.today() - timedelta(days=365 * anos)
+    snapshots.sincronizar_precos(simbolos, inicio, prazo)
+    base = snapshots.ler_precos(simbolos, inicio=inicio)
+    colunas = {}
+    for simbolo, (datas, valores) in base.items():
+        if len(datas) < 2:
+            continue
+        mensal = pd.Series(valores, index=pd.DatetimeIndex(datas)).resample('ME').last().dropna()
+        retornos = np.log(mensal[mensal > 0]).diff().dropna()
+        if len(retornos) >= SIM_MIN_MESES:
+            colunas[simbolo] = retornos
+    return pd.DataFrame(colunas)
+
+
+def _eh_renda_fixa(ativo):
+    return ativo.get('tipo') == 'Renda Fixa' or bool(ativo.get('indexador'))
+
+
+def estimar_parametros(carteira, agrupamento='classe', anos=SIM_HISTORICO_ANOS, prazo=None):
+    """Parâmetros mensais (log-retorno) para a simulação.
+
+    Retorna dict com nomes, valores iniciais (k,), mu (k,), cov (k, k) e, por
+    ativo, a fonte dos parâmetros ('historico' ou 'premissa').
+    """
+    ativos = [a for a in carteira if a.get('ticker') and float(a.get('valor_total') or 0) > 0]
+    if not ativos:
+        raise ValueError("Carteira vazia")
+    valores = np.array([float(a['valor_total']) for a in ativos])
+    simbolos = [None if _eh_renda_fixa(a) else models._normalize_ticker_for_yf(a['ticker']) for a in ativos]
+    retornos = _retornos_mensais([s for s in simbolos if s], anos, prazo)
+
+    n = len(ativos)
+    mu = np.zeros(n)
+    cov = np.zeros((n, n))
+    com_historico = [i for i, s in enumerate(simbolos) if s in retornos.columns]
+    if com_historico:
+        colunas = [simbolos[i] for i in com_historico]
+        media = retornos[colunas].mean().to_numpy()
+        covariancia = retornos[colunas].cov(min_periods=SIM_MIN_MESES).fillna(0.0).to_numpy()
+        idx = np.array(com_historico)
+        mu[idx] = media
+        cov[np.ix_(idx, idx)] = covariancia
+
+    taxas = models.obter_taxas_indexadores()
+    cdi = (taxas.get('CDI') or _CDI_PADRAO) / 100.0
+    fontes = []
+    for i, ativo in enumerate(ativos):
+        if i in com_historico:
+            fontes.append('historico')
+            continue
+        fontes.append('premissa')
+        if simbolos[i] is None:
+            mu[i] = _log_mensal(cdi)
+            cov[i, i] = (_VOLATILIDADE_RENDA_FIXA ** 2) / 12.0
+        else:
+            mu[i] = _log_mensal(_RETORNO_PADRAO) - (_VOLATILIDADE_PADRAO ** 2) / 24.0
+            cov[i, i] = (_VOLATILIDADE_PADRAO ** 2) / 12.0
+
+    nomes = [a['ticker'] for a in ativos]
+    if agrupamento == 'classe':
+        classes = sorted({a.get('tipo') or 'Desconhecido' for a in ativos})
+        pesos = np.zeros((n, len(classes)))
+        for i, ativo in enumerate(ativos):
+            pesos[i, classes.index(ativo.get('tipo') or 'Desconhecido')] = valores[i]
+        valores_classe = pesos.sum(axis=0)
+        pesos = pesos / valores_classe
+        mu = pesos.T @ mu
+        cov = pesos.T @ cov @ pesos
+        valores = valores_classe
+        nomes = classes
+
+    return {
+        'nomes': nomes,
+        'valores': valores,
+        'mu': mu,
+        'cov': _psd(cov),
+        'fontes': dict(zip([a['ticker'] for a in ativos], fontes)),
+        'meses_historico': int(len(retornos)),
+    }
+
+
+# ==================== MOTOR ====================
+
+def simular_trajetorias(valores, mu, cov, meses, n, seed=None, saida=None):
+    """Patrimônio mensal (meses x n, float32) de n trajetórias correlacionadas.
+
+    Cada componente (classe ou ativo) cresce por exp(cumsum) de log-retornos
+    N(mu, cov) mensais, sem rebalanceamento. As trajetórias saem em pares
+    antitéticos (+z, -z): metade das normais e menor variância do estimador.
+    Mesma seed e mesmos parâmetros reproduzem o resultado. Com `saida`
+    (meses x n, float32) escreve nela em vez de alocar.
+    """
+    valores = np.asarray(valores, dtype=np.float32)
+    k = len(valores)
+    rng = np.random.default_rng(seed)
+    fator = _cholesky(np.asarray(cov, dtype=float)).T.astype(np.float32)
+    deriva = np.asarray(mu, dtype=np.float32)
+    # 2 * mu * t: reflete a trajetória em torno da tendência (antitética)
+    tendencia_dupla = (2.0 * np.arange(1, meses + 1, dtype=np.float32)[:, None, None]) * deriva
+    pares = (n + 1) // 2
+    bloco = max(1, min(pares, SIM_ELEMENTOS_BLOCO // (meses * k)))
+    if saida is None:
+        saida = np.empty((meses, n), dtype=np.float32)
+    for inicio in range(0, pares, bloco):
+        b = min(bloco, pares - inicio)
+        log_r = rng.standard_normal((meses, b, k), dtype=np.float32)
+        if k == 1:
+            log_r *= fator[0, 0]
+        else:
+            log_r = log_r @ fator
+        log_r += deriva
+        np.cumsum(log_r, axis=0, out=log_r)
+        refletida = np.exp(tendencia_dupla - log_r)
+        np.exp(log_r, out=log_r)
+        meio = 2 * inicio + b
+        saida[:, 2 * inicio:meio] = log_r @ valores
+        # n ímpar: a última trajetória refletida fica de fora
+        fim = min(meio + b, n)
+        saida[:, meio:fim] = (refletida @ valores)[:, :fim - meio]
+    return saida
+
+
+def _etapas(n):
+    """Tamanhos acumulados das estimativas parciais: 1k, 10k, 100k, ..., n"""
+    return [etapa for etapa in SIM_ETAPAS if etapa < n] + [n]
+
+
+def simular_progressivo(valores, mu, cov, meses, n, seed=None):
+    """Gera as n trajetórias por etapas, entregando (feitas, patrimonio[:, :feitas]).
+
+    Cada etapa usa uma semente filha de `seed` (SeedSequence.spawn), e as
+    trajetórias já geradas são mantidas: a estimativa de cada etapa inclui as
+    anteriores, e a mesma seed reproduz o resultado final com ou sem o modo
+    progressivo.
+    """
+    etapas = _etapas(n)
+    sementes = np.random.SeedSequence(seed).spawn(len(etapas))
+    patrimonio = np.empty((meses, n), dtype=np.float32)
+    feitas = 0
+    for etapa, semente in zip(etapas, sementes):
+        simular_trajetorias(valores, mu, cov, meses, etapa - feitas, seed=semente,
+                            saida=patrimonio[:, feitas:etapa])
+        feitas = etapa
+        yield feitas, patrimonio[:, :feitas]
+
+
+def _percentis(matriz, percentis):
+    """np.percentile (linear) por linha com um único np.partition"""
+    n = matriz.shape[-1]
+    posicoes = np.asarray(percentis, dtype=float) / 100.0 * (n - 1)
+    baixo = np.floor(posicoes).astype(int)
+    alto = np.ceil(posicoes).astype(int)
+    particao = np.partition(matriz, np.unique(np.concatenate([baixo, alto])), axis=-1)
+    inferior = particao[..., baixo].astype(float)
+    return inferior + (particao[..., alto] - inferior) * (posicoes - baixo)
+
+
+def resumir(patrimonio, valor_inicial, periodo_anos, confianca=95, amostra=1000):
+    """Estatísticas do valor final e faixas de percentis mês a mês (fan chart)"""
+    finais = patrimonio[-1].astype(float)
+    n = len(finais)
+    valor_esperado = float(finais.mean())
+    desvio = float(finais.std())
+    baixo = (100 - confianca) / 2.0
+    finais_p = np.percentile(finais, PERCENTIS + (baixo, 100 - baixo))
+    # amostra espaçada: os blocos +z / -z antitéticos ficam representados igualmente
+    passo = -(-n // SIM_AMOSTRA_FAIXAS)
+    faixas = _percentis(patrimonio[:, ::passo], PERCENTIS).T
+    return {
+        "percentis": {f"p{p}": float(v) for p, v in zip(PERCENTIS, finais_p)},
+        "intervalo_confianca": {"confianca": confianca, "inferior": float(finais_p[-2]), "superior": float(finais_p[-1])},
+        "probabilidade_perda": float((finais < valor_inicial).sum() / n * 100),
+        "valor_esperado": valor_esperado,
+        "volatilidade": desvio / valor_esperado if valor_esperado else 0.0,
+        "sharpe": (valor_esperado - valor_inicial) / (desvio * np.sqrt(periodo_anos)) if desvio else 0.0,
+        "cenarios": finais[:amostra].tolist(),
+        "faixas": {
+            "meses": list(range(1, patrimonio.shape[0] + 1)),
+            **{f"p{p}": [float(v) for v in linha] for p, linha in zip(PERCENTIS, faixas)},
+        },
+        "n_simulacoes": n,
+    }
+
+
+# ==================== API ====================
+
+def validar_monte_carlo(n_simulacoes, periodo_anos, confianca):
+    n_simulacoes = int(n_simulacoes)
+    meses = int(round(float(periodo_anos) * 12))
+    confianca = float(confianca)
+    if not 1 <= n_simulacoes <= SIM_MAX_SIMULACOES:
+        raise ValueError(f"nSimulacoes deve estar entre 1 e {SIM_MAX_SIMULACOES}")
+    if not 1 <= meses <= SIM_MAX_MESES:
+        raise ValueError(f"periodoAnos deve estar entre 1 mês e {SIM_MAX_MESES // 12} anos")
+    if n_simulacoes * meses > SIM_MAX_ELEMENTOS:
+        raise ValueError(f"nSimulacoes x meses acima do limite: até {SIM_MAX_ELEMENTOS // meses} simulações "
+                         f"para {meses} meses")
+    if not 50 <= confianca < 100:
+        raise ValueError("confianca deve estar entre 50 e 100")
+    return n_simulacoes, meses, confianca
+
+
+def params_monte_carlo(n_simulacoes=10000, periodo_anos=5, confianca=95, seed=None, agrupamento='classe'):
+    """Parâmetros validados e normalizados (também usados na chave do cache)"""
+    n_simulacoes, meses, confianca = validar_monte_carlo(n_simulacoes, periodo_anos, confianca)
+    if agrupamento not in ('classe', 'ativo'):
+        raise ValueError("agrupamento deve ser 'classe' ou 'ativo'")
+    return {
+        'n': n_simulacoes,
+        'meses': meses,
+        'confianca': confianca,
+        'seed': int(seed) if seed is not None else None,
+        'agrupamento': agrupamento,
+    }
+
+
+def preparar_monte_carlo(params, carteira=None):
+    """Estima os parâmetros da carteira e fixa a seed; ValueError se não há o que simular"""
+    if carteira is None:
+        carteira = models.obter_carteira()
+    if not carteira:
+        raise ValueError("Carteira vazia")
+    plano = dict(params)
+    plano['parametros'] = estimar_parametros(carteira, params['agrupamento'])
+    if plano['seed'] is None:
+        plano['seed'] = int(np.random.SeedSequence().entropy % (2 ** 32))
+    return plano
+
+
+def resultados_monte_carlo(plano, parciais=True):
+    """Gera (feitas, resultado) a cada etapa; o último traz também os parâmetros estimados"""
+    parametros = plano['parametros']
+    meses = plano['meses']
+    valor_inicial = float(parametros['valores'].sum())
+    inicio = time.time()
+    for feitas, patrimonio in simular_progressivo(parametros['valores'], parametros['mu'], parametros['cov'],
+                                                  meses, plano['n'], seed=plano['seed']):
+        final = feitas == plano['n']
+        if not (parciais or final):
+            continue
+        resultado = resumir(patrimonio, valor_inicial, meses / 12.0, plano['confianca'])
+        resultado.update({"valor_atual": valor_inicial, "seed": plano['seed']})
+        if final:
+            desvios = np.sqrt(np.diag(parametros['cov']))
+            resultado["parametros"] = {
+                "agrupamento": plano['agrupamento'],
+                "componentes": parametros['nomes'],
+                "retorno_anual": [float(np.expm1(m * 12)) for m in parametros['mu']],
+                "volatilidade_anual": [float(d * np.sqrt(12)) for d in desvios],
+                "correlacao": np.round(parametros['cov'] / np.outer(desvios, desvios).clip(1e-18), 4).tolist(),
+                "fontes": parametros['fontes'],
+                "meses_historico": parametros['meses_historico'],
+            }
+            print(f"Monte Carlo concluído: {feitas} trajetórias x {meses} meses em {time.time() - inicio:.2f}s")
+        yield feitas, resultado
+
+
+def executar_monte_carlo(n_simulacoes=10000, periodo_anos=5, confianca=95, seed=None, agrupamento='classe', carteira=None):
+    """
+    Executa simulação Monte Carlo para a carteira
+    """
+    try:
+        params = params_monte_carlo(n_simulacoes, periodo_anos, confianca, seed, agrupamento)
+        if not models.get_usuario_atual():
+            return {"error": "Usuário não autenticado"}
+        resultado = None
+        for _, resultado in resultados_monte_carlo(preparar_monte_carlo(params, carteira), parciais=False):
+            pass
+        return resultado
+    except ValueError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        print(f"Erro na simulação Monte Carlo: {e}")
+        return {"error": str(e)}
+
+
+def eventos_monte_carlo(params=None, carteira=None, chave=None, resultado=None):
+    """Gerador SSE do modo progressivo: `inicio`, `parcial` a cada etapa e `resultado` no fim.
+
+    A estimativa dos parâmetros (sincroniza preços, pode levar segundos) roda
+    aqui dentro, depois do evento `inicio`: a resposta começa na hora. Com
+    `resultado` (já em cache) só emite o evento final. O resultado completo
+    vai para o cache sob `chave`. O cliente fecha o EventSource ao receber
+    `resultado` (senão o navegador reconecta e recebe o resultado do cache).
+    """
+    def _evento(nome, dados):
+        return f"event: {nome}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n"
+
+    if resultado is not None:
+        yield _evento('resultado', {**resultado, 'em_cache': True})
+        return
+    yield _evento('inicio', {'total': params['n'], 'etapa': 'estimando_parametros'})
+    try:
+        plano = preparar_monte_carlo(params, carteira)
+        for feitas, parcial in resultados_monte_carlo(plano):
+            if feitas < plano['n']:
+                yield _evento('parcial', {**parcial, 'total': plano['n']})
+            else:
+                guardar_resultado(chave, parcial)
+                yield _evento('resultado', parcial)
+    except Exception as e:
+        print(f"Erro na simulação Monte Carlo progressiva: {e}")
+        yield _evento('erro', {'error': str(e)})
+
+
+# ==================== CHOQUES EM INDEXADORES ====================
+
+# Ordem das linhas da matriz de choques (p.p. ao ano)
+INDEXADORES_CHOQUE = ('cdi', 'ipca', 'selic')
+CHOQUES_MAX_CENARIOS = 200
+# Horizonte em que a mudança de rendimento dos pós-fixados é acumulada
+CHOQUES_HORIZONTE_MESES = 12
+# Prazo assumido para título marcado a mercado sem vencimento cadastrado
+_PRAZO_PADRAO_ANOS = 3.0
+
+
+def _taxas_anuais():
+    """CDI, IPCA e SELIC atuais em taxa anual decimal (IPCA do BCB vem mensal)"""
+    taxas = models.obter_taxas_indexadores()
+    ipca_mensal = taxas.get('IPCA') or 0.5
+    return {
+        'cdi': (taxas.get('CDI') or _CDI_PADRAO) / 100.0,
+        'ipca': (1 + ipca_mensal / 100.0) ** 12 - 1,
+        'selic': (taxas.get('SELIC') or 13.75) / 100.0,
+    }
+
+
+def _prazo_anos(vencimento, hoje):
+    try:
+        dias = (date.fromisoformat(str(vencimento)[:10]) - hoje).days
+    except (TypeError, ValueError):
+        return None
+    return max(dias, 0) / 365.25
+
+
+def exposicoes_choques(carteira, taxas):
+    """Sensibilidade de cada ativo aos choques, em arrays (ativos x indexadores).
+
+    Pós-fixados (CDI, CDI+, SELIC, IPCA): o choque muda a taxa de rendimento
+    (`base` + `carrego` @ choques) acumulada no horizonte. Prefixado e IPCA+:
+    marcação a mercado de um título zero-cupom com taxa `taxa` e `prazo` em
+    anos; o choque desloca a taxa em `marcacao` @ choques (prefixado segue a
+    SELIC, IPCA+ a taxa real SELIC - IPCA). IPCA+ também carrega o IPCA.
+    Ações, FIIs e demais ativos não respondem aos choques.
+    """
+    hoje = date.today()
+    n = len(carteira)
+    col = {nome: i for i, nome in enumerate(INDEXADORES_CHOQUE)}
+    valores = np.zeros(n)
+    base = np.zeros(n)
+    carrego = np.zeros((n, len(INDEXADORES_CHOQUE)))
+    taxa = np.zeros(n)
+    prazo = np.zeros(n)
+    marcacao = np.zeros((n, len(INDEXADORES_CHOQUE)))
+    prazo_estimado = np.zeros(n, dtype=bool)
+    for i, ativo in enumerate(carteira):
+        valores[i] = float(ativo.get('valor_total') or 0)
+        indexador = (ativo.get('indexador') or '').upper()
+        pct = ativo.get('indexador_pct')
+        pct = float(pct) / 100.0 if pct not in (None, '') else None
+        if indexador in ('CDI', 'SELIC', 'IPCA'):
+            fracao = pct if pct else 1.0
+            nome = indexador.lower()
+            base[i] = fracao * taxas[nome]
+            carrego[i, col[nome]] = fracao
+        elif indexador == 'CDI+':
+            base[i] = taxas['cdi'] + (pct or 0.0)
+            carrego[i, col['cdi']] = 1.0
+        elif indexador in ('PREFIXADO', 'IPCA+'):
+            taxa[i] = pct or 0.0
+            anos = _prazo_anos(ativo.get('vencimento'), hoje)
+            prazo_estimado[i] = anos is None
+            prazo[i] = _PRAZO_PADRAO_ANOS if anos is None else anos
+            marcacao[i, col['selic']] = 1.0
+            if indexador == 'IPCA+':
+                marcacao[i, col['ipca']] = -1.0
+                base[i] = taxas['ipca']
+                carrego[i, col['ipca']] = 1.0
+    return {
+        'valores': valores,
+        'base': base,
+        'carrego': carrego,
+        'taxa': taxa,
+        'prazo': prazo,
+        'marcacao': marcacao,
+        'prazo_estimado': prazo_estimado,
+    }
+
+
+def fatores_choques(exposicao, choques, horizonte_meses=CHOQUES_HORIZONTE_MESES):
+    """Fator de valor (ativos x cenários) para a matriz de choques (indexadores x cenários, em p.p.)"""
+    choques = np.asarray(choques, dtype=float) / 100.0
+    base = exposicao['base'][:, None]
+    # pós-fixados: rendimento com a taxa chocada / rendimento atual, no horizonte
+    rendimento = np.clip(1.0 + base + exposicao['carrego'] @ choques, 1e-6, None)
+    fator = (rendimento / (1.0 + base)) ** (horizonte_meses / 12.0)
+    # marcação a mercado do zero-cupom: P = (1 + y) ** -T
+    taxa = exposicao['taxa'][:, None]
+    taxa_chocada = np.clip(1.0 + taxa + exposicao['marcacao'] @ choques, 1e-6, None)
+    fator *= ((1.0 + taxa) / taxa_chocada) ** exposicao['prazo'][:, None]
+    return fator
+
+
+def avaliar_cenarios(cenarios, carteira=None, horizonte_meses=CHOQUES_HORIZONTE_MESES):
+    """Avalia M cenários de choque de uma vez.
+
+    cenarios: lista de {'nome', 'choques': {'cdi', 'ipca', 'selic'}} (p.p. ao
+    ano). Retorna os ativos com duration/prazo, e por cenário os totais e a
+    variação de cada ativo (na ordem de `ativos`).
+    """
+    if not cenarios:
+        raise ValueError("Informe ao menos um cenário")
+    if len(cenarios) > CHOQUES_MAX_CENARIOS:
+        raise ValueError(f"Máximo de {CHOQUES_MAX_CENARIOS} cenários por chamada")
+    if not 0 < int(horizonte_meses) <= SIM_MAX_MESES:
+        raise ValueError(f"horizonte_meses deve estar entre 1 e {SIM_MAX_MESES}")
+    if carteira is None:
+        carteira = models.obter_carteira() or []
+    carteira = [a for a in carteira if a.get('ticker')]
+
+    choques = np.array([[float((c.get('choques') or {}).get(nome) or 0) for c in cenarios]
+                        for nome in INDEXADORES_CHOQUE]).reshape(len(INDEXADORES_CHOQUE), len(cenarios))
+    taxas = _taxas_anuais()
+    exposicao = exposicoes_choques(carteira, taxas)
+    valores = exposicao['valores']
+    simulados = valores[:, None] * fatores_choques(exposicao, choques, int(horizonte_meses))
+    variacoes = simulados - valores[:, None]
+
+    valor_atual = float(valores.sum())
+    totais = simulados.sum(axis=0)
+    duration = exposicao['prazo'] / (1.0 + exposicao['taxa'])
+    return {
+        "ativos": [
+            {
+                "ticker": ativo['ticker'],
+                "tipo": ativo.get('tipo'),
+                "indexador": ativo.get('indexador'),
+                "valor_atual": float(valores[i]),
+                "prazo_anos": round(float(exposicao['prazo'][i]), 2) if exposicao['prazo'][i] else None,
+                "duration_modificada": round(float(duration[i]), 2) if exposicao['prazo'][i] else None,
+                "prazo_estimado": bool(exposicao['prazo_estimado'][i]),
+            }
+            for i, ativo in enumerate(carteira)
+        ],
+        "cenarios": [
+            {
+                **{k: v for k, v in cenario.items() if k != 'choques'},
+                "choques": {nome: float(choques[r, j]) for r, nome in enumerate(INDEXADORES_CHOQUE)},
+                "totais": {
+                    "valor_atual": valor_atual,
+                    "valor_simulado": float(totais[j]),
+                    "variacao": float(totais[j] - valor_atual),
+                    "variacao_percentual": float((totais[j] - valor_atual) / valor_atual * 100) if valor_atual > 0 else 0.0,
+                },
+                "variacoes": np.round(variacoes[:, j], 2).tolist(),
+            }
+            for j, cenario in enumerate(cenarios)
+        ],
+        "premissas": {
+            "horizonte_meses": int(horizonte_meses),
+            "taxas_anuais": {nome: round(valor * 100, 4) for nome, valor in taxas.items()},
+            "prazo_padrao_anos": _PRAZO_PADRAO_ANOS,
+        },
+    }
+
+
+def simular_choques_indexadores(choques_cdi=0, choques_ipca=0, choques_selic=0, carteira=None):
+    """
+    Simula choques nos indexadores e calcula o impacto na carteira
+    """
+    try:
+        usuario = models.get_usuario_atual()
+        if not usuario:
+            return {"error": "Usuário não autenticado"}
+
+        if carteira is None:
+            carteira = models.obter_carteira()
+        carteira = [a for a in (carteira or []) if a.get('ticker')]
+        if not carteira:
+            return {"carteira_simulada": [], "totais": {"valor_atual": 0, "valor_simulado": 0, "variacao": 0, "variacao_percentual": 0}}
+
+        resultado = avaliar_cenarios([{'choques': {'cdi': choques_cdi, 'ipca': choques_ipca, 'selic': choques_selic}}], carteira)
+        cenario = resultado['cenarios'][0]
+        carteira_simulada = []
+        for ativo, info, variacao in zip(carteira, resultado['ativos'], cenario['variacoes']):
+            valor_total = info['valor_atual']
+            novo_valor_total = valor_total + variacao
+            fator = novo_valor_total / valor_total if valor_total else 1.0
+            carteira_simulada.append({
+                **ativo,
+                'preco_simulado': float(ativo.get('preco_atual') or 0) * fator,
+                'valor_total_simulado': novo_valor_total,
+                'variacao': variacao,
+                'variacao_percentual': (variacao / valor_total) * 100 if valor_total > 0 else 0,
+                'duration_modificada': info['duration_modificada'],
+            })
+        return {"carteira_simulada": carteira_simulada, "totais": cenario['totais'], "premissas": resultado['premissas']}
+
+    except Exception as e:
+        print(f"Erro na simulação de choques: {e}")
+        return {"error": str(e)}
+
+
+# ==================== METAS ====================
+
+METAS_SIMULACOES = 5000
+METAS_MAX_SIMULACOES = 50000
+# Limite de meses x trajetórias por projeção (float64; poucas matrizes desse tamanho em memória)
+METAS_MAX_ELEMENTOS = 3_000_000
+CONFIANCAS_META = (50, 75, 90, 95)
+PERCENTIS_META = (10, 50, 90)
+
+
+def volatilidade_carteira(carteira):
+    """Volatilidade anual da carteira pelas premissas por classe, ponderada pelo valor"""
+    total = 0.0
+    ponderada = 0.0
+    for ativo in carteira or []:
+        valor = float(ativo.get('valor_total') or 0)
+        if valor <= 0:
+            continue
+        total += valor
+        ponderada += valor * (_VOLATILIDADE_RENDA_FIXA if _eh_renda_fixa(ativo) else _VOLATILIDADE_PADRAO)
+    return ponderada / total if total else _VOLATILIDADE_PADRAO
+
+
+def cronograma_aportes(meses, reajuste_anual=0.0):
+    """Multiplicador do aporte em cada mês (reajustado a cada 12 meses)"""
+    return (1.0 + reajuste_anual) ** (np.arange(meses) // 12)
+
+
+def trajetorias_meta(saldo_inicial, meses, retorno_anual, volatilidade_anual, n, seed=None,
+                     reajuste_aporte_anual=0.0, volatilidade_aporte=0.0):
+    """Matrizes (meses x n) `base` e `por_aporte`: saldo = base + aporte * por_aporte.
+
+    Retornos mensais log-normais com média `retorno_anual` e o aporte entrando
+    no fim do mês, depois do rendimento (como no roadmap determinístico). Com
+    `volatilidade_aporte` cada aporte da trajetória é multiplicado por um
+    fator log-normal de média 1. O saldo é afim no aporte, então uma única
+    simulação serve para qualquer valor de aporte.
+    """
+    rng = np.random.default_rng(seed)
+    sigma = volatilidade_anual / np.sqrt(12.0)
+    deriva = _log_mensal(retorno_anual) - sigma ** 2 / 2.0
+    crescimento = rng.normal(deriva, sigma, (meses, n))
+    np.cumsum(crescimento, axis=0, out=crescimento)
+    np.exp(crescimento, out=crescimento)
+    aportes = np.broadcast_to(cronograma_aportes(meses, reajuste_aporte_anual)[:, None], (meses, n))
+    if volatilidade_aporte > 0:
+        aportes = aportes * rng.lognormal(-volatilidade_aporte ** 2 / 2.0, volatilidade_aporte, (meses, n))
+    # W_t = G_t * (S + soma_{s<=t} A_s / G_s)
+    por_aporte = crescimento * np.cumsum(aportes / crescimento, axis=0)
+    return crescimento * saldo_inicial, por_aporte
+
+
+def simular_meta(saldo_inicial, aporte, meses, capital_alvo, retorno_anual, carteira=None, opcoes=None,
+                 reajuste_aporte_anual=0.0):
+    """Probabilidade de atingir o capital alvo no horizonte e aportes por nível de confiança.
+
+    O aporte que leva cada trajetória exatamente ao alvo sai da forma afim do
+    saldo; o aporte para uma confiança é o quantil desses valores, e a
+    probabilidade para qualquer aporte é um searchsorted no vetor ordenado.
+    """
+    opcoes = opcoes if isinstance(opcoes, dict) else {}
+    n = int(opcoes.get('n') or METAS_SIMULACOES)
+    if not 1 <= n <= METAS_MAX_SIMULACOES:
+        raise ValueError(f"simulacao.n deve estar entre 1 e {METAS_MAX_SIMULACOES}")
+    if not 1 <= meses <= SIM_MAX_MESES:
+        raise ValueError(f"horizonte_meses deve estar entre 1 e {SIM_MAX_MESES}")
+    confianca = float(opcoes.get('confianca') or 90)
+    if not 0 < confianca < 100:
+        raise ValueError("simulacao.confianca deve estar entre 0 e 100")
+    n = min(n, max(1, METAS_MAX_ELEMENTOS // meses))
+    volatilidade = opcoes.get('volatilidade_anual')
+    volatilidade = volatilidade_carteira(carteira) if volatilidade is None else float(volatilidade)
+    volatilidade_aporte = float(opcoes.get('volatilidade_aporte') or 0)
+    seed = opcoes.get('seed')
+    seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy % (2 ** 32))
+
+    base, por_aporte = trajetorias_meta(saldo_inicial, meses, retorno_anual, volatilidade, n, seed=seed,
+                                        reajuste_aporte_anual=reajuste_aporte_anual,
+                                        volatilidade_aporte=volatilidade_aporte)
+    necessarios = np.sort(np.clip((capital_alvo - base[-1]) / por_aporte[-1], 0.0, None))
+
+    def _probabilidade(valor):
+        return float(np.searchsorted(necessarios, valor, side='right') / n * 100)
+
+    def _aporte_para(nivel):
+        # arredonda para cima: o aporte em centavos mantém a confiança pedida
+        return float(np.ceil(np.quantile(necessarios, nivel / 100.0, method='inverted_cdf') * 100) / 100)
+
+    saldos = base + aporte * por_aporte
+    faixas = _percentis(saldos, PERCENTIS_META).T
+    finais = saldos[-1]
+    return {
+        "n_simulacoes": n,
+        "seed": seed,
+        "volatilidade_anual": volatilidade,
+        "volatilidade_aporte": volatilidade_aporte,
+        "aporte_avaliado": round(float(aporte), 2),
+        "probabilidade_sucesso": _probabilidade(aporte),
+        "confianca": confianca,
+        "aporte_necessario": _aporte_para(confianca),
+        "aportes_por_confianca": {f"{nivel:g}": _aporte_para(nivel) for nivel in CONFIANCAS_META},
+        "saldo_final": {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTIS_META, np.percentile(finais, PERCENTIS_META))},
+        "faixas": {f"p{p}": [round(float(v), 2) for v in linha] for p, linha in zip(PERCENTIS_META, faixas)},
+    }
+
+
+# ==================== CACHE DE RESULTADOS ====================
+
+def versao_carteira(carteira):
+    """Impressão digital da carteira (posições e preços atuais) para as chaves do cache"""
+    linhas = sorted(json.dumps(ativo, sort_keys=True, default=str) for ativo in (carteira or []))
+    return hashlib.sha256('\n'.join(linhas).encode('utf-8')).hexdigest()[:16]
+
+
+def chave_resultado(usuario, tipo, params, carteira):
+    """Chave de (versão da carteira, tipo, parâmetros, seed).
+
+    O dia entra na chave: o histórico de preços e os indicadores (CDI/IPCA)
+    usados nas premissas mudam de um dia para o outro.
+    """
+    partes = {
+        'tipo': tipo,
+        'params': params,
+        'carteira': versao_carteira(carteira),
+        'dia': date.today().isoformat(),
+    }
+    digest = hashlib.sha256(json.dumps(partes, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+    return f"simulacao:{usuario}:{digest}"
+
+
+def resultado_em_cache(chave):
+    try:
+        return models.cache.get(chave)
+    except Exception:
+        return None
+
+
+def guardar_resultado(chave, resultado):
+    if not chave or not isinstance(resultado, dict) or "error" in resultado:
+        return
+    try:
+        models.cache.set(chave, resultado, timeout=SIM_CACHE_TTL)
+    except Exception as e:
+        print(f"Erro ao guardar resultado da simulação no cache: {e}")
+
+
+def com_cache(tipo, params, calcular, carteira=None):
+    """Resultado de calcular(carteira), reaproveitado enquanto carteira, parâmetros e seed não mudam"""
+    usuario = models.get_usuario_atual()
+    if not usuario:
+        return calcular(carteira)
+    if carteira is None:
+        carteira = models.obter_carteira() or []
+    chave = chave_resultado(usuario, tipo, params, carteira)
+    resultado = resultado_em_cache(chave)
+    if resultado is not None:
+        return {**resultado, 'em_cache': True}
+    resultado = calcular(carteira)
+    guardar_resultado(chave, resultado)
+    return resultado
@@ -0,0 +1,468 @@
+"""
+Snapshots diários do patrimônio (tabela historico_carteira) e base local de preços.
+
+Base de preços: tabela compartilhada `precos_diarios` (public no Postgres, ou no
+banco de usuários SQLite) com o fechamento diário por símbolo do yfinance, mais
+`precos_cobertura` com o intervalo já baixado de cada símbolo. Só o trecho que
+falta (início anterior ao coberto ou cauda desatualizada) vai ao yfinance, e o
+mesmo símbolo serve a todos os usuários.
+
+Snapshots: uma linha por dia útil com o total e o valor por classe (tipo) da
+carteira do usuário. O agendador grava o dia após o fechamento com os preços
+da carteira; os dias que faltam são reconstruídos pela linha do tempo das
+movimentações com os preços da base local. Se as movimentações mudam (ativo
+adicionado com data retroativa, edição, remoção), os snapshots são refeitos.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import models
+    from . import async_http
+    from .posicoes import LinhaTempoPosicoes, valores_em
+    from .optimizations import ttl_mercado
+except ImportError:
+    import models
+    import async_http
+    from posicoes import LinhaTempoPosicoes, valores_em
+    from optimizations import ttl_mercado
+
+# Cauda da série de preços é rebaixada depois disso (ttl_mercado estica fora do pregão)
+PRECOS_TTL = int(os.getenv('PRECOS_TTL', '3600'))
+# Prazo padrão (s) para baixar o que falta na base de preços
+PRECOS_PRAZO = float(os.getenv('PRECOS_PRAZO', '30'))
+# Sobreposição ao completar a cauda (fechamentos revisados, feriados)
+_SOBREPOSICAO = timedelta(days=5)
+
+
+def _dia_str(valor):
+    if isinstance(valor, str):
+        return valor[:10]
+    if isinstance(valor, datetime):
+        return valor.date().isoformat()
+    if isinstance(valor, np.datetime64):
+        return str(valor.astype('datetime64[D]'))
+    return valor.isoformat()
+
+
+def _para_date(valor):
+    return date.fromisoformat(_dia_str(valor))
+
+
+# ==================== BASE LOCAL DE PREÇOS ====================
+
+_tabelas_precos_ok = False
+
+
+def _conn_publica():
+    if models._is_postgres():
+        return models._get_pg_conn()
+    return sqlite3.connect(models.USUARIOS_DB_PATH, timeout=30)
+
+
+def _sql_publico(query):
+    """Placeholders ? -> %s e tabelas com schema no Postgres"""
+    if models._is_postgres():
+        return (query.replace('?', '%s')
+                .replace(' precos_diarios', ' public.precos_diarios')
+                .replace(' precos_cobertura', ' public.precos_cobertura'))
+    return query
+
+
+def garantir_tabelas_precos():
+    global _tabelas_precos_ok
+    if _tabelas_precos_ok:
+        return
+    real = 'DOUBLE PRECISION' if models._is_postgres() else 'REAL'
+    conn = _conn_publica()
+    try:
+        cur = conn.cursor()
+        cur.execute(_sql_publico(f'''
+            CREATE TABLE IF NOT EXISTS precos_diarios (
+                simbolo TEXT NOT NULL,
+                data TEXT NOT NULL,
+                fechamento {real} NOT NULL,
+                PRIMARY KEY (simbolo, data)
+            )
+        '''))
+        cur.execute(_sql_publico(f'''
+            CREATE TABLE IF NOT EXISTS precos_cobertura (
+                simbolo TEXT PRIMARY KEY,
+                inicio TEXT NOT NULL,
+                fim TEXT NOT NULL,
+                atualizado_em {real} NOT NULL
+            )
+        '''))
+        conn.commit()
+    finally:
+        conn.close()
+    _tabelas_precos_ok = True
+
+
+def _cobertura(simbolos):
+    if not simbolos:
+        return {}
+    garantir_tabelas_precos()
+    conn = _conn_publica()
+    try:
+        cur = conn.cursor()
+        marcas = ', '.join('?' for _ in simbolos)
+        cur.execute(_sql_publico(
+            f"SELECT simbolo, inicio, fim, atualizado_em FROM precos_cobertura WHERE simbolo IN ({marcas})"
+        ), list(simbolos))
+        return {s: (date.fromisoformat(i), date.fromisoformat(f), float(a)) for s, i, f, a in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def _gravar_precos(simbolo, hist, inicio, fim):
+    """Grava os fechamentos baixados e estende a cobertura do símbolo"""
+    linhas = []
+    if hist is not None and 'Close' in hist:
+        fechamentos = hist['Close'].dropna()
+        linhas = [(simbolo, _dia_str(d), float(v)) for d, v in zip(fechamentos.index.values, fechamentos.to_numpy())]
+    postgres = models._is_postgres()
+    conn = _conn_publica()
+    try:
+        cur = conn.cursor()
+        if linhas:
+            if postgres:
+                cur.executemany(_sql_publico(
+                    "INSERT INTO precos_diarios (simbolo, data, fechamento) VALUES (?, ?, ?) "
+                    "ON CONFLICT (simbolo, data) DO UPDATE SET fechamento = EXCLUDED.fechamento"
+                ), linhas)
+            else:
+                cur.executemany(
+                    "INSERT OR REPLACE INTO precos_diarios (simbolo, data, fechamento) VALUES (?, ?, ?)", linhas
+                )
+        if postgres:
+            cur.execute(_sql_publico(
+                "INSERT INTO precos_cobertura (simbolo, inicio, fim, atualizado_em) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (simbolo) DO UPDATE SET inicio = LEAST(precos_cobertura.inicio, EXCLUDED.inicio), "
+                "fim = GREATEST(precos_cobertura.fim, EXCLUDED.fim), atualizado_em = EXCLUDED.atualizado_em"
+            ), (simbolo, inicio.isoformat(), fim.isoformat(), time.time()))
+        else:
+            cur.execute(
+                "INSERT INTO precos_cobertura (simbolo, inicio, fim, atualizado_em) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (simbolo) DO UPDATE SET inicio = MIN(inicio, excluded.inicio), "
+                "fim = MAX(fim, excluded.fim), atualizado_em = excluded.atualizado_em",
+                (simbolo, inicio.isoformat(), fim.isoformat(), time.time())
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def sincronizar_precos(simbolos, inicio, prazo=None):
+    """Baixa em paralelo o que falta de cada símbolo desde `inicio` até hoje.
+
+    Retorna os símbolos que não puderam ser atualizados (erro ou fora do prazo);
+    símbolo sem dados no yfinance conta como atualizado.
+    """
+    simbolos = list(dict.fromkeys(s for s in simbolos if s))
+    if not simbolos:
+        return []
+    inicio = _para_date(inicio)
+    hoje = date.today()
+    # sem prazo do chamador é sincronização em background: não disputa as
+    # threads dos downloads com prazo de request
+    pool = models._historico_pool if prazo is not None else models._sincronizacao_pool
+    prazo = prazo if prazo is not None else time.time() + PRECOS_PRAZO
+    cobertura = _cobertura(simbolos)
+    validade = ttl_mercado(PRECOS_TTL)
+
+    pedidos = {}
+    for simbolo in simbolos:
+        atual = cobertura.get(simbolo)
+        if atual is None or inicio < atual[0]:
+            pedidos[simbolo] = inicio
+        elif atual[1] < hoje or time.time() - atual[2] > validade:
+            pedidos[simbolo] = min(atual[1], hoje)
+    if not pedidos:
+        return []
+
+    fim_download = datetime.combine(hoje + timedelta(days=1), datetime.min.time())
+    futuros = {
+        simbolo: pool.submit(
+            models._baixar_historico, simbolo,
+            datetime.combine(desde - _SOBREPOSICAO, datetime.min.time()), fim_download
+        )
+        for simbolo, desde in pedidos.items()
+    }
+    # os que ainda estão na fila no fim do prazo são cancelados (resultados)
+    historicos = async_http.resultados(futuros, timeout=max(0.0, prazo - time.time()))
+    falhas = []
+    for simbolo, futuro in futuros.items():
+        if not futuro.done() or futuro.cancelled() or futuro.exception() is not None:
+            falhas.append(simbolo)
+            continue
+        try:
+            _gravar_precos(simbolo, historicos[simbolo], pedidos[simbolo], hoje)
+        except Exception as e:
+            print(f"Erro ao gravar preços de {simbolo}: {e}")
+            falhas.append(simbolo)
+    if falhas:
+        print(f"DEBUG: base de preços sem atualizar: {falhas}")
+    return falhas
+
+
+def ler_precos(simbolos, inicio=None):
+    """{simbolo: (datas datetime64[D], fechamentos)} da base local, ordenados por data"""
+    simbolos = list(dict.fromkeys(s for s in simbolos if s))
+    if not simbolos:
+        return {}
+    garantir_tabelas_precos()
+    conn = _conn_publica()
+    try:
+        cur = conn.cursor()
+        marcas = ', '.join('?' for _ in simbolos)
+        query = f"SELECT simbolo, data, fechamento FROM precos_diarios WHERE simbolo IN ({marcas})"
+        params = list(simbolos)
+        if inicio is not None:
+            query += " AND data >= ?"
+            params.append(_dia_str(inicio))
+        cur.execute(_sql_publico(query + " ORDER BY simbolo, data"), params)
+        linhas = cur.fetchall()
+    finally:
+        conn.close()
+    por_simbolo = {}
+    for simbolo, data, fechamento in linhas:
+        por_simbolo.setdefault(simbolo, ([], []))
+        por_simbolo[simbolo][0].append(data)
+        por_simbolo[simbolo][1].append(float(fechamento))
+    return {
+        simbolo: (np.array(datas, dtype='datetime64[D]'), np.array(valores, dtype=float))
+        for simbolo, (datas, valores) in por_simbolo.items()
+    }
+
+
+# ==================== SNAPSHOTS ====================
+
+_schema_ok = set()
+
+
+def _conn_usuario(usuario):
+    if models._is_postgres():
+        return models._pg_conn_for_user(usuario)
+    return sqlite3.connect(models.get_db_path(usuario, "carteira"), check_same_thread=False)
+
+
+def _sql_usuario(query):
+    return query.replace('?', '%s') if models._is_postgres() else query
+
+
+def _executar(usuario, query, params=(), fetch=None, muitos=False):
+    _garantir_schema(usuario)
+    conn = _conn_usuario(usuario)
+    try:
+        cur = conn.cursor()
+        if muitos:
+            cur.executemany(_sql_usuario(query), params)
+        else:
+            cur.execute(_sql_usuario(query), params)
+        resultado = cur.fetchone() if fetch == 'one' else cur.fetchall() if fetch == 'all' else None
+        conn.commit()
+        return resultado
+    finally:
+        conn.close()
+
+
+def _garantir_schema(usuario):
+    if usuario in _schema_ok:
+        return
+    postgres = models._is_postgres()
+    conn = _conn_usuario(usuario)
+    try:
+        cur = conn.cursor()
+        if postgres:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS historico_carteira (
+                    id SERIAL PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    valor_total NUMERIC NOT NULL
+                )
+            ''')
+            cur.execute('ALTER TABLE historico_carteira ADD COLUMN IF NOT EXISTS por_classe TEXT')
+            cur.execute('ALTER TABLE historico_carteira ADD COLUMN IF NOT EXISTS origem TEXT')
+        else:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS historico_carteira (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    data TEXT NOT NULL,
+                    valor_total REAL NOT NULL
+                )
+            ''')
+            colunas = {linha[1] for linha in cur.execute('PRAGMA table_info(historico_carteira)').fetchall()}
+            for coluna in ('por_classe', 'origem'):
+                if coluna not in colunas:
+                    cur.execute(f'ALTER TABLE historico_carteira ADD COLUMN {coluna} TEXT')
+        cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_historico_carteira_data ON historico_carteira(data)')
+        cur.execute('CREATE TABLE IF NOT EXISTS snapshot_meta (chave TEXT PRIMARY KEY, valor TEXT)')
+        conn.commit()
+    finally:
+        conn.close()
+    _schema_ok.add(usuario)
+
+
+def _gravar_snapshots(usuario, linhas):
+    """linhas: (data, valor_total, por_classe_json, origem); substitui o dia se já existir"""
+    if not linhas:
+        return
+    if models._is_postgres():
+        query = ("INSERT INTO historico_carteira (data, valor_total, por_classe, origem) VALUES (?, ?, ?, ?) "
+                 "ON CONFLICT (data) DO UPDATE SET valor_total = EXCLUDED.valor_total, "
+                 "por_classe = EXCLUDED.por_classe, origem = EXCLUDED.origem")
+    else:
+        query = "INSERT OR REPLACE INTO historico_carteira (data, valor_total, por_classe, origem) VALUES (?, ?, ?, ?)"
+    _executar(usuario, query, linhas, muitos=True)
+
+
+def _meta(usuario, chave):
+    linha = _executar(usuario, "SELECT valor FROM snapshot_meta WHERE chave = ?", (chave,), fetch='one')
+    return linha[0] if linha else None
+
+
+def _definir_meta(usuario, chave, valor):
+    if models._is_postgres():
+        query = ("INSERT INTO snapshot_meta (chave, valor) VALUES (?, ?) "
+                 "ON CONFLICT (chave) DO UPDATE SET valor = EXCLUDED.valor")
+    else:
+        query = "INSERT OR REPLACE INTO snapshot_meta (chave, valor) VALUES (?, ?)"
+    _executar(usuario, query, (chave, valor))
+
+
+def _assinatura_movimentacoes(usuario):
+    """Muda sempre que uma movimentação é incluída, alterada ou removida"""
+    linha = _executar(
+        usuario,
+        "SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(MIN(data), ''), "
+        "COALESCE(SUM(quantidade), 0), COALESCE(SUM(quantidade * preco), 0) FROM movimentacoes",
+        fetch='one'
+    )
+    return '|'.join(str(v) for v in linha)
+
+
+def valor_atual(usuario):
+    """(total, {classe: valor}) da carteira com os preços gravados agora"""
+    linhas = _executar(usuario, "SELECT tipo, SUM(valor_total) FROM carteira GROUP BY tipo", fetch='all')
+    por_classe = {(tipo or 'Desconhecido'): round(float(valor or 0), 2) for tipo, valor in linhas}
+    return round(sum(por_classe.values()), 2), por_classe
+
+
+def gravar_snapshot_hoje(usuario):
+    """Snapshot de fim de dia com os valores atuais da carteira"""
+    total, por_classe = valor_atual(usuario)
+    _gravar_snapshots(usuario, [(date.today().isoformat(), total, json.dumps(por_classe), 'fechamento')])
+    return total
+
+
+def dias_pendentes(usuario):
+    """True se há movimentações novas/alteradas ou dias úteis sem snapshot até ontem"""
+    if _meta(usuario, 'movimentacoes') != _assinatura_movimentacoes(usuario):
+        return True
+    ontem = date.today() - timedelta(days=1)
+    ultimo = _executar(usuario, "SELECT MAX(data) FROM historico_carteira WHERE data < ?",
+                       (date.today().isoformat(),), fetch='one')[0]
+    if ultimo:
+        inicio = _para_date(ultimo) + timedelta(days=1)
+    else:
+        # nenhum snapshot ainda: pendente desde a primeira movimentação
+        primeira = _executar(usuario, "SELECT MIN(data) FROM movimentacoes", fetch='one')[0]
+        if not primeira:
+            return False
+        inicio = _para_date(primeira)
+    return len(pd.bdate_range(inicio, ontem)) > 0
+
+
+def reconstruir(usuario, prazo=None, progresso=None):
+    """Backfill dos dias úteis sem snapshot até ontem.
+
+    Retorna o número de dias gravados, ou None se a base de preços não pôde ser
+    completada (nada é gravado para não fixar um histórico com buracos).
+    """
+    assinatura = _assinatura_movimentacoes(usuario)
+    hoje = date.today()
+    ontem = hoje - timedelta(days=1)
+    if _meta(usuario, 'movimentacoes') != assinatura:
+        # histórico mudou: todos os dias são refeitos
+        _executar(usuario, "DELETE FROM historico_carteira")
+        ultimo = None
+    else:
+        ultimo = _executar(usuario, "SELECT MAX(data) FROM historico_carteira WHERE data < ?",
+                           (hoje.isoformat(),), fetch='one')[0]
+
+    movimentos = models._movimentacoes_ordenadas(usuario)
+    if not movimentos:
+        _definir_meta(usuario, 'movimentacoes', assinatura)
+        return 0
+    linha_tempo = LinhaTempoPosicoes(movimentos)
+    primeira = _para_date(linha_tempo.primeira_data())
+    inicio = date.fromisoformat(ultimo) + timedelta(days=1) if ultimo else primeira
+    dias = pd.bdate_range(max(inicio, primeira), ontem).values.astype('datetime64[D]')
+    if len(dias) == 0:
+        _definir_meta(usuario, 'movimentacoes', assinatura)
+        return 0
+
+    if progresso:
+        progresso(0.1, 'Atualizando base de preços')
+    simbolos = {tk: models._normalize_ticker_for_yf(tk) for tk in linha_tempo.tickers}
+    if sincronizar_precos(simbolos.values(), primeira, prazo):
+        return None
+    base = ler_precos(simbolos.values())
+
+    if progresso:
+        progresso(0.6, f'Calculando {len(dias)} dias')
+    # sem cotação no yfinance (renda fixa, ativo manual): preço da última movimentação
+    precos = linha_tempo.series_precos()
+    for ticker, simbolo in simbolos.items():
+        if simbolo in base and len(base[simbolo][0]):
+            precos[ticker] = base[simbolo]
+
+    tipos = dict(_executar(usuario, "SELECT ticker, tipo FROM carteira", fetch='all'))
+    classes = {}
+    for ticker in linha_tempo.tickers:
+        classes.setdefault(tipos.get(ticker) or 'Desconhecido', []).append(ticker)
+    valores = {classe: linha_tempo.valorizar(dias, precos, tickers) for classe, tickers in classes.items()}
+    totais = np.sum(list(valores.values()), axis=0)
+
+    linhas = []
+    for i, dia in enumerate(dias):
+        por_classe = {classe: round(float(v[i]), 2) for classe, v in valores.items() if v[i]}
+        linhas.append((_dia_str(dia), round(float(totais[i]), 2), json.dumps(por_classe), 'reconstruido'))
+    _gravar_snapshots(usuario, linhas)
+    _definir_meta(usuario, 'movimentacoes', assinatura)
+    return len(linhas)
+
+
+def ler_snapshots(usuario, inicio=None):
+    """(datas datetime64[D], totais) dos snapshots gravados, por data"""
+    query = "SELECT data, valor_total FROM historico_carteira"
+    params = ()
+    if inicio is not None:
+        query += " WHERE data >= ?"
+        params = (_dia_str(inicio),)
+    linhas = _executar(usuario, query + " ORDER BY data", params, fetch='all')
+    return (np.array([l[0] for l in linhas], dtype='datetime64[D]'),
+            np.array([float(l[1]) for l in linhas], dtype=float))
+
+
+def serie_carteira(usuario, pontos, prazo=None):
+    """Patrimônio em cada ponto: snapshots para o passado e valor atual para hoje em diante.
+
+    None se os snapshots não puderam ser completados (quem chama recalcula).
+    """
+    if dias_pendentes(usuario) and reconstruir(usuario, prazo) is None:
+        return None
+    datas, totais = ler_snapshots(usuario)
+    hoje = np.datetime64(date.today(), 'D')
+    dias = np.array([_dia_str(p) for p in pontos], dtype='datetime64[D]')
+    passados = np.nan_to_num(valores_em(datas, totais, dias), nan=0.0)
+    atual, _ = valor_atual(usuario)
+    return [atual if dia >= hoje else float(v) for dia, v in zip(dias, passados)]
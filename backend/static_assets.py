@@ -0,0 +1,151 @@
+"""
+Servidor dos arquivos estáticos do frontend (frontend/dist) a partir de memória.
+
+No startup o diretório é lido uma vez: para cada arquivo guardamos conteúdo,
+ETag, mimetype e, para tipos de texto, as variantes gzip e brotli já
+comprimidas. Assim cada request vira um lookup num dict, sem os.path.exists,
+sem recompressão pelo flask_compress e com 304 para o que o navegador já tem.
+
+Assets com hash no nome (assets/index-<hash>.js, gerados pelo Vite) recebem
+Cache-Control immutable; index.html e sw.js são sempre revalidados.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response, send_file
+
+try:
+    import brotli  # type: ignore
+except Exception:
+    brotli = None
+
+# Acima disso o arquivo fica no disco e é servido com send_file
+MAX_EM_MEMORIA = int(os.getenv('STATIC_MAX_MEMORIA', str(5 * 1024 * 1024)))
+# Abaixo disso comprimir não compensa
+MIN_COMPRIMIR = 1024
+
+_COMPRIMIVEIS = ('text/', 'application/javascript', 'application/json', 'application/manifest+json',
+                 'image/svg+xml', 'application/xml', 'application/wasm')
+# nome-<hash>.ext do Vite (hash de 8+ caracteres base64url)
+_HASH_NO_NOME = re.compile(r'[-.][A-Za-z0-9_-]{8,}\.[a-z0-9]+$')
+_SEM_CACHE = {'index.html', 'sw.js', 'manifest.webmanifest'}
+
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+mimetypes.add_type('application/javascript', '.js')
+mimetypes.add_type('application/javascript', '.mjs')
+
+
+class Arquivo:
+    __slots__ = ('caminho', 'mimetype', 'etag', 'cache_control', 'variantes')
+
+    def __init__(self, caminho, mimetype, etag, cache_control, variantes):
+        self.caminho = caminho
+        self.mimetype = mimetype
+        self.etag = etag
+        self.cache_control = cache_control
+        # encoding ('identity', 'br', 'gzip') -> bytes; vazio = servir do disco
+        self.variantes = variantes
+
+
+def _cache_control(relativo):
+    if relativo in _SEM_CACHE:
+        return 'no-cache'
+    if relativo.startswith('assets/') and _HASH_NO_NOME.search(relativo):
+        return 'public, max-age=31536000, immutable'
+    return 'public, max-age=3600'
+
+
+def _ler(caminho):
+    with open(caminho, 'rb') as f:
+        return f.read()
+
+
+def _variantes(caminho, conteudo, mimetype):
+    variantes = {'identity': conteudo}
+    if len(conteudo) < MIN_COMPRIMIR or not mimetype.startswith(_COMPRIMIVEIS):
+        return variantes
+    # .br/.gz gerados no build têm prioridade sobre comprimir aqui
+    if os.path.exists(caminho + '.br'):
+        variantes['br'] = _ler(caminho + '.br')
+    elif brotli is not None:
+        variantes['br'] = brotli.compress(conteudo, quality=11)
+    if os.path.exists(caminho + '.gz'):
+        variantes['gzip'] = _ler(caminho + '.gz')
+    else:
+        variantes['gzip'] = gzip.compress(conteudo, compresslevel=9, mtime=0)
+    for encoding in ('br', 'gzip'):
+        if encoding in variantes and len(variantes[encoding]) >= len(conteudo):
+            del variantes[encoding]
+    return variantes
+
+
+class ManifestoEstatico:
+    """Mapa caminho relativo -> Arquivo, montado uma vez a partir do dist"""
+
+    def __init__(self, raiz):
+        self.raiz = raiz
+        self.arquivos = {}
+        if not os.path.isdir(raiz):
+            return
+        for pasta, _, nomes in os.walk(raiz):
+            for nome in nomes:
+                if nome.endswith(('.br', '.gz')) and os.path.exists(os.path.join(pasta, nome[:-3])):
+                    continue
+                caminho = os.path.join(pasta, nome)
+                relativo = os.path.relpath(caminho, raiz).replace(os.sep, '/')
+                mimetype = mimetypes.guess_type(nome)[0] or 'application/octet-stream'
+                if os.path.getsize(caminho) > MAX_EM_MEMORIA:
+                    stat = os.stat(caminho)
+                    etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+                    variantes = {}
+                else:
+                    conteudo = _ler(caminho)
+                    etag = hashlib.sha1(conteudo).hexdigest()[:20]
+                    variantes = _variantes(caminho, conteudo, mimetype)
+                self.arquivos[relativo] = Arquivo(caminho, mimetype, etag, _cache_control(relativo), variantes)
+        print(f"DEBUG: manifesto estático com {len(self.arquivos)} arquivos de {raiz}")
+
+    @property
+    def index(self):
+        return self.arquivos.get('index.html')
+
+    def resolver(self, path):
+        """Arquivo para o path pedido; rotas do SPA caem no index.html"""
+        arquivo = self.arquivos.get(path)
+        if arquivo is not None:
+            return arquivo
+        # asset inexistente (ex.: bundle antigo após deploy) é 404, não HTML
+        if path.startswith('assets/'):
+            return None
+        return self.index
+
+    def responder(self, arquivo, request):
+        if not arquivo.variantes:
+            resp = send_file(arquivo.caminho, mimetype=arquivo.mimetype, etag=arquivo.etag, conditional=True)
+            resp.headers['Cache-Control'] = arquivo.cache_control
+            return resp
+
+        encoding = 'identity'
+        if len(arquivo.variantes) > 1:
+            aceitos = request.accept_encodings
+            for candidato in ('br', 'gzip'):
+                if candidato in arquivo.variantes and aceitos[candidato]:
+                    encoding = candidato
+                    break
+        etag = arquivo.etag if encoding == 'identity' else f"{arquivo.etag}-{encoding}"
+
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            resp = Response(arquivo.variantes[encoding], mimetype=arquivo.mimetype)
+            if encoding != 'identity':
+                resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = arquivo.cache_control
+        if len(arquivo.variantes) > 1:
+            resp.vary.add('Accept-Encoding')
+        return resp
@@ -0,0 +1,199 @@
+"""
+Índice em memória para busca/autocomplete de tickers.
+
+Construído uma vez no import a partir de assets_lists.py e do mapeamento de
+logos; nomes, setores e segmentos entram depois via `atualizar()` (quando o
+carregamento de ativos termina). Cada reconstrução troca o índice inteiro de
+uma vez, então a busca nunca vê um índice pela metade.
+
+Busca: prefixo por bisect em arrays ordenados (ticker e palavras do nome) e,
+para erros de digitação, um índice de trigramas.
+"""
+
+import bisect
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from .assets_lists import LISTA_ACOES, LISTA_FIIS, LISTA_BDRS
+    from .complete_b3_logos_mapping import COMPLETE_B3_LOGOS_MAPPING
+except ImportError:
+    from assets_lists import LISTA_ACOES, LISTA_FIIS, LISTA_BDRS
+    from complete_b3_logos_mapping import COMPLETE_B3_LOGOS_MAPPING
+
+
+def normalizar(texto: str) -> str:
+    """minúsculas, sem acento e só [a-z0-9 ]"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch)).lower()
+    return re.sub(r'[^a-z0-9]+', ' ', texto).strip()
+
+
+def _ticker_base(ticker: str) -> str:
+    """'PETR4.SA' / 'petr4.sa' -> 'petr4'"""
+    t = (ticker or '').strip().lower()
+    return t[:-3] if t.endswith('.sa') else t
+
+
+def _trigramas(texto: str) -> set:
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTickers:
+    """Estrutura imutável: listas ordenadas + trigramas sobre as entradas"""
+
+    def __init__(self, entradas: List[Dict]):
+        self.entradas = entradas
+        tickers = []
+        palavras = []
+        trigramas = defaultdict(list)
+        for i, e in enumerate(entradas):
+            base = _ticker_base(e['ticker'])
+            tickers.append((base, i))
+            texto = normalizar(' '.join(filter(None, (e.get('nome'), e.get('segmento'), e.get('setor')))))
+            for palavra in set(texto.split()):
+                if len(palavra) >= 2:
+                    palavras.append((palavra, i))
+            for tri in _trigramas(base) | _trigramas(texto):
+                trigramas[tri].append(i)
+        tickers.sort()
+        palavras.sort()
+        self._tickers = tickers
+        self._tickers_chaves = [t for t, _ in tickers]
+        self._palavras = palavras
+        self._palavras_chaves = [p for p, _ in palavras]
+        self._trigramas = dict(trigramas)
+
+    @staticmethod
+    def _prefixo(chaves, pares, prefixo):
+        inicio = bisect.bisect_left(chaves, prefixo)
+        fim = bisect.bisect_left(chaves, prefixo + '￿')
+        return [pares[k] for k in range(inicio, fim)]
+
+    def buscar(self, q: str, limite: int = 10, prioridade: Optional[Iterable[str]] = None) -> List[Dict]:
+        termo = normalizar(q)
+        if not termo:
+            return []
+        termo_ticker = normalizar(_ticker_base(q)).replace(' ', '')
+        pontos = {}
+
+        def marcar(i, valor):
+            if valor > pontos.get(i, 0):
+                pontos[i] = valor
+
+        for chave, i in self._prefixo(self._tickers_chaves, self._tickers, termo_ticker):
+            marcar(i, 100 if chave == termo_ticker else 80 - min(len(chave) - len(termo_ticker), 10))
+        partes = termo.split()
+        for chave, i in self._prefixo(self._palavras_chaves, self._palavras, partes[0]):
+            marcar(i, 60 if chave == partes[0] else 50)
+        if len(partes) > 1:
+            # todas as palavras precisam casar por prefixo
+            for i in list(pontos):
+                texto = normalizar(' '.join(filter(None, (self.entradas[i].get('nome'), self.entradas[i].get('segmento')))))
+                palavras = texto.split()
+                if not all(any(p.startswith(parte) for p in palavras) for parte in partes[1:]):
+                    if pontos[i] < 80:
+                        del pontos[i]
+
+        if len(pontos) < limite and len(termo) >= 3:
+            # tolerância a erro de digitação: fração dos trigramas da consulta presentes
+            tris = _trigramas(termo)
+            contagem = defaultdict(int)
+            for tri in tris:
+                for i in self._trigramas.get(tri, ()):
+                    contagem[i] += 1
+            for i, n in contagem.items():
+                similaridade = n / len(tris)
+                if similaridade >= 0.5:
+                    marcar(i, int(40 * similaridade))
+
+        prioridade = {_ticker_base(t) for t in (prioridade or ())}
+        ordenados = sorted(
+            pontos.items(),
+            key=lambda item: (
+                _ticker_base(self.entradas[item[0]]['ticker']) not in prioridade,
+                -item[1],
+                self.entradas[item[0]]['ticker'],
+            ),
+        )
+        resultado = []
+        for i, score in ordenados[:limite]:
+            e = dict(self.entradas[i])
+            e['na_carteira'] = _ticker_base(e['ticker']) in prioridade
+            e['score'] = score
+            resultado.append(e)
+        return resultado
+
+
+def _entradas_base() -> Dict[str, Dict]:
+    entradas = {}
+    for lista, tipo in ((LISTA_ACOES, 'Ação'), (LISTA_FIIS, 'FII'), (LISTA_BDRS, 'BDR')):
+        for ticker in lista:
+            t = ticker.upper()
+            entradas.setdefault(t, {'ticker': t, 'nome': None, 'tipo': tipo, 'setor': None, 'segmento': None})
+    for ticker in COMPLETE_B3_LOGOS_MAPPING:
+        t = ticker.upper()
+        entradas.setdefault(t, {'ticker': t, 'nome': None, 'tipo': None, 'setor': None, 'segmento': None})
+    return entradas
+
+
+_lock = threading.Lock()
+_entradas = _entradas_base()
+_indice = IndiceTickers(list(_entradas.values()))
+
+
+def atualizar(registros: Iterable[Dict]):
+    """Acrescenta nome/setor/segmento (ex.: df_ativos.to_dict('records')) e reconstrói o índice"""
+    global _indice
+    with _lock:
+        for r in registros:
+            ticker = (r.get('ticker') or '').upper()
+            if not ticker:
+                continue
+            atual = _entradas.setdefault(ticker, {'ticker': ticker, 'nome': None, 'tipo': None, 'setor': None, 'segmento': None})
+            nome = r.get('nome_completo') or r.get('nome')
+            if nome and nome != 'Desconhecido':
+                atual['nome'] = nome
+            if r.get('tipo'):
+                atual['tipo'] = r['tipo']
+            setor = r.get('setor')
+            if setor and setor != 'Desconhecido':
+                atual['setor'] = setor
+            if r.get('segmento_fii') or r.get('segmento'):
+                atual['segmento'] = r.get('segmento_fii') or r.get('segmento')
+        novo = IndiceTickers([dict(e) for e in _entradas.values()])
+    _indice = novo
+
+
+def buscar(q: str, limite: int = 10, carteira: Optional[List[Dict]] = None) -> List[Dict]:
+    """Busca no índice; posições da carteira vêm primeiro (e entram mesmo fora do índice)"""
+    carteira = carteira or []
+    resultado = _indice.buscar(q, limite=limite, prioridade=[a.get('ticker') for a in carteira])
+    termo = normalizar(q)
+    vistos = {_ticker_base(r['ticker']) for r in resultado}
+    extras = []
+    for ativo in carteira:
+        base = _ticker_base(ativo.get('ticker'))
+        if not base or base in vistos:
+            continue
+        texto = normalizar(f"{ativo.get('ticker')} {ativo.get('nome_completo') or ''}")
+        if termo and termo in texto:
+            extras.append({
+                'ticker': (ativo.get('ticker') or '').upper(),
+                'nome': ativo.get('nome_completo'),
+                'tipo': ativo.get('tipo'),
+                'setor': None,
+                'segmento': None,
+                'na_carteira': True,
+                'score': 90,
+            })
+            vistos.add(base)
+    return (extras + resultado)[:limite] if extras else resultado
+
+
+def total_entradas() -> int:
+    return len(_indice.entradas)
@@ -1,7 +1,7 @@
 import { useQuery } from '@tanstack/react-query'
 import { Link } from 'react-router-dom'
 import { ativoService } from '../services/api'
-import { normalizeTicker, getDisplayTicker } from '../utils/tickerUtils'
+import { normalizeTicker, getDisplayTicker, resolveLogoUrl } from '../utils/tickerUtils'
 
 interface TickerWithLogoProps {
   ticker: string
@@ -22,11 +22,14 @@ export default function TickerWithLogo({
   const normalizedTicker = normalizeTicker(ticker)
   const displayTicker = getDisplayTicker(ticker)
   
-  const { data: logoUrl } = useQuery<string | null>({
-    queryKey: ['logo', normalizedTicker],
-    queryFn: () => ativoService.getLogoUrl(normalizedTicker),
-    enabled: !!normalizedTicker,
+  // Um único manifesto compartilhado por todas as instâncias (em vez de um request por ticker)
+  const { data: manifest } = useQuery({
+    queryKey: ['logos-manifest'],
+    queryFn: ativoService.getLogosManifest,
+    staleTime: Infinity,
+    gcTime: Infinity,
   })
+  const logoUrl = resolveLogoUrl(manifest, normalizedTicker)
 
   const sizeClasses = {
     sm: 'w-8 h-8 text-xs',    // Dobrado: 16px -> 32px
@@ -78,7 +78,7 @@ export default function CarteiraProjecaoTab({
   const projectGoalsQuery = useQuery({
     queryKey: ['goals-projecao', goalTipo, goalAlvo, goalHorizonteMeses, usarCrescimentoManual, crescimentoManual],
     queryFn: async () => {
-      const payload: any = { tipo: goalTipo }
+      const payload: any = { tipo: goalTipo, simulacao: { confianca: 90 } }
       if (goalAlvo) payload.alvo = parseFloat(goalAlvo)
       if (goalHorizonteMeses) payload.horizonte_meses = parseInt(goalHorizonteMeses)
       
@@ -437,6 +437,22 @@ export default function CarteiraProjecaoTab({
                   </span>
                 </motion.div>
               </div>
+              {projectGoalsQuery.data.simulacao && (
+                <div className="mt-3 pt-3 border-t border-primary/20 grid grid-cols-1 sm:grid-cols-2 gap-3 text-sm">
+                  <div className="flex items-center justify-between gap-2">
+                    <span>Chance de atingir a meta:</span>
+                    <span className="font-bold text-primary">
+                      {formatPercentage(projectGoalsQuery.data.simulacao.probabilidade_sucesso)}
+                    </span>
+                  </div>
+                  <div className="flex items-center justify-between gap-2">
+                    <span>Aporte para {projectGoalsQuery.data.simulacao.confianca}% de chance:</span>
+                    <span className="font-bold text-primary">
+                      {formatCurrency(projectGoalsQuery.data.simulacao.aporte_necessario)} / mês
+                    </span>
+                  </div>
+                </div>
+              )}
               {(projectGoalsQuery.data as any).taxa_anual_usada && (
                 <div className="mt-3 pt-3 border-t border-primary/20">
                   <div className="flex items-center justify-between text-xs text-muted-foreground">
@@ -1,6 +1,7 @@
-import { useState } from 'react'
+import { useEffect, useMemo, useState } from 'react'
 import { motion } from 'framer-motion'
 import { useQuery } from '@tanstack/react-query'
+import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts'
 import { 
   TrendingUp, 
   TrendingDown, 
@@ -33,6 +34,7 @@ interface CenarioPredefinido {
   descricao: string
   choques: ChoquesIndexadores
   cor: string
+  totais?: { valor_atual: number; valor_simulado: number; variacao: number; variacao_percentual: number }
 }
 
 interface MonteCarloConfig {
@@ -41,6 +43,21 @@ interface MonteCarloConfig {
   confianca: number
 }
 
+interface MonteCarloStream {
+  resultado: any
+  feitas: number
+  total: number
+  final: boolean
+}
+
+const PERCENTIS_FAIXAS = [
+  { chave: 'p95', cor: '#16a34a', nome: 'P95' },
+  { chave: 'p75', cor: '#4ade80', nome: 'P75' },
+  { chave: 'p50', cor: '#2563eb', nome: 'Mediana' },
+  { chave: 'p25', cor: '#fb923c', nome: 'P25' },
+  { chave: 'p5', cor: '#dc2626', nome: 'P5' },
+]
+
 
 const CENARIOS_PREDEFINIDOS: CenarioPredefinido[] = [
   {
@@ -96,23 +113,62 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
     retry: 1
   })
 
-  // Query para cenários pré-definidos
+  // Cenários pré-definidos já avaliados (totais de todos numa chamada)
   const { data: cenariosData } = useQuery({
-    queryKey: ['cenarios-predefinidos'],
-    queryFn: simuladorService.obterCenarios,
+    queryKey: ['cenarios-predefinidos', carteira.length],
+    queryFn: () => simuladorService.avaliarCenarios(),
+    enabled: carteira.length > 0,
     staleTime: 300000, // 5 minutos
     retry: 1
   })
 
-  // Query para Monte Carlo
-  const { data: monteCarloResultado, isLoading: loadingMonteCarlo } = useQuery({
-    queryKey: ['monte-carlo', monteCarloConfig.nSimulacoes, monteCarloConfig.periodoAnos],
+  // Monte Carlo progressivo (SSE): percentis parciais após 1k, 10k e 100k trajetórias
+  const [monteCarloStream, setMonteCarloStream] = useState<MonteCarloStream | null>(null)
+  const [monteCarloFallback, setMonteCarloFallback] = useState(false)
+  const monteCarloAtivo = carteira.length > 0 && secaoAtiva === 'monte-carlo'
+
+  useEffect(() => {
+    setMonteCarloStream(null)
+    setMonteCarloFallback(false)
+    if (!monteCarloAtivo) return
+    if (typeof EventSource === 'undefined') {
+      setMonteCarloFallback(true)
+      return
+    }
+    const fonte = simuladorService.streamMonteCarlo(
+      monteCarloConfig,
+      (parcial) => setMonteCarloStream({ resultado: parcial, feitas: parcial.n_simulacoes, total: parcial.total, final: false }),
+      (resultado) => setMonteCarloStream({ resultado, feitas: resultado.n_simulacoes, total: resultado.n_simulacoes, final: true }),
+      // stream indisponível ou com erro: o POST calcula o resultado completo
+      () => setMonteCarloFallback(true),
+    )
+    return () => fonte.close()
+  }, [monteCarloAtivo, monteCarloConfig.nSimulacoes, monteCarloConfig.periodoAnos, monteCarloConfig.confianca])
+
+  // Fallback: POST (mesmo cache do stream no servidor)
+  const { data: monteCarloPost, isLoading: loadingMonteCarloPost } = useQuery({
+    queryKey: ['monte-carlo', monteCarloConfig.nSimulacoes, monteCarloConfig.periodoAnos, monteCarloConfig.confianca],
     queryFn: () => simuladorService.executarMonteCarlo(monteCarloConfig),
-    enabled: carteira.length > 0 && secaoAtiva === 'monte-carlo',
+    enabled: monteCarloAtivo && monteCarloFallback,
     staleTime: 300000, // 5 minutos
     retry: 1
   })
 
+  const monteCarloResultado = (monteCarloFallback && monteCarloPost) || monteCarloStream?.resultado
+  const loadingMonteCarlo = !monteCarloResultado && (monteCarloFallback ? loadingMonteCarloPost : monteCarloAtivo)
+  const monteCarloRefinando = !monteCarloFallback && monteCarloStream !== null && !monteCarloStream.final
+
+  // Fan chart: faixas de percentis mês a mês
+  const monteCarloFaixas = useMemo(() => {
+    const faixas = monteCarloResultado?.faixas
+    if (!faixas?.meses) return []
+    return faixas.meses.map((mes: number, i: number) => {
+      const ponto: Record<string, number> = { mes }
+      PERCENTIS_FAIXAS.forEach(({ chave }) => { ponto[chave] = faixas[chave]?.[i] })
+      return ponto
+    })
+  }, [monteCarloResultado])
+
   const cenariosPredefinidos = cenariosData?.cenarios || CENARIOS_PREDEFINIDOS
 
   // Usar dados da simulação ou calcular localmente
@@ -198,6 +254,11 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
                 <div>IPCA: {cenario.choques.ipca > 0 ? '+' : ''}{cenario.choques.ipca}%</div>
                 <div>SELIC: {cenario.choques.selic > 0 ? '+' : ''}{cenario.choques.selic}%</div>
               </div>
+              {cenario.totais && (
+                <div className={`mt-2 text-sm font-semibold ${cenario.totais.variacao >= 0 ? 'text-green-600' : 'text-red-600'}`}>
+                  {cenario.totais.variacao_percentual >= 0 ? '+' : ''}{cenario.totais.variacao_percentual.toFixed(2)}%
+                </div>
+              )}
             </div>
           </motion.button>
         ))}
@@ -478,6 +539,26 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
             </div>
           ) : monteCarloResultado && monteCarloResultado.percentis ? (
             <>
+              {monteCarloRefinando && monteCarloStream && (
+                <div className="bg-card border border-border rounded-lg p-4">
+                  <div className="flex items-center justify-between text-sm mb-2">
+                    <span className="flex items-center gap-2">
+                      <RefreshCw className="w-4 h-4 animate-spin" />
+                      Refinando estimativa...
+                    </span>
+                    <span className="text-muted-foreground">
+                      {monteCarloStream.feitas.toLocaleString()} de {monteCarloStream.total.toLocaleString()} trajetórias
+                    </span>
+                  </div>
+                  <div className="w-full h-2 bg-muted rounded-full overflow-hidden">
+                    <div
+                      className="h-full bg-primary transition-all"
+                      style={{ width: `${Math.min(100, (monteCarloStream.feitas / Math.max(1, monteCarloStream.total)) * 100)}%` }}
+                    />
+                  </div>
+                </div>
+              )}
+
               {/* Métricas Principais */}
               <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-4 gap-4">
                 <motion.div
@@ -491,7 +572,7 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
                     <span className="font-medium">Valor Esperado</span>
                   </div>
                   <div className="text-2xl font-bold text-green-600">
-                    {formatCurrency(monteCarloResultado?.valorEsperado || 0)}
+                    {formatCurrency(monteCarloResultado?.valor_esperado || 0)}
                   </div>
                 </motion.div>
 
@@ -527,7 +608,7 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
 
                 <motion.div
                   className={`bg-card border border-border rounded-lg p-4 ${
-                    (monteCarloResultado?.probabilidadePerda || 0) > 20 ? 'border-red-200 bg-red-50' : 'border-green-200 bg-green-50'
+                    (monteCarloResultado?.probabilidade_perda || 0) > 20 ? 'border-red-200 bg-red-50' : 'border-green-200 bg-green-50'
                   }`}
                   initial={{ opacity: 0, y: 20 }}
                   animate={{ opacity: 1, y: 0 }}
@@ -538,9 +619,9 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
                     <span className="font-medium">Prob. de Perda</span>
                   </div>
                   <div className={`text-2xl font-bold ${
-                    (monteCarloResultado?.probabilidadePerda || 0) > 20 ? 'text-red-600' : 'text-green-600'
+                    (monteCarloResultado?.probabilidade_perda || 0) > 20 ? 'text-red-600' : 'text-green-600'
                   }`}>
-                    {(monteCarloResultado?.probabilidadePerda || 0).toFixed(1)}%
+                    {(monteCarloResultado?.probabilidade_perda || 0).toFixed(1)}%
                   </div>
                 </motion.div>
               </div>
@@ -590,18 +671,49 @@ export default function CarteiraSimuladorTab({ carteira }: CarteiraSimuladorTabP
                 </div>
               </div>
 
-              {/* Gráfico de Distribuição */}
+              {/* Faixas de percentis (fan chart), atualizadas a cada etapa */}
               <div className="bg-card border border-border rounded-lg p-6">
                 <h3 className="text-lg font-semibold mb-4 flex items-center gap-2">
                   <BarChart className="w-5 h-5" />
-                  Distribuição de Cenários
+                  Evolução do Patrimônio por Percentil
                 </h3>
-                <div className="h-64 flex items-center justify-center text-muted-foreground">
-                  <div className="text-center">
-                    <BarChart className="w-12 h-12 mx-auto mb-2 opacity-50" />
-                    <p>Gráfico de distribuição será implementado</p>
-                    <p className="text-sm">Mostrará histograma dos {monteCarloConfig.nSimulacoes.toLocaleString()} cenários</p>
-                  </div>
+                <div className="h-64">
+                  <ResponsiveContainer width="100%" height="100%">
+                    <LineChart data={monteCarloFaixas}>
+                      <CartesianGrid strokeDasharray="3 3" stroke="hsl(var(--border))" />
+                      <XAxis
+                        dataKey="mes"
+                        stroke="hsl(var(--muted-foreground))"
+                        tickFormatter={(value) => `${Math.floor(value / 12)}a`}
+                      />
+                      <YAxis
+                        stroke="hsl(var(--muted-foreground))"
+                        tickFormatter={(value) => formatCurrency(value, '')}
+                      />
+                      <Tooltip
+                        contentStyle={{
+                          backgroundColor: 'hsl(var(--card))',
+                          border: '1px solid hsl(var(--border))',
+                          borderRadius: '8px',
+                          color: 'hsl(var(--foreground))'
+                        }}
+                        formatter={(value: any, name: string) => [formatCurrency(value), name]}
+                        labelFormatter={(value) => `Mês ${value}`}
+                      />
+                      {PERCENTIS_FAIXAS.map(({ chave, cor, nome }) => (
+                        <Line
+                          key={chave}
+                          type="monotone"
+                          dataKey={chave}
+                          name={nome}
+                          stroke={cor}
+                          strokeWidth={chave === 'p50' ? 2 : 1}
+                          dot={false}
+                          isAnimationActive={false}
+                        />
+                      ))}
+                    </LineChart>
+                  </ResponsiveContainer>
                 </div>
               </div>
             </>
@@ -23,7 +23,7 @@ import {
 } from 'lucide-react'
 import { useAuth } from '../contexts/AuthContext'
 import { carteiraService } from '../services/api'
-import { AtivoCarteira, Movimentacao } from '../types'
+import { AtivoCarteira, CarteiraStreamEvento, Movimentacao } from '../types'
 import { formatCurrency } from '../utils/formatters'
 import HelpTips from '../components/HelpTips'
 import { normalizeTicker, getDisplayTicker } from '../utils/tickerUtils'
@@ -160,14 +160,43 @@ export default function CarteiraPage() {
   const queryClient = useQueryClient()
 
 
+  // Stream de cotações recusado (503 = limite de streams): volta ao polling
+  const [pollingCarteira, setPollingCarteira] = useState(false)
+
   // Carregamento prioritário - carteira principal
   const { data: carteira, isLoading: loadingCarteira } = useQuery<AtivoCarteira[]>({
     queryKey: ['carteira', user], 
     queryFn: async () => await carteiraService.getCarteira(),
     enabled: !!user, 
     staleTime: 2 * 60 * 1000, // 2 minutos
+    refetchInterval: pollingCarteira ? 60 * 1000 : false,
   })
 
+  // Preços ao vivo via SSE: aplica snapshot e deltas direto no cache da query
+  useEffect(() => {
+    if (!user) return
+    if (typeof EventSource === 'undefined') {
+      setPollingCarteira(true)
+      return
+    }
+    const aplicarPrecos = (evento: CarteiraStreamEvento) => {
+      queryClient.setQueryData<AtivoCarteira[]>(['carteira', user], (atual) => atual?.map((ativo) => {
+        const item = evento.itens[ativo.ticker]
+        if (!item || item.preco_atual == null || item.preco_atual === ativo.preco_atual) return ativo
+        return { ...ativo, preco_atual: item.preco_atual, valor_total: Number(ativo.quantidade || 0) * item.preco_atual }
+      }))
+    }
+    const fonte = carteiraService.streamCarteira(
+      (snapshot) => { setPollingCarteira(false); aplicarPrecos(snapshot) },
+      aplicarPrecos,
+      () => {
+        // erro de rede: o EventSource reconecta sozinho; resposta recusada fecha a conexão
+        if (fonte.readyState === EventSource.CLOSED) setPollingCarteira(true)
+      },
+    )
+    return () => fonte.close()
+  }, [user, queryClient])
+
   const { data: tiposApi } = useQuery({
     queryKey: ['tipos-ativos', user],
     queryFn: carteiraService.getTipos,
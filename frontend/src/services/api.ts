@@ -1,5 +1,5 @@
 import axios from 'axios'
-import { AtivoInfo, AtivoDetalhes, TickerSugestao, AtivoCarteira, Movimentacao, Marmita, GastoMensal, Receita, Cartao, OutroGasto, EvolucaoFinanceira, TotalPorPessoa, ReceitasDespesas, AtivoAnalise, ResumoAnalise, FiltrosAnalise, CartaoCadastrado, CompraCartao } from '../types'
+import { AtivoInfo, AtivoDetalhes, TickerSugestao, TickerBusca, LogosManifest, Job, CarteiraStreamEvento, AtivoCarteira, Movimentacao, Marmita, GastoMensal, Receita, Cartao, OutroGasto, EvolucaoFinanceira, TotalPorPessoa, ReceitasDespesas, AtivoAnalise, ResumoAnalise, FiltrosAnalise, CartaoCadastrado, CompraCartao } from '../types'
 import { normalizeTicker } from '../utils/tickerUtils'
 
 const API_BASE_URL = (typeof import.meta !== 'undefined' && (import.meta as ImportMeta & { env?: any })?.env?.VITE_API_BASE_URL)
@@ -32,6 +32,26 @@ api.interceptors.response.use(
   }
 )
 
+// PDFs são gerados em background: 202 traz o job, que é consultado até ficar pronto
+// (no máximo RELATORIO_MAX_CONSULTAS vezes, com intervalo crescente até 5s)
+const RELATORIO_MAX_CONSULTAS = 120
+
+const baixarRelatorioPDF = async (url: string): Promise<Blob> => {
+  const resp = await api.get(url, { responseType: 'blob' })
+  if (resp.status !== 202) return resp.data as Blob
+  const job = JSON.parse(await (resp.data as Blob).text())
+  let concluido = false
+  for (let tentativa = 0; tentativa < RELATORIO_MAX_CONSULTAS && !concluido; tentativa++) {
+    await new Promise((resolve) => setTimeout(resolve, Math.min(1000 + tentativa * 250, 5000)))
+    const status = await api.get(`/relatorios/jobs/${job.job_id}`)
+    if (status.data.status === 'erro') throw new Error(status.data.erro || 'Falha ao gerar relatório')
+    concluido = status.data.status === 'concluido'
+  }
+  if (!concluido) throw new Error('Tempo esgotado ao gerar relatório')
+  const pdf = await api.get(`/relatorios/jobs/${job.job_id}/download`, { responseType: 'blob' })
+  return pdf.data as Blob
+}
+
 export const ativoService = {
 
   getDetalhes: async (ticker: string): Promise<AtivoDetalhes> => {
@@ -40,9 +60,10 @@ export const ativoService = {
     return response.data
   },
 
-  getHistorico: async (ticker: string, periodo: string = '1y'): Promise<Array<Record<string, any>>> => {
+  getHistorico: async (ticker: string, periodo: string = '1y', points?: number): Promise<Array<Record<string, any>>> => {
     const normalizedTicker = normalizeTicker(ticker)
-    const response = await api.get(`/ativo/${normalizedTicker}/historico?periodo=${periodo}`)
+    const pointsParam = points ? `&points=${points}` : ''
+    const response = await api.get(`/ativo/${normalizedTicker}/historico?periodo=${periodo}${pointsParam}`)
     return response.data
   },
 
@@ -71,9 +92,15 @@ export const ativoService = {
     return response.data
   },
 
+  buscarTickers: async (q: string, limit = 10): Promise<TickerBusca[]> => {
+    const response = await api.get('/tickers/search', { params: { q, limit } })
+    return response.data
+  },
+
 
-  startLoad: async (): Promise<void> => {
-    await api.post('/start_load')
+  startLoad: async (): Promise<Job> => {
+    const response = await api.post('/start_load')
+    return response.data
   },
 
 
@@ -93,6 +120,11 @@ export const ativoService = {
     }
   },
 
+  getLogosManifest: async (): Promise<LogosManifest> => {
+    const response = await api.get('/logos/manifest')
+    return response.data
+  },
+
   getLogosBatch: async (tickers: string[]): Promise<Record<string, string | null>> => {
     try {
       const response = await api.post('/logos', { tickers })
@@ -138,6 +170,20 @@ export const carteiraService = {
     return response.data
   },
 
+  // SSE: snapshot e depois só os ativos cujo preço mudou. O EventSource reconecta sozinho;
+  // onErro recebe o erro quando o servidor recusa (503 = limite de streams, voltar ao polling)
+  streamCarteira: (
+    onSnapshot: (evento: CarteiraStreamEvento) => void,
+    onPrecos: (evento: CarteiraStreamEvento) => void,
+    onErro?: (evento: Event) => void,
+  ): EventSource => {
+    const fonte = new EventSource(`${API_BASE_URL}/carteira/stream`, { withCredentials: true })
+    fonte.addEventListener('snapshot', (e) => onSnapshot(JSON.parse((e as MessageEvent).data)))
+    fonte.addEventListener('precos', (e) => onPrecos(JSON.parse((e as MessageEvent).data)))
+    if (onErro) fonte.onerror = onErro
+    return fonte
+  },
+
   refreshCarteira: async (): Promise<{ success: boolean; updated?: number; errors?: string[]; message?: string }> => {
     const response = await api.post('/carteira/refresh')
     return response.data
@@ -243,6 +289,16 @@ export const carteiraService = {
     return response.data
   },
 
+  getMovimentacoesPaginadas: async (filtros: { limit?: number; cursor?: string | null; ticker?: string; tipo?: string; q?: string; mes?: number; ano?: number; inicio?: string; fim?: string } = {}): Promise<{ items: Movimentacao[]; next_cursor: string | null }> => {
+    const params = new URLSearchParams()
+    params.append('limit', String(filtros.limit ?? 50))
+    Object.entries(filtros).forEach(([chave, valor]) => {
+      if (chave !== 'limit' && valor !== undefined && valor !== null && valor !== '') params.append(chave, String(valor))
+    })
+    const response = await api.get(`/carteira/movimentacoes?${params.toString()}`)
+    return response.data
+  },
+
   // Rebalanceamento
   getRebalanceConfig: async (): Promise<{ periodo?: string; targets?: Record<string, number>; start_date?: string; last_rebalance_date?: string } | {}> => {
     const response = await api.get('/carteira/rebalance/config')
@@ -256,6 +312,20 @@ export const carteiraService = {
     const response = await api.get('/carteira/rebalance/status')
     return response.data
   },
+  // Ordens por ticker (lotes da B3 / fracionário) para um aporte ou rebalanceamento com vendas
+  getRebalanceSugestao: async (payload: { aporte?: number; vender?: boolean; minimo_operacao?: number; fracionario?: boolean; pesos_ativos?: Record<string, number>; targets?: Record<string, number> }): Promise<{
+    modo: 'aporte' | 'rebalanceamento'
+    ordens: Array<{ ticker: string; tipo?: string; acao: 'comprar' | 'vender'; quantidade: number; preco: number; valor: number; lote_padrao?: number; fracionario?: number; ticker_fracionario?: string }>
+    total_compras: number
+    total_vendas: number
+    caixa_restante: number
+    classes_sem_ativos: Record<string, number>
+    distribuicao_atual: Record<string, number>
+    distribuicao_apos: Record<string, number>
+  }> => {
+    const response = await api.post('/carteira/rebalance/sugestao', payload)
+    return response.data
+  },
   getRebalanceHistory: async (): Promise<{ history: string[] }> => {
     const response = await api.get('/carteira/rebalance/history')
     return response.data
@@ -288,7 +358,7 @@ export const carteiraService = {
     const response = await api.post('/goals', payload)
     return response.data
   },
-  projectGoals: async (payload?: { tipo?: 'renda'|'patrimonio'; alvo?: number; horizonte_meses?: number; aporte_mensal?: number; premissas?: any }): Promise<{ capital_alvo: number; aporte_sugerido: number; horizonte_meses: number; saldo_inicial: number; taxa_mensal: number; roadmap: Array<{ mes: number; saldo: number; aporte: number }> }> => {
+  projectGoals: async (payload?: { tipo?: 'renda'|'patrimonio'; alvo?: number; horizonte_meses?: number; aporte_mensal?: number; premissas?: any; simulacao?: { n?: number; confianca?: number; seed?: number; volatilidade_anual?: number; volatilidade_aporte?: number } }): Promise<{ capital_alvo: number; aporte_sugerido: number; horizonte_meses: number; saldo_inicial: number; taxa_mensal: number; roadmap: Array<{ mes: number; saldo: number; aporte: number }>; simulacao?: { n_simulacoes: number; probabilidade_sucesso: number; confianca: number; aporte_necessario: number; aportes_por_confianca: Record<string, number>; saldo_final: Record<string, number>; faixas: Record<string, number[]> } }> => {
     const response = await api.post('/goals/projecao', payload || {})
     return response.data
   },
@@ -319,17 +389,13 @@ export const carteiraService = {
     if (params.inicio) p.append('inicio', params.inicio)
     if (params.fim) p.append('fim', params.fim)
     p.append('formato', 'pdf')
-    const url = `/relatorios/movimentacoes?${p.toString()}`
-    const resp = await api.get(url, { responseType: 'blob' })
-    return resp.data as Blob
+    return baixarRelatorioPDF(`/relatorios/movimentacoes?${p.toString()}`)
   },
   downloadPosicoesPDF: async () => {
-    const resp = await api.get(`/relatorios/posicoes?formato=pdf`, { responseType: 'blob' })
-    return resp.data as Blob
+    return baixarRelatorioPDF(`/relatorios/posicoes?formato=pdf`)
   },
   downloadRendimentosPDF: async (periodo: string = 'mensal') => {
-    const resp = await api.get(`/relatorios/rendimentos?periodo=${periodo}&formato=pdf`, { responseType: 'blob' })
-    return resp.data as Blob
+    return baixarRelatorioPDF(`/relatorios/rendimentos?periodo=${periodo}&formato=pdf`)
   },
 
   getProventos: async (tickers: string[]): Promise<Array<{
@@ -748,10 +814,85 @@ export const simuladorService = {
     return response.data
   },
 
-  executarMonteCarlo: async (config: { nSimulacoes: number; periodoAnos: number; confianca: number }): Promise<any> => {
+  // Todos os cenários numa chamada (sem cenários: os pré-definidos), com totais e variação por ativo
+  avaliarCenarios: async (
+    cenarios?: Array<{ nome?: string; choques: { cdi: number; ipca: number; selic: number } }>,
+    horizonteMeses?: number,
+  ): Promise<any> => {
+    const response = await api.post('/simulador/choques/lote', { cenarios, horizonte_meses: horizonteMeses })
+    return response.data
+  },
+
+  executarMonteCarlo: async (config: { nSimulacoes: number; periodoAnos: number; confianca: number; seed?: number; agrupamento?: 'classe' | 'ativo' }): Promise<any> => {
     const response = await api.post('/simulador/monte-carlo', config)
     return response.data
   },
+
+  // Modo progressivo: onParcial a cada etapa (1k, 10k, 100k trajetórias); fecha o stream no resultado final
+  streamMonteCarlo: (
+    config: { nSimulacoes: number; periodoAnos: number; confianca: number; seed?: number; agrupamento?: 'classe' | 'ativo' },
+    onParcial: (parcial: any) => void,
+    onResultado: (resultado: any) => void,
+    onErro?: (erro: any) => void,
+  ): EventSource => {
+    const p = new URLSearchParams()
+    Object.entries(config).forEach(([k, v]) => { if (v !== undefined && v !== null) p.append(k, String(v)) })
+    const fonte = new EventSource(`${API_BASE_URL}/simulador/monte-carlo/stream?${p.toString()}`, { withCredentials: true })
+    fonte.addEventListener('parcial', (e) => onParcial(JSON.parse((e as MessageEvent).data)))
+    fonte.addEventListener('resultado', (e) => {
+      fonte.close()
+      onResultado(JSON.parse((e as MessageEvent).data))
+    })
+    fonte.addEventListener('erro', (e) => {
+      fonte.close()
+      if (onErro) onErro(JSON.parse((e as MessageEvent).data))
+    })
+    fonte.onerror = (e) => {
+      fonte.close()
+      if (onErro) onErro(e)
+    }
+    return fonte
+  },
 }
 
-export default api 
\ No newline at end of file
+export default api 
+
+export const jobService = {
+  submeter: async (tipo: string, params: Record<string, any> = {}): Promise<Job> => {
+    const response = await api.post('/jobs', { tipo, params })
+    return response.data
+  },
+
+  getStatus: async (id: string): Promise<Job> => {
+    const response = await api.get(`/jobs/${id}`)
+    return response.data
+  },
+
+  getResultado: async <T = any>(id: string): Promise<T> => {
+    const response = await api.get(`/jobs/${id}/resultado`)
+    return response.data
+  },
+
+  cancelar: async (id: string): Promise<Job> => {
+    const response = await api.delete(`/jobs/${id}`)
+    return response.data
+  },
+
+  listar: async (): Promise<Job[]> => {
+    const response = await api.get('/jobs')
+    return response.data
+  },
+
+  // Submete e acompanha o job até terminar; onProgress recebe cada status
+  executar: async <T = any>(tipo: string, params: Record<string, any> = {}, onProgress?: (job: Job) => void): Promise<T> => {
+    let job = await jobService.submeter(tipo, params)
+    while (job.status === 'pendente' || job.status === 'executando') {
+      onProgress?.(job)
+      await new Promise((resolve) => setTimeout(resolve, 1000))
+      job = await jobService.getStatus(job.id)
+    }
+    onProgress?.(job)
+    if (job.status !== 'concluido') throw new Error(job.erro || `Job ${job.status}`)
+    return jobService.getResultado<T>(job.id)
+  },
+}
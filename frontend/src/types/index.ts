@@ -23,6 +23,22 @@ export interface TickerSugestao {
   value: string
 }
 
+export interface TickerBusca {
+  ticker: string
+  nome: string | null
+  tipo: string | null
+  setor: string | null
+  segmento: string | null
+  na_carteira: boolean
+  score: number
+}
+
+export interface LogosManifest {
+  versao: string
+  logos: Record<string, string>
+  crypto: Record<string, string>
+}
+
 export interface HistoricoData {
   Date: string
   Open: number
@@ -263,4 +279,27 @@ export interface CategoriaCompra {
   icone: string
 }
 
- 
\ No newline at end of file
+ 
+
+export interface CarteiraStreamEvento {
+  itens: Record<string, { quantidade?: number; preco_atual: number | null; valor_total: number }>
+  valor_total: number
+  ts: number
+}
+
+export interface Job {
+  id: string
+  tipo: string
+  status: 'pendente' | 'executando' | 'concluido' | 'erro' | 'cancelado'
+  progresso: number
+  mensagem: string | null
+  erro: string | null
+  cancelar: boolean
+  params?: Record<string, any>
+  criado_em: number
+  iniciado_em: number | null
+  concluido_em: number | null
+  atualizado_em: number
+  status_url?: string
+  resultado_url?: string
+}
@@ -1,3 +1,5 @@
+import type { LogosManifest } from '../types'
+
 /**
  
  * @param ticker -
@@ -50,4 +52,19 @@ export function isBrazilianTicker(ticker: string): boolean {
  */
 export function getDisplayTicker(ticker: string): string {
   return removeTickerExtension(ticker)
-} 
\ No newline at end of file
+} 
+
+/**
+ * Resolve a URL da logo de um ticker a partir do manifesto de logos
+ * @param manifest - Manifesto retornado por /api/logos/manifest
+ * @param ticker - O ticker (normalizado ou não)
+ * @returns A URL da logo ou null
+ */
+export function resolveLogoUrl(manifest: LogosManifest | undefined, ticker: string): string | null {
+  if (!manifest || !ticker) return null
+  const normalized = normalizeTicker(ticker)
+  if (normalized.includes('-USD')) {
+    return manifest.crypto[normalized.split('-')[0].toLowerCase()] || null
+  }
+  return manifest.logos[normalized.toLowerCase()] || null
+}